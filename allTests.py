@@ -10,8 +10,13 @@ from cactus.setup.cactus_setupTest import TestCase as setupTest
 from cactus.blast.blastTest import TestCase as blastTest
 from cactus.blast.cactus_coverageTest import TestCase as coverageTest
 from cactus.blast.trimSequencesTest import TestCase as trimSequencesTest
+from cactus.blast.coverageIntervalsTest import TestCase as coverageIntervalsTest
+from cactus.blast.binaryAlignmentsTest import TestCase as binaryAlignmentsTest
 from cactus.pipeline.cactus_workflowTest import TestCase as workflowTest
 from cactus.pipeline.cactus_evolverTest import TestCase as evolverTest
+from cactus.pipeline.ktClientTest import TestCase as ktClientTest
+from cactus.pipeline.snapshotDeltaTest import TestCase as snapshotDeltaTest
+from cactus.pipeline.ktserverControlTest import TestCase as ktserverControlTest
 from cactus.bar.cactus_barTest import TestCase as barTest
 from cactus.phylogeny.cactus_phylogenyTest import TestCase as phylogenyTest
 from cactus.faces.cactus_fillAdjacenciesTest import TestCase as adjacenciesTest
@@ -23,6 +28,9 @@ from cactus.normalisation.cactus_normalisationTest import TestCase as normalisat
 from cactus.progressive.allTests import allSuites as progressiveSuite
 from cactus.shared.commonTest import TestCase as commonTest
 from cactus.shared.experimentWrapperTest import TestCase as experimentWrapperTest
+from cactus.shared.configWrapperTest import TestCase as configWrapperTest
+from cactus.shared.fastaIndexTest import TestCase as fastaIndexTest
+from cactus.shared.readCacheTest import TestCase as readCacheTest
 from cactus.faces.cactus_fillAdjacenciesTest import TestCase as fillAdjacenciesTest
 from cactus.preprocessor.allTests import allSuites as preprocessorTest
 from cactus.preprocessor.lastzRepeatMasking.cactus_lastzRepeatMaskTest import TestCase as lastzRepeatMaskTest
@@ -44,7 +52,15 @@ def allSuites():
                         halTest,
                         coverageTest,
                         trimSequencesTest,
+                        coverageIntervalsTest,
+                        binaryAlignmentsTest,
                         experimentWrapperTest,
+                        configWrapperTest,
+                        fastaIndexTest,
+                        readCacheTest,
+                        ktClientTest,
+                        snapshotDeltaTest,
+                        ktserverControlTest,
                         fillAdjacenciesTest,
                         commonTest]] + 
                         [progressiveSuite()])
@@ -0,0 +1,426 @@
+/*
+ * Released under the MIT license, see LICENSE.txt
+ */
+
+#include <zlib.h>
+#include "cactusGlobalsPrivate.h"
+#include "pairwiseAlignment.h"
+
+#define BINARY_ALIGNMENTS_MAGIC "CACTUSALN\x01"
+#define BINARY_ALIGNMENTS_MAGIC_LENGTH 10
+#define BINARY_ALIGNMENTS_BLOCK_SIZE 10000
+// The flags byte of each alignment.
+#define BINARY_ALIGNMENTS_STRAND1 1
+#define BINARY_ALIGNMENTS_STRAND2 2
+#define BINARY_ALIGNMENTS_FLOAT_SCORE 4
+
+/*
+ * Growable byte buffers, used for the columns of a block.
+ */
+
+typedef struct _byteBuffer {
+    uint8_t *data;
+    int64_t length;
+    int64_t maxLength;
+} ByteBuffer;
+
+static void byteBuffer_append(ByteBuffer *buffer, const void *data, int64_t length) {
+    if (buffer->length + length > buffer->maxLength) {
+        buffer->maxLength = 2 * (buffer->length + length);
+        buffer->data = st_realloc(buffer->data, buffer->maxLength);
+    }
+    memcpy(buffer->data + buffer->length, data, length);
+    buffer->length += length;
+}
+
+static void byteBuffer_appendByte(ByteBuffer *buffer, uint8_t byte) {
+    byteBuffer_append(buffer, &byte, 1);
+}
+
+static void byteBuffer_appendVarint(ByteBuffer *buffer, uint64_t value) {
+    while (value >= 0x80) {
+        byteBuffer_appendByte(buffer, (value & 0x7f) | 0x80);
+        value >>= 7;
+    }
+    byteBuffer_appendByte(buffer, value);
+}
+
+static void byteBuffer_appendLittleEndian(ByteBuffer *buffer, uint64_t value, int64_t bytes) {
+    for (int64_t i = 0; i < bytes; i++) {
+        byteBuffer_appendByte(buffer, (value >> (8 * i)) & 0xff);
+    }
+}
+
+static uint64_t zigzag(int64_t value) {
+    return ((uint64_t) value << 1) ^ (uint64_t) (value >> 63);
+}
+
+static int64_t unzigzag(uint64_t value) {
+    return (int64_t) (value >> 1) ^ -(int64_t) (value & 1);
+}
+
+static int64_t opTypeToCode(int64_t opType) {
+    switch (opType) {
+    case PAIRWISE_MATCH:
+        return 0;
+    case PAIRWISE_INDEL_X:
+        return 1;
+    case PAIRWISE_INDEL_Y:
+        return 2;
+    default:
+        st_errAbort("Unknown alignment operation type %" PRIi64, opType);
+        return -1;
+    }
+}
+
+static int64_t codeToOpType(int64_t code) {
+    switch (code) {
+    case 0:
+        return PAIRWISE_MATCH;
+    case 1:
+        return PAIRWISE_INDEL_X;
+    case 2:
+        return PAIRWISE_INDEL_Y;
+    default:
+        st_errAbort("Corrupt binary alignment file: unknown operation code %" PRIi64, code);
+        return -1;
+    }
+}
+
+/*
+ * Writing. The alignments of a block are encoded into their columns as they are added,
+ * and the columns are joined and compressed once the block is full.
+ */
+
+enum {
+    COLUMN_CONTIG1,
+    COLUMN_CONTIG2,
+    COLUMN_START1,
+    COLUMN_LENGTH1,
+    COLUMN_START2,
+    COLUMN_LENGTH2,
+    COLUMN_FLAGS,
+    COLUMN_SCORE,
+    COLUMN_OPERATION_NUMBER,
+    COLUMN_OPERATION_TYPES,
+    COLUMN_OPERATION_LENGTHS,
+    COLUMN_NUMBER
+};
+
+struct _binaryAlignmentWriter {
+    FILE *fileHandle;
+    stHash *contigIDs;
+    int64_t newContigNumber;
+    ByteBuffer newContigs;
+    int64_t blockLength;
+    ByteBuffer columns[COLUMN_NUMBER];
+};
+
+BinaryAlignmentWriter *binaryAlignmentWriter_construct(FILE *fileHandle) {
+    BinaryAlignmentWriter *writer = st_calloc(1, sizeof(BinaryAlignmentWriter));
+    writer->fileHandle = fileHandle;
+    writer->contigIDs = stHash_construct3(stHash_stringKey, stHash_stringEqualKey, free, free);
+    fwrite(BINARY_ALIGNMENTS_MAGIC, 1, BINARY_ALIGNMENTS_MAGIC_LENGTH, fileHandle);
+    return writer;
+}
+
+static void binaryAlignmentWriter_flush(BinaryAlignmentWriter *writer) {
+    if (writer->blockLength == 0) {
+        return;
+    }
+    ByteBuffer data = { NULL, 0, 0 };
+    byteBuffer_appendVarint(&data, writer->newContigNumber);
+    byteBuffer_append(&data, writer->newContigs.data, writer->newContigs.length);
+    byteBuffer_appendVarint(&data, writer->blockLength);
+    for (int64_t i = 0; i < COLUMN_NUMBER; i++) {
+        byteBuffer_append(&data, writer->columns[i].data, writer->columns[i].length);
+        writer->columns[i].length = 0;
+    }
+    uLongf compressedLength = compressBound(data.length);
+    uint8_t *compressed = st_malloc(compressedLength);
+    if (compress2(compressed, &compressedLength, data.data, data.length, Z_DEFAULT_COMPRESSION) != Z_OK) {
+        st_errAbort("Failed to compress a block of binary alignments");
+    }
+    ByteBuffer header = { NULL, 0, 0 };
+    byteBuffer_appendLittleEndian(&header, compressedLength, 4);
+    byteBuffer_appendLittleEndian(&header, data.length, 4);
+    if (fwrite(header.data, 1, header.length, writer->fileHandle) != (size_t) header.length
+            || fwrite(compressed, 1, compressedLength, writer->fileHandle) != (size_t) compressedLength) {
+        st_errnoAbort("Failed to write a block of binary alignments");
+    }
+    free(header.data);
+    free(compressed);
+    free(data.data);
+    writer->newContigNumber = 0;
+    writer->newContigs.length = 0;
+    writer->blockLength = 0;
+}
+
+void binaryAlignmentWriter_destruct(BinaryAlignmentWriter *writer) {
+    binaryAlignmentWriter_flush(writer);
+    stHash_destruct(writer->contigIDs);
+    free(writer->newContigs.data);
+    for (int64_t i = 0; i < COLUMN_NUMBER; i++) {
+        free(writer->columns[i].data);
+    }
+    free(writer);
+}
+
+static int64_t binaryAlignmentWriter_getContigID(BinaryAlignmentWriter *writer, char *contig) {
+    int64_t *contigID = stHash_search(writer->contigIDs, contig);
+    if (contigID == NULL) {
+        contigID = st_malloc(sizeof(int64_t));
+        *contigID = stHash_size(writer->contigIDs);
+        stHash_insert(writer->contigIDs, stString_copy(contig), contigID);
+        byteBuffer_appendVarint(&writer->newContigs, strlen(contig));
+        byteBuffer_append(&writer->newContigs, contig, strlen(contig));
+        writer->newContigNumber++;
+    }
+    return *contigID;
+}
+
+void binaryAlignmentWriter_write(BinaryAlignmentWriter *writer, struct PairwiseAlignment *pA) {
+    ByteBuffer *columns = writer->columns;
+    byteBuffer_appendVarint(&columns[COLUMN_CONTIG1], binaryAlignmentWriter_getContigID(writer, pA->contig1));
+    byteBuffer_appendVarint(&columns[COLUMN_CONTIG2], binaryAlignmentWriter_getContigID(writer, pA->contig2));
+    byteBuffer_appendVarint(&columns[COLUMN_START1], pA->start1);
+    byteBuffer_appendVarint(&columns[COLUMN_LENGTH1], zigzag(pA->end1 - pA->start1));
+    byteBuffer_appendVarint(&columns[COLUMN_START2], pA->start2);
+    byteBuffer_appendVarint(&columns[COLUMN_LENGTH2], zigzag(pA->end2 - pA->start2));
+    // Scores are always written as doubles, which is what cigarRead gives.
+    byteBuffer_appendByte(&columns[COLUMN_FLAGS], (pA->strand1 ? BINARY_ALIGNMENTS_STRAND1 : 0)
+            | (pA->strand2 ? BINARY_ALIGNMENTS_STRAND2 : 0) | BINARY_ALIGNMENTS_FLOAT_SCORE);
+    uint64_t score;
+    memcpy(&score, &pA->score, sizeof(double));
+    byteBuffer_appendLittleEndian(&columns[COLUMN_SCORE], score, 8);
+    struct List *operations = pA->operationList;
+    byteBuffer_appendVarint(&columns[COLUMN_OPERATION_NUMBER], operations->length);
+    for (int64_t i = 0; i < operations->length; i += 4) {
+        uint8_t packed = 0;
+        for (int64_t j = 0; j < 4 && i + j < operations->length; j++) {
+            struct AlignmentOperation *op = operations->list[i + j];
+            packed |= opTypeToCode(op->opType) << (2 * j);
+        }
+        byteBuffer_appendByte(&columns[COLUMN_OPERATION_TYPES], packed);
+    }
+    for (int64_t i = 0; i < operations->length; i++) {
+        struct AlignmentOperation *op = operations->list[i];
+        byteBuffer_appendVarint(&columns[COLUMN_OPERATION_LENGTHS], op->length);
+    }
+    if (++writer->blockLength >= BINARY_ALIGNMENTS_BLOCK_SIZE) {
+        binaryAlignmentWriter_flush(writer);
+    }
+}
+
+/*
+ * Reading. A block is decoded in one go and its alignments are then handed out in order.
+ */
+
+struct _alignmentReader {
+    FILE *fileHandle;
+    bool isBinary;
+    stList *contigs;
+    stList *block;
+    int64_t blockIndex;
+};
+
+typedef struct _blockCursor {
+    uint8_t *data;
+    int64_t offset;
+    int64_t length;
+} BlockCursor;
+
+static uint8_t blockCursor_getByte(BlockCursor *cursor) {
+    if (cursor->offset >= cursor->length) {
+        st_errAbort("Corrupt binary alignment file: block ends early");
+    }
+    return cursor->data[cursor->offset++];
+}
+
+static uint64_t blockCursor_getVarint(BlockCursor *cursor) {
+    uint64_t value = 0;
+    for (int64_t shift = 0;; shift += 7) {
+        uint8_t byte = blockCursor_getByte(cursor);
+        value |= (uint64_t) (byte & 0x7f) << shift;
+        if (byte < 0x80) {
+            return value;
+        }
+    }
+}
+
+static uint64_t blockCursor_getLittleEndian(BlockCursor *cursor, int64_t bytes) {
+    uint64_t value = 0;
+    for (int64_t i = 0; i < bytes; i++) {
+        value |= (uint64_t) blockCursor_getByte(cursor) << (8 * i);
+    }
+    return value;
+}
+
+static int64_t *blockCursor_getVarints(BlockCursor *cursor, int64_t length) {
+    int64_t *values = st_malloc(length * sizeof(int64_t));
+    for (int64_t i = 0; i < length; i++) {
+        values[i] = blockCursor_getVarint(cursor);
+    }
+    return values;
+}
+
+static uint64_t readLittleEndian(uint8_t *bytes, int64_t length) {
+    uint64_t value = 0;
+    for (int64_t i = 0; i < length; i++) {
+        value |= (uint64_t) bytes[i] << (8 * i);
+    }
+    return value;
+}
+
+static void alignmentReader_clearBlock(AlignmentReader *reader) {
+    for (int64_t i = reader->blockIndex; i < stList_length(reader->block); i++) {
+        destructPairwiseAlignment(stList_get(reader->block, i));
+    }
+    stList_destruct(reader->block);
+    reader->block = stList_construct();
+    reader->blockIndex = 0;
+}
+
+/*
+ * Decodes the next block into reader->block, returning false at the end of the file.
+ */
+static bool alignmentReader_readBlock(AlignmentReader *reader) {
+    uint8_t header[8];
+    size_t headerLength = fread(header, 1, 8, reader->fileHandle);
+    if (headerLength == 0) {
+        return 0;
+    }
+    if (headerLength < 8) {
+        st_errAbort("Truncated binary alignment file");
+    }
+    uLongf compressedLength = readLittleEndian(header, 4);
+    uLongf length = readLittleEndian(header + 4, 4);
+    uint8_t *compressed = st_malloc(compressedLength);
+    if (fread(compressed, 1, compressedLength, reader->fileHandle) != compressedLength) {
+        st_errAbort("Truncated binary alignment file");
+    }
+    BlockCursor cursor = { st_malloc(length + 1), 0, length };
+    if (uncompress(cursor.data, &length, compressed, compressedLength) != Z_OK || (int64_t) length != cursor.length) {
+        st_errAbort("Corrupt binary alignment file: a block failed to decompress");
+    }
+    free(compressed);
+
+    int64_t newContigNumber = blockCursor_getVarint(&cursor);
+    for (int64_t i = 0; i < newContigNumber; i++) {
+        int64_t contigLength = blockCursor_getVarint(&cursor);
+        if (cursor.offset + contigLength > cursor.length) {
+            st_errAbort("Corrupt binary alignment file: block ends early");
+        }
+        stList_append(reader->contigs, stString_getSubString((char *) cursor.data, cursor.offset, contigLength));
+        cursor.offset += contigLength;
+    }
+    int64_t blockLength = blockCursor_getVarint(&cursor);
+    int64_t *contigs1 = blockCursor_getVarints(&cursor, blockLength);
+    int64_t *contigs2 = blockCursor_getVarints(&cursor, blockLength);
+    int64_t *starts1 = blockCursor_getVarints(&cursor, blockLength);
+    int64_t *lengths1 = blockCursor_getVarints(&cursor, blockLength);
+    int64_t *starts2 = blockCursor_getVarints(&cursor, blockLength);
+    int64_t *lengths2 = blockCursor_getVarints(&cursor, blockLength);
+    uint8_t *flags = st_malloc(blockLength + 1);
+    for (int64_t i = 0; i < blockLength; i++) {
+        flags[i] = blockCursor_getByte(&cursor);
+    }
+    double *scores = st_malloc(blockLength * sizeof(double) + 1);
+    for (int64_t i = 0; i < blockLength; i++) {
+        if (flags[i] & BINARY_ALIGNMENTS_FLOAT_SCORE) {
+            uint64_t score = blockCursor_getLittleEndian(&cursor, 8);
+            memcpy(&scores[i], &score, sizeof(double));
+        } else {
+            scores[i] = unzigzag(blockCursor_getVarint(&cursor));
+        }
+    }
+    int64_t *operationNumbers = blockCursor_getVarints(&cursor, blockLength);
+    stList *operationLists = stList_construct();
+    for (int64_t i = 0; i < blockLength; i++) {
+        struct List *operations = constructEmptyList(0, (void (*)(void *)) destructAlignmentOperation);
+        for (int64_t j = 0; j < operationNumbers[i]; j += 4) {
+            uint8_t packed = blockCursor_getByte(&cursor);
+            for (int64_t k = 0; k < 4 && j + k < operationNumbers[i]; k++) {
+                listAppend(operations, constructAlignmentOperation(codeToOpType((packed >> (2 * k)) & 3), 0, 0.0));
+            }
+        }
+        stList_append(operationLists, operations);
+    }
+    for (int64_t i = 0; i < blockLength; i++) {
+        struct List *operations = stList_get(operationLists, i);
+        for (int64_t j = 0; j < operations->length; j++) {
+            ((struct AlignmentOperation *) operations->list[j])->length = blockCursor_getVarint(&cursor);
+        }
+        if (contigs1[i] >= stList_length(reader->contigs) || contigs2[i] >= stList_length(reader->contigs)) {
+            st_errAbort("Corrupt binary alignment file: unknown contig");
+        }
+        stList_append(reader->block, constructPairwiseAlignment(stList_get(reader->contigs, contigs1[i]),
+                starts1[i], starts1[i] + unzigzag(lengths1[i]), (flags[i] & BINARY_ALIGNMENTS_STRAND1) != 0,
+                stList_get(reader->contigs, contigs2[i]),
+                starts2[i], starts2[i] + unzigzag(lengths2[i]), (flags[i] & BINARY_ALIGNMENTS_STRAND2) != 0,
+                scores[i], operations));
+    }
+    stList_destruct(operationLists);
+    free(contigs1);
+    free(contigs2);
+    free(starts1);
+    free(lengths1);
+    free(starts2);
+    free(lengths2);
+    free(flags);
+    free(scores);
+    free(operationNumbers);
+    free(cursor.data);
+    reader->blockIndex = 0;
+    return 1;
+}
+
+AlignmentReader *alignmentReader_construct(FILE *fileHandle) {
+    if (fileHandle == NULL) {
+        st_errAbort("Tried to read alignments from a file that could not be opened");
+    }
+    AlignmentReader *reader = st_calloc(1, sizeof(AlignmentReader));
+    reader->fileHandle = fileHandle;
+    reader->contigs = stList_construct3(0, free);
+    reader->block = stList_construct();
+    char magic[BINARY_ALIGNMENTS_MAGIC_LENGTH];
+    reader->isBinary = fread(magic, 1, BINARY_ALIGNMENTS_MAGIC_LENGTH, fileHandle) == BINARY_ALIGNMENTS_MAGIC_LENGTH
+            && memcmp(magic, BINARY_ALIGNMENTS_MAGIC, BINARY_ALIGNMENTS_MAGIC_LENGTH) == 0;
+    if (!reader->isBinary) {
+        fseek(fileHandle, 0, SEEK_SET);
+    }
+    return reader;
+}
+
+void alignmentReader_destruct(AlignmentReader *reader) {
+    alignmentReader_clearBlock(reader);
+    stList_destruct(reader->block);
+    stList_destruct(reader->contigs);
+    fclose(reader->fileHandle);
+    free(reader);
+}
+
+bool alignmentReader_isBinary(AlignmentReader *reader) {
+    return reader->isBinary;
+}
+
+struct PairwiseAlignment *alignmentReader_getNext(AlignmentReader *reader) {
+    if (!reader->isBinary) {
+        return cigarRead(reader->fileHandle);
+    }
+    while (reader->blockIndex >= stList_length(reader->block)) {
+        alignmentReader_clearBlock(reader);
+        if (!alignmentReader_readBlock(reader)) {
+            return NULL;
+        }
+    }
+    return stList_get(reader->block, reader->blockIndex++);
+}
+
+void alignmentReader_reset(AlignmentReader *reader) {
+    alignmentReader_clearBlock(reader);
+    // The contig dictionary is rebuilt as the blocks are read again.
+    stList_destruct(reader->contigs);
+    reader->contigs = stList_construct3(0, free);
+    fseek(reader->fileHandle, reader->isBinary ? BINARY_ALIGNMENTS_MAGIC_LENGTH : 0, SEEK_SET);
+}
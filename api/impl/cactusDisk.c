@@ -15,7 +15,244 @@
 #define CACTUS_DISK_NAME_INCREMENT 16384
 #define CACTUS_DISK_BUCKET_NUMBER 65536
 #define CACTUS_DISK_PARAMETER_KEY -100000
+#define CACTUS_DISK_WRITES_STARTED_KEY -100001
+#define CACTUS_DISK_WRITES_FINISHED_KEY -100002
 #define CACTUS_DISK_SEQUENCE_CHUNK_SIZE 500
+#define CACTUS_DISK_SHARD_RING_POINTS 128
+#define CACTUS_DISK_PREFETCH_BATCH_SIZE 1000
+#define CACTUS_DISK_READ_CACHE_SIZE 100000000
+#define CACTUS_DISK_COMPRESSION_LEVEL -1
+
+/*
+ * Functions to spread the records over the shards of the database. Each shard owns
+ * CACTUS_DISK_SHARD_RING_POINTS points on a ring of hashes, and a key belongs to the shard
+ * with the first point at or after the hash of the key. Every process given the same list of
+ * shards therefore agrees on where each record lives.
+ */
+
+static uint64_t hashKey(uint64_t key) {
+    // The splitmix64 finaliser.
+    key += 0x9E3779B97F4A7C15ULL;
+    key = (key ^ (key >> 30)) * 0xBF58476D1CE4E5B9ULL;
+    key = (key ^ (key >> 27)) * 0x94D049BB133111EBULL;
+    return key ^ (key >> 31);
+}
+
+static int shardRingPoint_cmp(const void *o1, const void *o2) {
+    uint64_t hash1 = ((ShardRingPoint *) o1)->hash;
+    uint64_t hash2 = ((ShardRingPoint *) o2)->hash;
+    return hash1 < hash2 ? -1 : (hash1 > hash2 ? 1 : 0);
+}
+
+static void constructShardRing(CactusDisk *cactusDisk) {
+    int64_t shardNumber = stList_length(cactusDisk->databases);
+    if (shardNumber == 1) {
+        cactusDisk->shardRing = NULL;
+        cactusDisk->shardRingSize = 0;
+        return;
+    }
+    cactusDisk->shardRingSize = shardNumber * CACTUS_DISK_SHARD_RING_POINTS;
+    cactusDisk->shardRing = st_malloc(sizeof(ShardRingPoint) * cactusDisk->shardRingSize);
+    for (int64_t i = 0; i < shardNumber; i++) {
+        for (int64_t j = 0; j < CACTUS_DISK_SHARD_RING_POINTS; j++) {
+            ShardRingPoint *point = &cactusDisk->shardRing[i * CACTUS_DISK_SHARD_RING_POINTS + j];
+            point->hash = hashKey(hashKey(i) + j);
+            point->shard = i;
+        }
+    }
+    qsort(cactusDisk->shardRing, cactusDisk->shardRingSize, sizeof(ShardRingPoint), shardRingPoint_cmp);
+}
+
+static int64_t getShard(CactusDisk *cactusDisk, Name key) {
+    if (cactusDisk->shardRing == NULL) {
+        return 0;
+    }
+    uint64_t hash = hashKey(key);
+    int64_t low = 0, high = cactusDisk->shardRingSize;
+    while (low < high) {
+        int64_t mid = (low + high) / 2;
+        if (cactusDisk->shardRing[mid].hash < hash) {
+            low = mid + 1;
+        } else {
+            high = mid;
+        }
+    }
+    return cactusDisk->shardRing[low == cactusDisk->shardRingSize ? 0 : low].shard;
+}
+
+static stKVDatabase *getDatabase(CactusDisk *cactusDisk, Name key) {
+    return stList_get(cactusDisk->databases, getShard(cactusDisk, key));
+}
+
+/*
+ * Bulk requests are kept as a list of requests for each shard.
+ */
+
+static stList *constructShardLists(CactusDisk *cactusDisk, void (*destructElement)(void *)) {
+    stList *shardLists = stList_construct3(0, (void (*)(void *)) stList_destruct);
+    for (int64_t i = 0; i < stList_length(cactusDisk->databases); i++) {
+        stList_append(shardLists, stList_construct3(0, destructElement));
+    }
+    return shardLists;
+}
+
+static void shardLists_append(CactusDisk *cactusDisk, stList *shardLists, Name key, void *item) {
+    stList_append(stList_get(shardLists, getShard(cactusDisk, key)), item);
+}
+
+static int64_t shardLists_length(stList *shardLists) {
+    int64_t length = 0;
+    for (int64_t i = 0; i < stList_length(shardLists); i++) {
+        length += stList_length(stList_get(shardLists, i));
+    }
+    return length;
+}
+
+static void bulkSetRecords(CactusDisk *cactusDisk, stList *shardRequests) {
+    for (int64_t i = 0; i < stList_length(shardRequests); i++) {
+        stList *requests = stList_get(shardRequests, i);
+        if (stList_length(requests) > 0) {
+            stKVDatabase_bulkSetRecords(stList_get(cactusDisk->databases, i), requests);
+        }
+    }
+}
+
+static void bulkRemoveRecords(CactusDisk *cactusDisk, stList *shardRemoveRequests) {
+    for (int64_t i = 0; i < stList_length(shardRemoveRequests); i++) {
+        stList *removeRequests = stList_get(shardRemoveRequests, i);
+        if (stList_length(removeRequests) > 0) {
+            stKVDatabase_bulkRemoveRecords(stList_get(cactusDisk->databases, i), removeRequests);
+        }
+    }
+}
+
+static stList *bulkGetRecords(CactusDisk *cactusDisk, stList *keys) {
+    /*
+     * Gets the records for a list of int64_t keys, as a list of bulk results in the same order.
+     */
+    if (cactusDisk->shardRing == NULL) {
+        return stKVDatabase_bulkGetRecords(stList_get(cactusDisk->databases, 0), keys);
+    }
+    int64_t *shards = st_malloc(sizeof(int64_t) * stList_length(keys));
+    stList *shardKeys = constructShardLists(cactusDisk, NULL);
+    for (int64_t i = 0; i < stList_length(keys); i++) {
+        int64_t *key = stList_get(keys, i);
+        shards[i] = getShard(cactusDisk, *key);
+        stList_append(stList_get(shardKeys, shards[i]), key);
+    }
+    stList *records = stList_construct3(stList_length(keys), (void (*)(void *)) stKVDatabaseBulkResult_destruct);
+    for (int64_t i = 0; i < stList_length(shardKeys); i++) {
+        stList *keys2 = stList_get(shardKeys, i);
+        if (stList_length(keys2) == 0) {
+            continue;
+        }
+        stList *records2 = stKVDatabase_bulkGetRecords(stList_get(cactusDisk->databases, i), keys2);
+        assert(stList_length(records2) == stList_length(keys2));
+        // Put the results back in the order of the keys.
+        int64_t k = 0;
+        for (int64_t j = 0; j < stList_length(keys); j++) {
+            if (shards[j] == i) {
+                stList_set(records, j, stList_get(records2, k++));
+            }
+        }
+        stList_setDestructor(records2, NULL);
+        stList_destruct(records2);
+    }
+    stList_destruct(shardKeys);
+    free(shards);
+    return records;
+}
+
+/*
+ * Functions to read the shards from the database conf string.
+ */
+
+static char *getXmlAttribute(const char *tag, const char *attribute) {
+    /*
+     * Gets the value of an attribute in the tag starting at the given position, or NULL if the tag
+     * doesn't have it.
+     */
+    const char *tagEnd = strchr(tag, '>');
+    char *pattern = stString_print(" %s=\"", attribute);
+    const char *start = strstr(tag, pattern);
+    char *value = NULL;
+    if (start != NULL && (tagEnd == NULL || start < tagEnd)) {
+        start += strlen(pattern);
+        const char *end = strchr(start, '"');
+        if (end == NULL) {
+            stThrowNew(CACTUS_DISK_EXCEPTION_ID, "Unterminated attribute %s in the database conf", attribute);
+        }
+        value = stString_getSubString(start, 0, end - start);
+    }
+    free(pattern);
+    return value;
+}
+
+static char *setXmlAttribute(const char *xml, const char *tag, const char *attribute, const char *value) {
+    /*
+     * Returns a copy of the xml in which the given attribute of the first tag of the given name is
+     * set to value.
+     */
+    char *tagPattern = stString_print("<%s ", tag);
+    const char *tagStart = strstr(xml, tagPattern);
+    free(tagPattern);
+    char *oldValue = tagStart != NULL ? getXmlAttribute(tagStart, attribute) : NULL;
+    if (oldValue == NULL) {
+        stThrowNew(CACTUS_DISK_EXCEPTION_ID, "The database conf has no %s tag with a %s attribute", tag, attribute);
+    }
+    char *pattern = stString_print(" %s=\"", attribute);
+    const char *start = strstr(tagStart, pattern) + strlen(pattern);
+    char *prefix = stString_getSubString(xml, 0, start - xml);
+    char *newXml = stString_print("%s%s%s", prefix, value, start + strlen(oldValue));
+    free(prefix);
+    free(pattern);
+    free(oldValue);
+    return newXml;
+}
+
+static stList *getShardConfStrings(const char *confString) {
+    /*
+     * Splits a database conf listing several shards into a conf string for each shard.
+     */
+    stList *confStrings = stList_construct3(0, free);
+    stList_append(confStrings, stString_copy(confString));
+    const char *shardTag = confString;
+    while ((shardTag = strstr(shardTag, "<kyoto_tycoon_shard ")) != NULL) {
+        char *host = getXmlAttribute(shardTag, "host");
+        char *port = getXmlAttribute(shardTag, "port");
+        if (host == NULL || port == NULL) {
+            stThrowNew(CACTUS_DISK_EXCEPTION_ID, "A kyoto_tycoon_shard tag is missing its host or port: %s",
+                       confString);
+        }
+        char *confString2 = setXmlAttribute(confString, "kyoto_tycoon", "host", host);
+        char *confString3 = setXmlAttribute(confString2, "kyoto_tycoon", "port", port);
+        stList_append(confStrings, confString3);
+        free(confString2);
+        free(host);
+        free(port);
+        shardTag++;
+    }
+    return confStrings;
+}
+
+static int64_t getConfParameter(const char *confString, const char *attribute, int64_t defaultValue) {
+    /*
+     * Gets an integer attribute of the st_kv_database_conf tag, or the default if it isn't set.
+     */
+    const char *tag = confString != NULL ? strstr(confString, "<st_kv_database_conf ") : NULL;
+    char *value = tag != NULL ? getXmlAttribute(tag, attribute) : NULL;
+    if (value == NULL) {
+        return defaultValue;
+    }
+    int64_t i;
+    if (sscanf(value, "%" SCNi64, &i) != 1) {
+        stThrowNew(CACTUS_DISK_EXCEPTION_ID, "The %s attribute of the database conf is not an integer: %s",
+                   attribute, value);
+    }
+    free(value);
+    return i;
+}
+
 
 /*
  * Functions on meta sequences.
@@ -42,18 +279,19 @@ Name cactusDisk_addString(CactusDisk *cactusDisk, const char *string) {
     int64_t stringSize = strlen(string);
     int64_t intervalSize = ceil((double) stringSize / CACTUS_DISK_SEQUENCE_CHUNK_SIZE);
     Name name = cactusDisk_getUniqueIDInterval(cactusDisk, intervalSize);
-    stList *insertRequests = stList_construct3(0, (void (*)(void *)) stKVDatabaseBulkRequest_destruct);
+    stList *insertRequests = constructShardLists(cactusDisk, (void (*)(void *)) stKVDatabaseBulkRequest_destruct);
     for (int64_t i = 0; i * CACTUS_DISK_SEQUENCE_CHUNK_SIZE < stringSize; i++) {
         int64_t j =
             (i + 1) * CACTUS_DISK_SEQUENCE_CHUNK_SIZE < stringSize ?
             CACTUS_DISK_SEQUENCE_CHUNK_SIZE : stringSize - i * CACTUS_DISK_SEQUENCE_CHUNK_SIZE;
         char *subString = stString_getSubString(string, i * CACTUS_DISK_SEQUENCE_CHUNK_SIZE, j);
-        stList_append(insertRequests, stKVDatabaseBulkRequest_constructInsertRequest(name + i, subString, j + 1));
+        shardLists_append(cactusDisk, insertRequests, name + i,
+                          stKVDatabaseBulkRequest_constructInsertRequest(name + i, subString, j + 1));
         free(subString);
     }
     stTry
     {
-        stKVDatabase_bulkSetRecords(cactusDisk->database, insertRequests);
+        bulkSetRecords(cactusDisk, insertRequests);
     }
     stCatch(except)
     {
@@ -163,7 +401,7 @@ static void cacheSubstringsFromDB(CactusDisk *cactusDisk, stList *substrings) {
     stList *records = NULL;
     stTry
     {
-        records = stKVDatabase_bulkGetRecords(cactusDisk->database, getRequests);
+        records = bulkGetRecords(cactusDisk, getRequests);
     }
     stCatch(except)
     {
@@ -399,10 +637,10 @@ static void cactusDisk_loadFromBinaryRepresentation(void **binaryString, CactusD
  * The following two functions compress and decompress the data in the cactus disk..
  */
 
-static void *compress(void *data, int64_t *dataSize) {
+static void *compress(CactusDisk *cactusDisk, void *data, int64_t *dataSize) {
     //Compression
     int64_t compressedSize;
-    void *data2 = stCompression_compress(data, *dataSize, &compressedSize, -1);
+    void *data2 = stCompression_compress(data, *dataSize, &compressedSize, cactusDisk->compressionLevel);
     free(data);
     *dataSize = compressedSize;
     return data2;
@@ -416,60 +654,196 @@ static void *decompress(void *data, int64_t *dataSize) {
     return data2;
 }
 
-static stList *getRecords(CactusDisk *cactusDisk, stList *objectNames, char *type) {
-    if (stList_length(objectNames) == 0) {
-        return stList_construct3(0, NULL);
+/*
+ * Functions on the read cache, which holds prefetched records, least recently used first out.
+ */
+
+static int readCacheEntry_cmp(const void *o1, const void *o2) {
+    return cactusMisc_nameCompare(((ReadCacheEntry *) o1)->name, ((ReadCacheEntry *) o2)->name);
+}
+
+static ReadCacheEntry *readCache_get(CactusDisk *cactusDisk, Name name) {
+    static ReadCacheEntry entry;
+    entry.name = name;
+    return stSortedSet_search(cactusDisk->readCache, &entry);
+}
+
+static void readCache_unlink(CactusDisk *cactusDisk, ReadCacheEntry *entry) {
+    if (entry->previous != NULL) {
+        entry->previous->next = entry->next;
+    } else {
+        cactusDisk->readCacheHead = entry->next;
     }
-    stList *records = NULL;
-    stTry
-        {
-            records = stKVDatabase_bulkGetRecords(cactusDisk->database, objectNames);
+    if (entry->next != NULL) {
+        entry->next->previous = entry->previous;
+    } else {
+        cactusDisk->readCacheTail = entry->previous;
+    }
+    entry->previous = NULL;
+    entry->next = NULL;
+}
+
+static void readCache_pushFront(CactusDisk *cactusDisk, ReadCacheEntry *entry) {
+    entry->next = cactusDisk->readCacheHead;
+    if (cactusDisk->readCacheHead != NULL) {
+        cactusDisk->readCacheHead->previous = entry;
+    } else {
+        cactusDisk->readCacheTail = entry;
+    }
+    cactusDisk->readCacheHead = entry;
+}
+
+static void readCache_remove(CactusDisk *cactusDisk, ReadCacheEntry *entry) {
+    readCache_unlink(cactusDisk, entry);
+    stSortedSet_remove(cactusDisk->readCache, entry);
+    cactusDisk->readCacheSize -= entry->size;
+    free(entry->record);
+    free(entry);
+}
+
+static void readCache_insert(CactusDisk *cactusDisk, Name name, const void *record, int64_t size) {
+    if (size > CACTUS_DISK_READ_CACHE_SIZE) {
+        return;
+    }
+    ReadCacheEntry *entry = readCache_get(cactusDisk, name);
+    if (entry != NULL) {
+        readCache_remove(cactusDisk, entry);
+    }
+    entry = st_calloc(1, sizeof(ReadCacheEntry));
+    entry->name = name;
+    entry->record = st_malloc(size);
+    memcpy(entry->record, record, size);
+    entry->size = size;
+    stSortedSet_insert(cactusDisk->readCache, entry);
+    readCache_pushFront(cactusDisk, entry);
+    cactusDisk->readCacheSize += size;
+    while (cactusDisk->readCacheSize > CACTUS_DISK_READ_CACHE_SIZE) {
+        readCache_remove(cactusDisk, cactusDisk->readCacheTail);
+        cactusDisk->evictedRecords++;
+    }
+}
+
+static void readCache_clear(CactusDisk *cactusDisk) {
+    while (cactusDisk->readCacheHead != NULL) {
+        readCache_remove(cactusDisk, cactusDisk->readCacheHead);
+    }
+}
+
+static bool isCached(CactusDisk *cactusDisk, Name objectName) {
+    return (cactusDisk->cache != NULL && stCache_containsRecord(cactusDisk->cache, objectName, 0, INT64_MAX))
+        || readCache_get(cactusDisk, objectName) != NULL;
+}
+
+static void *getCachedRecord(CactusDisk *cactusDisk, Name objectName, int64_t *recordSize) {
+    /*
+     * Gets a copy of the uncompressed record from the caches, or NULL if it isn't cached.
+     */
+    if (cactusDisk->cache != NULL && stCache_containsRecord(cactusDisk->cache, objectName, 0, INT64_MAX)) {
+        return stCache_getRecord(cactusDisk->cache, objectName, 0, INT64_MAX, recordSize);
+    }
+    ReadCacheEntry *entry = readCache_get(cactusDisk, objectName);
+    if (entry == NULL) {
+        return NULL;
+    }
+    *recordSize = entry->size;
+    void *record = decompress(entry->record, recordSize);
+    if (cactusDisk->cache != NULL) {
+        // From now on the general cache has it.
+        stCache_setRecord(cactusDisk->cache, objectName, 0, *recordSize, record);
+        readCache_remove(cactusDisk, entry);
+    } else {
+        readCache_unlink(cactusDisk, entry);
+        readCache_pushFront(cactusDisk, entry);
+    }
+    return record;
+}
+
+static void prefetchRecords(CactusDisk *cactusDisk, stList *objectNames, char *type) {
+    /*
+     * Puts the records for the given names that aren't already cached into the read cache, with
+     * one bulk get.
+     */
+    stList *missingNames = stList_construct();
+    for (int64_t i = 0; i < stList_length(objectNames); i++) {
+        int64_t *objectName = stList_get(objectNames, i);
+        if (!isCached(cactusDisk, *objectName)) {
+            stList_append(missingNames, objectName);
         }
-        stCatch(except)
+    }
+    if (stList_length(missingNames) > 0) {
+        stList *results = NULL;
+        stTry
             {
-                stThrowNewCause(except, ST_KV_DATABASE_EXCEPTION_ID,
-                        "An unknown database error occurred when getting a bulk set of %s", type);
-            }stTryEnd
-    ;
-    assert(records != NULL);
-    assert(stList_length(objectNames) == stList_length(records));
-    stList_setDestructor(records, free);
-    for (int64_t i = 0; i < stList_length(objectNames); i++) {
-        Name objectName = *((int64_t *) stList_get(objectNames, i));
-        int64_t recordSize;
-        void *record;
-        stKVDatabaseBulkResult *result = stList_get(records, i);
-        assert(result != NULL);
-        if (cactusDisk->cache == NULL
-            || !stCache_containsRecord(cactusDisk->cache, objectName, 0, INT64_MAX)) {
-            record = stKVDatabaseBulkResult_getRecord(result, &recordSize);
-            assert(recordSize >= 0);
-            assert(record != NULL);
-            record = decompress(record, &recordSize);
-            if (cactusDisk->cache != NULL) {
-                stCache_setRecord(cactusDisk->cache, objectName, 0, recordSize, record);
+                results = bulkGetRecords(cactusDisk, missingNames);
             }
-        } else {
-            record = stCache_getRecord(cactusDisk->cache, objectName, 0, INT64_MAX, &recordSize);
-            assert(recordSize >= 0);
+            stCatch(except)
+                {
+                    stThrowNewCause(except, ST_KV_DATABASE_EXCEPTION_ID,
+                            "An unknown database error occurred when getting a bulk set of %s", type);
+                }stTryEnd
+        ;
+        assert(stList_length(results) == stList_length(missingNames));
+        for (int64_t i = 0; i < stList_length(missingNames); i++) {
+            int64_t recordSize;
+            void *record = stKVDatabaseBulkResult_getRecord(stList_get(results, i), &recordSize);
+            if (record != NULL) {
+                readCache_insert(cactusDisk, *((int64_t *) stList_get(missingNames, i)), record, recordSize);
+                cactusDisk->prefetchedRecords++;
+            }
+        }
+        stList_destruct(results);
+        cactusDisk->prefetchBatches++;
+    }
+    stList_destruct(missingNames);
+}
+
+static stList *getBatch(stList *list, int64_t start) {
+    stList *batch = stList_construct();
+    for (int64_t i = start; i < stList_length(list) && i < start + CACTUS_DISK_PREFETCH_BATCH_SIZE; i++) {
+        stList_append(batch, stList_get(list, i));
+    }
+    return batch;
+}
+
+void cactusDisk_prefetchRecords(CactusDisk *cactusDisk, stList *names) {
+    for (int64_t i = 0; i < stList_length(names); i += CACTUS_DISK_PREFETCH_BATCH_SIZE) {
+        stList *batch = getBatch(names, i);
+        prefetchRecords(cactusDisk, batch, "records");
+        stList_destruct(batch);
+    }
+}
+
+static void *getRecord(CactusDisk *cactusDisk, Name objectName, char *type, int64_t *size);
+
+static stList *getRecords(CactusDisk *cactusDisk, stList *objectNames, char *type) {
+    /*
+     * Gets the uncompressed records for a list of names, fetching the ones that aren't cached
+     * in batched bulk gets.
+     */
+    stList *records = stList_construct3(0, free);
+    for (int64_t i = 0; i < stList_length(objectNames); i += CACTUS_DISK_PREFETCH_BATCH_SIZE) {
+        stList *batch = getBatch(objectNames, i);
+        prefetchRecords(cactusDisk, batch, type);
+        for (int64_t j = 0; j < stList_length(batch); j++) {
+            void *record = getRecord(cactusDisk, *((int64_t *) stList_get(batch, j)), type, NULL);
             assert(record != NULL);
+            stList_append(records, record);
         }
-        stKVDatabaseBulkResult_destruct(result);
-        stList_set(records, i, record);
+        stList_destruct(batch);
     }
     return records;
 }
 
 static void *getRecord(CactusDisk *cactusDisk, Name objectName, char *type, int64_t *size) {
-    void *cA = NULL;
     int64_t recordSize = 0;
-    if (cactusDisk->cache != NULL
-        && stCache_containsRecord(cactusDisk->cache, objectName, 0, INT64_MAX)) { //If we already have the record, we won't update it.
-        cA = stCache_getRecord(cactusDisk->cache, objectName, 0, INT64_MAX, &recordSize);
+    void *cA = getCachedRecord(cactusDisk, objectName, &recordSize);
+    if (cA != NULL) { //If we already have the record, we won't update it.
+        cactusDisk->recordHits++;
     } else {
+        cactusDisk->recordMisses++;
         stTry
             {
-                cA = stKVDatabase_getRecord2(cactusDisk->database, objectName, &recordSize);
+                cA = stKVDatabase_getRecord2(getDatabase(cactusDisk, objectName), objectName, &recordSize);
             }
             stCatch(except)
                 {
@@ -499,23 +873,37 @@ static void *getRecord(CactusDisk *cactusDisk, Name objectName, char *type, int6
 static bool containsRecord(CactusDisk *cactusDisk, Name objectName) {
     return (cactusDisk->cache != NULL
             && stCache_containsRecord(cactusDisk->cache, objectName, 0, INT64_MAX))
-        || stKVDatabase_containsRecord(cactusDisk->database, objectName);
+        || stKVDatabase_containsRecord(getDatabase(cactusDisk, objectName), objectName);
 }
 
-static CactusDisk *cactusDisk_constructPrivate(stKVDatabaseConf *conf, bool create, bool cache) {
+static CactusDisk *cactusDisk_constructPrivate(stList *confs, const char *confString, bool create, bool cache) {
     CactusDisk *cactusDisk = st_calloc(1, sizeof(CactusDisk));
 
+    //the write parameters, which the conf string may override
+    cactusDisk->compressionLevel = getConfParameter(confString, "compression_level", CACTUS_DISK_COMPRESSION_LEVEL);
+    if (cactusDisk->compressionLevel < -1 || cactusDisk->compressionLevel > 9) {
+        stThrowNew(CACTUS_DISK_EXCEPTION_ID, "The compression level must be between -1 and 9, not %" PRIi64,
+                   cactusDisk->compressionLevel);
+    }
+    cactusDisk->writeBatchSize = getConfParameter(confString, "write_batch_size", 0);
+    cactusDisk->writeBatchTime = getConfParameter(confString, "write_batch_time", 0);
+
     //construct lists of in memory objects
     cactusDisk->metaSequences = stSortedSet_construct3(cactusDisk_constructMetaSequencesP, NULL);
     cactusDisk->flowers = stSortedSet_construct3(cactusDisk_constructFlowersP, NULL);
     cactusDisk->flowerNamesMarkedForDeletion = stSortedSet_construct3((int (*)(const void *, const void *)) strcmp,
             free);
-    cactusDisk->updateRequests = stList_construct3(0, (void (*)(void *)) stKVDatabaseBulkRequest_destruct);
 
     cactusDisk->eventTree = NULL;
 
     //Now open the database
-    cactusDisk->database = stKVDatabase_construct(conf, create);
+    cactusDisk->databases = stList_construct3(0, (void (*)(void *)) stKVDatabase_destruct);
+    for (int64_t i = 0; i < stList_length(confs); i++) {
+        stList_append(cactusDisk->databases, stKVDatabase_construct(stList_get(confs, i), create));
+    }
+    constructShardRing(cactusDisk);
+    cactusDisk->updateRequests = constructShardLists(cactusDisk, (void (*)(void *)) stKVDatabaseBulkRequest_destruct);
+    cactusDisk->readCache = stSortedSet_construct3(readCacheEntry_cmp, NULL);
     if (cache) {
         // 10MB for general DB responses
         cactusDisk->cache = stCache_construct2(10000000);
@@ -537,7 +925,7 @@ static CactusDisk *cactusDisk_constructPrivate(stKVDatabaseConf *conf, bool crea
         }
         void *record = getRecord(cactusDisk, CACTUS_DISK_PARAMETER_KEY, "cactus_disk parameters", NULL);
         void *record2 = record;
-        cactusDisk_loadFromBinaryRepresentation(&record, cactusDisk, conf);
+        cactusDisk_loadFromBinaryRepresentation(&record, cactusDisk, stList_get(confs, 0));
         free(record2);
     } else {
         assert(create);
@@ -547,7 +935,26 @@ static CactusDisk *cactusDisk_constructPrivate(stKVDatabaseConf *conf, bool crea
 }
 
 CactusDisk *cactusDisk_construct(stKVDatabaseConf *conf, bool create, bool cache) {
-    return cactusDisk_constructPrivate(conf, create, cache);
+    stList *confs = stList_construct();
+    stList_append(confs, conf);
+    CactusDisk *cactusDisk = cactusDisk_constructPrivate(confs, NULL, create, cache);
+    stList_destruct(confs);
+    return cactusDisk;
+}
+
+CactusDisk *cactusDisk_constructFromString(const char *confString, bool create, bool cache) {
+    stList *confStrings = getShardConfStrings(confString);
+    stList *confs = stList_construct3(0, (void (*)(void *)) stKVDatabaseConf_destruct);
+    for (int64_t i = 0; i < stList_length(confStrings); i++) {
+        stList_append(confs, stKVDatabaseConf_constructFromString(stList_get(confStrings, i)));
+    }
+    if (stList_length(confs) > 1) {
+        st_logInfo("Spreading the cactus disk over %" PRIi64 " database shards\n", stList_length(confs));
+    }
+    CactusDisk *cactusDisk = cactusDisk_constructPrivate(confs, confString, create, cache);
+    stList_destruct(confs);
+    stList_destruct(confStrings);
+    return cactusDisk;
 }
 
 void cactusDisk_destruct(CactusDisk *cactusDisk) {
@@ -566,8 +973,20 @@ void cactusDisk_destruct(CactusDisk *cactusDisk) {
     }
     stSortedSet_destruct(cactusDisk->metaSequences);
 
+    // Logged as critical so they end up in the job's log whatever the log level.
+    st_logCritical("Cactus disk record gets: %" PRIi64 " cache hits, %" PRIi64 " misses, %" PRIi64
+                   " records prefetched in %" PRIi64 " bulk gets, %" PRIi64 " evicted from the read cache\n",
+                   cactusDisk->recordHits, cactusDisk->recordMisses, cactusDisk->prefetchedRecords,
+                   cactusDisk->prefetchBatches, cactusDisk->evictedRecords);
+    st_logCritical("Cactus disk record sets: %" PRIi64 " records, %" PRIi64 " bytes compressed, written in %" PRIi64
+                   " flushes taking %" PRIi64 " seconds\n", cactusDisk->flushedRecords, cactusDisk->flushedBytes,
+                   cactusDisk->flushes, cactusDisk->flushTime);
+    readCache_clear(cactusDisk);
+    stSortedSet_destruct(cactusDisk->readCache);
+
     //close DB
-    stKVDatabase_destruct(cactusDisk->database);
+    stList_destruct(cactusDisk->databases);
+    free(cactusDisk->shardRing);
 
     if (cactusDisk->cache != NULL) {
         stCache_destruct(cactusDisk->cache);
@@ -581,6 +1000,82 @@ void cactusDisk_destruct(CactusDisk *cactusDisk) {
     free(cactusDisk);
 }
 
+/*
+ * Updates are buffered in the update requests and written in bulk when the buffer reaches
+ * writeBatchSize bytes or its oldest update is writeBatchTime seconds old, and at the end of
+ * cactusDisk_write.
+ *
+ * A write is only atomic if it is a single bulk set on a single database. When it is split, over
+ * several shards or into several batches, a binary that dies part way through leaves some of its
+ * records written and others not, and a retry of the job would read that. Split writes are
+ * therefore counted on the first shard, when they start and when they finish: if the counts
+ * differ once the phase is over (see checkPrimaryDBWrites in ktserverControl.py), a write was
+ * torn and the phase has to be rerun from its snapshot.
+ */
+
+static bool isSplitWrite(CactusDisk *cactusDisk) {
+    return cactusDisk->shardRing != NULL || cactusDisk->writeBatchSize > 0 || cactusDisk->writeBatchTime > 0;
+}
+
+static void countWrite(CactusDisk *cactusDisk, Name key) {
+    stKVDatabase *database = stList_get(cactusDisk->databases, 0);
+    volatile bool inserted = 0;
+    if (!stKVDatabase_containsRecord(database, key)) {
+        stTry
+            {
+                stKVDatabase_insertInt64(database, key, 1);
+                inserted = 1;
+            }
+            stCatch(except)
+                {
+                    // Another binary inserted it first.
+                    stExcept_free(except);
+                }stTryEnd
+        ;
+    }
+    if (!inserted) {
+        stKVDatabase_incrementInt64(database, key, 1);
+    }
+}
+
+static void flushUpdateRequests(CactusDisk *cactusDisk) {
+    int64_t updateNumber = shardLists_length(cactusDisk->updateRequests);
+    if (updateNumber == 0) {
+        return;
+    }
+    st_logDebug("Writing %" PRIi64 " updates, %" PRIi64 " bytes\n", updateNumber, cactusDisk->bufferedBytes);
+    time_t startTime = time(NULL);
+    stTry
+        {
+            bulkSetRecords(cactusDisk, cactusDisk->updateRequests);
+        }
+        stCatch(except)
+            {
+                stThrowNewCause(except, ST_KV_DATABASE_EXCEPTION_ID,
+                        "Failed when trying to set records in updating the cactus disk");
+            }stTryEnd
+    ;
+    cactusDisk->flushes++;
+    cactusDisk->flushedRecords += updateNumber;
+    cactusDisk->flushedBytes += cactusDisk->bufferedBytes;
+    cactusDisk->flushTime += time(NULL) - startTime;
+    stList_destruct(cactusDisk->updateRequests);
+    cactusDisk->updateRequests = constructShardLists(cactusDisk, (void (*)(void *)) stKVDatabaseBulkRequest_destruct);
+    cactusDisk->bufferedBytes = 0;
+}
+
+static void addUpdateRequest(CactusDisk *cactusDisk, Name name, stKVDatabaseBulkRequest *request, int64_t size) {
+    if (shardLists_length(cactusDisk->updateRequests) == 0) {
+        cactusDisk->bufferStartTime = time(NULL);
+    }
+    shardLists_append(cactusDisk, cactusDisk->updateRequests, name, request);
+    cactusDisk->bufferedBytes += size;
+    if ((cactusDisk->writeBatchSize > 0 && cactusDisk->bufferedBytes >= cactusDisk->writeBatchSize)
+        || (cactusDisk->writeBatchTime > 0 && time(NULL) - cactusDisk->bufferStartTime >= cactusDisk->writeBatchTime)) {
+        flushUpdateRequests(cactusDisk);
+    }
+}
+
 void cactusDisk_addUpdateRequest(CactusDisk *cactusDisk, Flower *flower) {
     int64_t recordSize;
     void *vA = binaryRepresentation_makeBinaryRepresentation(flower,
@@ -588,19 +1083,21 @@ void cactusDisk_addUpdateRequest(CactusDisk *cactusDisk, Flower *flower) {
             &recordSize);
     //Compression
     int64_t compressedSize;
-    void *compressed = stCompression_compress(vA, recordSize, &compressedSize, -1);
+    void *compressed = stCompression_compress(vA, recordSize, &compressedSize, cactusDisk->compressionLevel);
     if (containsRecord(cactusDisk, flower_getName(flower))) {
         // Check if this is a redundant update.
         int64_t recordSize2;
         void *vA2 = getRecord(cactusDisk, flower_getName(flower), "flower", &recordSize2);
         if (!stCache_recordsIdentical(vA, recordSize, vA2, recordSize2)) { //Only rewrite if we actually did something
-            stList_append(cactusDisk->updateRequests,
-                    stKVDatabaseBulkRequest_constructUpdateRequest(flower_getName(flower), compressed, compressedSize));
+            addUpdateRequest(cactusDisk, flower_getName(flower),
+                    stKVDatabaseBulkRequest_constructUpdateRequest(flower_getName(flower), compressed, compressedSize),
+                    compressedSize);
         }
         free(vA2);
     } else {
-        stList_append(cactusDisk->updateRequests,
-                stKVDatabaseBulkRequest_constructInsertRequest(flower_getName(flower), compressed, compressedSize));
+        addUpdateRequest(cactusDisk, flower_getName(flower),
+                stKVDatabaseBulkRequest_constructInsertRequest(flower_getName(flower), compressed, compressedSize),
+                compressedSize);
     }
     free(vA);
     free(compressed);
@@ -613,15 +1110,15 @@ void cactusDisk_forceParameterUpdate(CactusDisk *cactusDisk, bool keyAlreadyExis
                                                       (void (*)(void *, void (*)(const void * ptr, size_t size, size_t count))) cactusDisk_writeBinaryRepresentation,
                                                       &recordSize);
     //Compression
-    cactusDiskParameters = compress(cactusDiskParameters, &recordSize);
+    cactusDiskParameters = compress(cactusDisk, cactusDiskParameters, &recordSize);
     if (keyAlreadyExists) {
-        stList_append(cactusDisk->updateRequests,
+        addUpdateRequest(cactusDisk, CACTUS_DISK_PARAMETER_KEY,
                       stKVDatabaseBulkRequest_constructUpdateRequest(CACTUS_DISK_PARAMETER_KEY, cactusDiskParameters,
-                                                                     recordSize));
+                                                                     recordSize), recordSize);
     } else {
-        stList_append(cactusDisk->updateRequests,
+        addUpdateRequest(cactusDisk, CACTUS_DISK_PARAMETER_KEY,
                       stKVDatabaseBulkRequest_constructInsertRequest(CACTUS_DISK_PARAMETER_KEY, cactusDiskParameters,
-                                                                     recordSize));
+                                                                     recordSize), recordSize);
     }
     free(cactusDiskParameters);
 }
@@ -630,10 +1127,14 @@ void cactusDisk_write(CactusDisk *cactusDisk) {
     Flower *flower;
     int64_t recordSize;
 
-    stList *removeRequests = stList_construct3(0, (void (*)(void *)) stIntTuple_destruct);
+    stList *removeRequests = constructShardLists(cactusDisk, (void (*)(void *)) stIntTuple_destruct);
 
     st_logDebug("Starting to write the cactus to disk\n");
 
+    if (isSplitWrite(cactusDisk)) {
+        countWrite(cactusDisk, CACTUS_DISK_WRITES_STARTED_KEY);
+    }
+
     stSortedSetIterator *it = stSortedSet_getIterator(cactusDisk->flowers);
     //Sort flowers to update.
     while ((flower = stSortedSet_getNext(it)) != NULL) {
@@ -649,8 +1150,9 @@ void cactusDisk_write(CactusDisk *cactusDisk) {
     while ((nameString = stSortedSet_getNext(it)) != NULL) {
         Name name = cactusMisc_stringToName(nameString);
         if (containsRecord(cactusDisk, name)) {
-            stList_append(cactusDisk->updateRequests, stKVDatabaseBulkRequest_constructUpdateRequest(name, &name, 0)); //We set it to null in the first atomic operation.
-            stList_append(removeRequests, stIntTuple_construct1(name));
+            addUpdateRequest(cactusDisk, name,
+                             stKVDatabaseBulkRequest_constructUpdateRequest(name, &name, 0), 0); //We set it to null in the first atomic operation.
+            shardLists_append(cactusDisk, removeRequests, name, stIntTuple_construct1(name));
         }
     }
     stSortedSet_destructIterator(it);
@@ -666,13 +1168,15 @@ void cactusDisk_write(CactusDisk *cactusDisk) {
                         (void (*)(void *, void (*)(const void * ptr, size_t size, size_t count))) metaSequence_writeBinaryRepresentation,
                         &recordSize);
         //Compression
-        vA = compress(vA, &recordSize);
+        vA = compress(cactusDisk, vA, &recordSize);
         if (!containsRecord(cactusDisk, metaSequence_getName(metaSequence))) {
-            stList_append(cactusDisk->updateRequests,
-                    stKVDatabaseBulkRequest_constructInsertRequest(metaSequence_getName(metaSequence), vA, recordSize));
+            addUpdateRequest(cactusDisk, metaSequence_getName(metaSequence),
+                    stKVDatabaseBulkRequest_constructInsertRequest(metaSequence_getName(metaSequence), vA, recordSize),
+                    recordSize);
         } else {
-            stList_append(cactusDisk->updateRequests,
-                    stKVDatabaseBulkRequest_constructUpdateRequest(metaSequence_getName(metaSequence), vA, recordSize));
+            addUpdateRequest(cactusDisk, metaSequence_getName(metaSequence),
+                    stKVDatabaseBulkRequest_constructUpdateRequest(metaSequence_getName(metaSequence), vA, recordSize),
+                    recordSize);
         }
         free(vA);
     }
@@ -686,28 +1190,14 @@ void cactusDisk_write(CactusDisk *cactusDisk) {
 
     st_logDebug("Checked if need to write the initial parameters\n");
 
-    if (stList_length(cactusDisk->updateRequests) > 0) {
-        st_logDebug("Going to write %" PRIi64 " updates\n", stList_length(cactusDisk->updateRequests));
-        stTry
-            {
-                st_logDebug("Writing %" PRIi64 " updates\n", stList_length(cactusDisk->updateRequests));
-                assert(stList_length(cactusDisk->updateRequests) > 0);
-                stKVDatabase_bulkSetRecords(cactusDisk->database, cactusDisk->updateRequests);
-            }
-            stCatch(except)
-                {
-                    stThrowNewCause(except, ST_KV_DATABASE_EXCEPTION_ID,
-                            "Failed when trying to set records in updating the cactus disk");
-                }stTryEnd
-        ;
-    }
+    flushUpdateRequests(cactusDisk);
 
     st_logDebug("Updated the database with inserts\n");
 
-    if (stList_length(removeRequests) > 0) {
+    if (shardLists_length(removeRequests) > 0) {
         stTry
             {
-                stKVDatabase_bulkRemoveRecords(cactusDisk->database, removeRequests);
+                bulkRemoveRecords(cactusDisk, removeRequests);
             }
             stCatch(except)
                 {
@@ -719,10 +1209,12 @@ void cactusDisk_write(CactusDisk *cactusDisk) {
 
     st_logDebug("Now removed flowers we don't need\n");
 
-    stList_destruct(cactusDisk->updateRequests);
-    cactusDisk->updateRequests = stList_construct3(0, (void (*)(void *)) stKVDatabaseBulkRequest_destruct);
     stList_destruct(removeRequests);
 
+    if (isSplitWrite(cactusDisk)) {
+        countWrite(cactusDisk, CACTUS_DISK_WRITES_FINISHED_KEY);
+    }
+
     st_logDebug("Finished writing to the database\n");
 }
 
@@ -836,8 +1328,9 @@ void cactusDisk_getBlockOfUniqueIDs(CactusDisk *cactusDisk, int64_t intervalSize
                 assert(minimumValue >= 1);
                 assert(maximumValue <= INT64_MAX);
                 assert(minimumValue < maximumValue);
-                if (stKVDatabase_containsRecord(cactusDisk->database, keyName)) {
-                    cactusDisk->maxUniqueNumber = stKVDatabase_incrementInt64(cactusDisk->database, keyName,
+                stKVDatabase *database = getDatabase(cactusDisk, keyName);
+                if (stKVDatabase_containsRecord(database, keyName)) {
+                    cactusDisk->maxUniqueNumber = stKVDatabase_incrementInt64(database, keyName,
                             intervalSize);
                     cactusDisk->uniqueNumber = cactusDisk->maxUniqueNumber - intervalSize;
                     if (cactusDisk->uniqueNumber <= 0 || cactusDisk->uniqueNumber < minimumValue
@@ -851,7 +1344,7 @@ void cactusDisk_getBlockOfUniqueIDs(CactusDisk *cactusDisk, int64_t intervalSize
                 } else {
                     stTry
                         {
-                            stKVDatabase_insertInt64(cactusDisk->database, keyName, minimumValue);
+                            stKVDatabase_insertInt64(database, keyName, minimumValue);
                         }
                         stCatch(except)
                             {
@@ -908,6 +1401,7 @@ void cactusDisk_clearStringCache(CactusDisk *cactusDisk) {
 
 void cactusDisk_clearCache(CactusDisk *cactusDisk) {
     stCache_clear(cactusDisk->cache);
+    readCache_clear(cactusDisk);
 }
 
 EventTree *cactusDisk_getEventTree(CactusDisk *cactusDisk) {
@@ -7,19 +7,55 @@
 #ifndef CACTUS_DISK_PRIVATE_H_
 #define CACTUS_DISK_PRIVATE_H_
 
+#include <time.h>
 #include "cactusGlobals.h"
 
+typedef struct _shardRingPoint {
+    uint64_t hash;
+    int64_t shard;
+} ShardRingPoint;
+
+typedef struct _readCacheEntry ReadCacheEntry;
+
+struct _readCacheEntry {
+    Name name;
+    void *record; // Compressed, as stored in the database.
+    int64_t size;
+    ReadCacheEntry *previous;
+    ReadCacheEntry *next;
+};
+
 struct _cactusDisk {
-    stKVDatabase *database;
+    stList *databases; // The shards the records are spread over.
+    ShardRingPoint *shardRing; // NULL if there is only one shard.
+    int64_t shardRingSize;
     stSortedSet *metaSequences;
     stSortedSet *flowers;
     stSortedSet *flowerNamesMarkedForDeletion;
-    stList *updateRequests;
+    stList *updateRequests; // A list of requests for each shard.
     stCache *cache;
     stCache *stringCache;
     EventTree *eventTree;
     Name uniqueNumber;
     Name maxUniqueNumber;
+    stSortedSet *readCache; // Prefetched records, by name.
+    ReadCacheEntry *readCacheHead; // The most recently used record.
+    ReadCacheEntry *readCacheTail; // The least recently used record.
+    int64_t readCacheSize;
+    int64_t recordHits;
+    int64_t recordMisses;
+    int64_t prefetchedRecords;
+    int64_t prefetchBatches;
+    int64_t evictedRecords;
+    int64_t compressionLevel; // The zlib level records are compressed with, -1 for the default.
+    int64_t writeBatchSize; // Buffered updates are written once they reach this many bytes, 0 for no bound.
+    int64_t writeBatchTime; // Or once the oldest has been buffered this many seconds, 0 for no bound.
+    int64_t bufferedBytes;
+    time_t bufferStartTime;
+    int64_t flushes;
+    int64_t flushedRecords;
+    int64_t flushedBytes;
+    int64_t flushTime;
 };
 
 ////////////////////////////////////////////////
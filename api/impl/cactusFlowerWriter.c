@@ -2,6 +2,7 @@
 #include "cactusGlobalsPrivate.h"
 
 #define FLOWER_STREAM_BATCH_SIZE 50
+#define FLOWER_STREAM_PREFETCH_SIZE 1000
 
 struct _flowerWriter {
         stList *flowerNamesAndSizes;
@@ -215,6 +216,17 @@ Flower *flowerStream_getNext(FlowerStream *flowerStream) {
         if (batchEnd > stList_length(flowerStream->flowerNames)) {
             batchEnd = stList_length(flowerStream->flowerNames);
         }
+        if (batchStart % FLOWER_STREAM_PREFETCH_SIZE == 0) {
+            // Fetch the records for this and the following batches with one bulk get, so that
+            // they are in the read cache by the time they are needed.
+            stList *prefetchNames = stList_construct();
+            for (int64_t i = batchStart; i < stList_length(flowerStream->flowerNames)
+                    && i < batchStart + FLOWER_STREAM_PREFETCH_SIZE; i++) {
+                stList_append(prefetchNames, stList_get(flowerStream->flowerNames, i));
+            }
+            cactusDisk_prefetchRecords(flowerStream->cactusDisk, prefetchNames);
+            stList_destruct(prefetchNames);
+        }
         stList *namesBatch = stList_construct2(batchEnd - batchStart);
         for (int64_t i = batchStart; i < batchEnd; i++) {
             stList_set(namesBatch, i - batchStart, stList_get(flowerStream->flowerNames, i));
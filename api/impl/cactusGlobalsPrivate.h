@@ -60,5 +60,6 @@
 #include "cactusSerialisation.h"
 #include "cactusTestCommon.h"
 #include "cactusFlowerWriter.h"
+#include "cactusBinaryAlignments.h"
 
 #endif
@@ -27,5 +27,6 @@
 #include "cactusSequence.h"
 #include "cactusTestCommon.h"
 #include "cactusFlowerWriter.h"
+#include "cactusBinaryAlignments.h"
 
 #endif
@@ -0,0 +1,58 @@
+#ifndef CACTUS_BINARY_ALIGNMENTS_H_
+#define CACTUS_BINARY_ALIGNMENTS_H_
+
+/*
+ * Reading and writing of pairwise alignments in the compact binary format of
+ * src/cactus/blast/binaryAlignments.py: zlib-compressed blocks of columns, with the
+ * contig names in a dictionary, varint coordinates and packed operation types.
+ * Per-operation scores are not kept.
+ */
+
+#include <stdio.h>
+#include "sonLib.h"
+#include "cactusGlobals.h"
+
+struct PairwiseAlignment;
+
+/*
+ * Reads the alignments in a file, which may be either binary or cigar. The reader
+ * owns the file handle, which must be seekable.
+ */
+AlignmentReader *alignmentReader_construct(FILE *fileHandle);
+
+/*
+ * Closes the file.
+ */
+void alignmentReader_destruct(AlignmentReader *alignmentReader);
+
+/*
+ * Is the file in the binary format, rather than cigar?
+ */
+bool alignmentReader_isBinary(AlignmentReader *alignmentReader);
+
+/*
+ * Gets the next alignment, which the caller then owns, or NULL at the end of the file.
+ */
+struct PairwiseAlignment *alignmentReader_getNext(AlignmentReader *alignmentReader);
+
+/*
+ * Goes back to the first alignment.
+ */
+void alignmentReader_reset(AlignmentReader *alignmentReader);
+
+/*
+ * Writes alignments to the file in the binary format.
+ */
+BinaryAlignmentWriter *binaryAlignmentWriter_construct(FILE *fileHandle);
+
+/*
+ * Writes out the last block. Does not close the file.
+ */
+void binaryAlignmentWriter_destruct(BinaryAlignmentWriter *binaryAlignmentWriter);
+
+/*
+ * Adds an alignment, which the caller still owns.
+ */
+void binaryAlignmentWriter_write(BinaryAlignmentWriter *binaryAlignmentWriter, struct PairwiseAlignment *pA);
+
+#endif
@@ -30,6 +30,14 @@ extern const char *CACTUS_DISK_EXCEPTION_ID;
  */
 CactusDisk *cactusDisk_construct(stKVDatabaseConf *conf, bool create, bool cache);
 
+/*
+ * As cactusDisk_construct, but takes the database conf as a string. The
+ * string may list further kyoto_tycoon_shard tags (each with a host and
+ * port) after the kyoto_tycoon tag, in which case the records are spread
+ * over all the listed servers by consistent hashing of their keys.
+ */
+CactusDisk *cactusDisk_constructFromString(const char *confString, bool create, bool cache);
+
 /*
  * Destructs the cactus disk and all open flowers and sequences, and
  * then disconnects from the cactus DB.
@@ -46,6 +54,13 @@ int64_t cactusDisk_getUniqueID(CactusDisk *cactusDisk);
  */
 int64_t cactusDisk_getUniqueIDInterval(CactusDisk *cactusDisk, int64_t intervalSize);
 
+/*
+ * Fetches the records with the given names (a list of int64_t pointers) from the database in
+ * batched bulk gets, keeping them in a bounded read cache, so that loading the flowers (or other
+ * objects) with those names later doesn't take a round-trip to the database for each one.
+ */
+void cactusDisk_prefetchRecords(CactusDisk *cactusDisk, stList *names);
+
 /*
  * Writes the updated state of the parts of the cactus disk in memory to disk.
  *
@@ -46,6 +46,8 @@ typedef struct _faceEnd FaceEnd;
 typedef struct _flower Flower;
 typedef struct _cactusDisk CactusDisk;
 typedef struct _flowerWriter FlowerWriter;
+typedef struct _alignmentReader AlignmentReader;
+typedef struct _binaryAlignmentWriter BinaryAlignmentWriter;
 
 typedef stSortedSetIterator EventTree_Iterator;
 typedef struct _end_instanceIterator End_InstanceIterator;
@@ -15,6 +15,8 @@ static void usage(void)
     fprintf(stderr, "cactus_convertAlignmentsToInternalNames --cactusDisk cactusDisk inputFile outputFile\n");
     fprintf(stderr, "Options: --bed input file is a bed file, not a cigar. "
             "Output will be a sorted binary coverage file.\n");
+    fprintf(stderr, "--binary write the alignments in the binary alignment format "
+            "rather than as cigars. The input may be in either.\n");
 }
 
 static void convertHeadersToNames(struct PairwiseAlignment *pA, stHash *headerToName)
@@ -44,7 +46,6 @@ int main(int argc, char *argv[])
 {
     char *cactusDiskString = NULL;
     CactusDisk *cactusDisk;
-    stKVDatabaseConf *kvDatabaseConf;
     stHash *headerToName;
     stList *flowers;
     Flower_EndIterator *endIt;
@@ -53,8 +54,10 @@ int main(int argc, char *argv[])
     FILE *inputFile;
     FILE *outputFile;
     bool isBedFile = false; // true if bed, false if cigar
+    bool writeBinary = false;
     struct option longopts[] = { {"cactusDisk", required_argument, NULL, 'a' },
                                  {"bed", no_argument, NULL, 'c'},
+                                 {"binary", no_argument, NULL, 'b'},
 
                                  {0, 0, 0, 0} };
     int flag;
@@ -66,6 +69,9 @@ int main(int argc, char *argv[])
 	case 'c':
             isBedFile = true;
             break;
+        case 'b':
+            writeBinary = true;
+            break;
         case '?':
         default:
             usage();
@@ -81,8 +87,7 @@ int main(int argc, char *argv[])
     if (cactusDiskString == NULL) {
         st_errAbort("--cactusDisk option must be provided");
     }
-    kvDatabaseConf = stKVDatabaseConf_constructFromString(cactusDiskString);
-    cactusDisk = cactusDisk_construct(kvDatabaseConf, false, true);
+    cactusDisk = cactusDisk_constructFromString(cactusDiskString, false, true);
     flowers = flowerWriter_parseFlowersFromStdin(cactusDisk);
     assert(stList_length(flowers) == 1);
     Flower *flower = stList_get(flowers, 0);
@@ -204,24 +209,35 @@ int main(int argc, char *argv[])
         }
         fclose(tempFile);
         stFile_rmrf(tempPath);
+        fclose(inputFile);
     } else {
-        // Input is a cigar file.
+        // Input is a cigar (or binary alignment) file.
         // Scan over the given alignment file and convert the headers to
         // cactus Names.
+        AlignmentReader *alignmentReader = alignmentReader_construct(inputFile);
+        BinaryAlignmentWriter *binaryAlignmentWriter = writeBinary ? binaryAlignmentWriter_construct(outputFile) : NULL;
         for (;;) {
-            struct PairwiseAlignment *pA = cigarRead(inputFile);
+            struct PairwiseAlignment *pA = alignmentReader_getNext(alignmentReader);
             if (pA == NULL) {
-                // Signals end of cigar file.
+                // Signals end of alignment file.
                 break;
             }
             convertHeadersToNames(pA, headerToName);
             checkPairwiseAlignment(pA);
-            cigarWrite(outputFile, pA, TRUE);
+            if (writeBinary) {
+                binaryAlignmentWriter_write(binaryAlignmentWriter, pA);
+            } else {
+                cigarWrite(outputFile, pA, TRUE);
+            }
+            destructPairwiseAlignment(pA);
+        }
+        if (writeBinary) {
+            binaryAlignmentWriter_destruct(binaryAlignmentWriter);
         }
+        alignmentReader_destruct(alignmentReader);
     }
 
     // Cleanup.
-    fclose(inputFile);
     fclose(outputFile);
     flower_destructEndIterator(endIt);
     cactusDisk_destruct(cactusDisk);
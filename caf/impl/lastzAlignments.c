@@ -81,7 +81,25 @@ void stCaf_sortCigarsByScoreInDescendingOrder(stList *cigars) {
 }
 
 void stCaf_sortCigarsFileByScoreInDescendingOrder(char *cigarsFile, char *sortedFile) {
-    int64_t i = st_system("sort -k10,10nr -k2,2 %s > %s", cigarsFile, sortedFile);
+    // Unix sort needs cigar lines, so binary alignments are written out as cigars first.
+    char *unsortedFile = NULL;
+    AlignmentReader *alignmentReader = alignmentReader_construct(fopen(cigarsFile, "r"));
+    if (alignmentReader_isBinary(alignmentReader)) {
+        unsortedFile = getTempFile();
+        FILE *unsortedHandle = fopen(unsortedFile, "w");
+        struct PairwiseAlignment *pA;
+        while ((pA = alignmentReader_getNext(alignmentReader)) != NULL) {
+            cigarWrite(unsortedHandle, pA, 0);
+            destructPairwiseAlignment(pA);
+        }
+        fclose(unsortedHandle);
+    }
+    alignmentReader_destruct(alignmentReader);
+    int64_t i = st_system("sort -k10,10nr -k2,2 %s > %s", unsortedFile != NULL ? unsortedFile : cigarsFile, sortedFile);
+    if (unsortedFile != NULL) {
+        stFile_rmrf(unsortedFile);
+        free(unsortedFile);
+    }
     if(i != 0) {
         st_errAbort("Encountered unix sort error when sorting cigar alignments in file: %s\n", cigarsFile);
     }
@@ -119,20 +119,21 @@ static stPinch *pairwiseAlignmentToPinch_getNext(PairwiseAlignmentToPinch *pA) {
 }
 
 static PairwiseAlignmentToPinch *pairwiseAlignmentToPinch_resetForFile(PairwiseAlignmentToPinch *pA) {
-    fseek(pA->alignmentArg, 0, SEEK_SET);
+    alignmentReader_reset(pA->alignmentArg);
     pA->pairwiseAlignment = NULL;
     return pA;
 }
 
 static void pairwiseAlignmentToPinch_destructForFile(PairwiseAlignmentToPinch *pA) {
-    fclose(pA->alignmentArg);
+    alignmentReader_destruct(pA->alignmentArg);
     free(pA);
 }
 
 stPinchIterator *stPinchIterator_constructFromFile(const char *alignmentFile) {
     stPinchIterator *pinchIterator = st_calloc(1, sizeof(stPinchIterator));
-    pinchIterator->alignmentArg = pairwiseAlignmentToPinch_construct(fopen(alignmentFile, "r"),
-            (struct PairwiseAlignment *(*)(void *)) cigarRead, 1);
+    // The file may be either cigar or binary alignments.
+    pinchIterator->alignmentArg = pairwiseAlignmentToPinch_construct(alignmentReader_construct(fopen(alignmentFile, "r")),
+            (struct PairwiseAlignment *(*)(void *)) alignmentReader_getNext, 1);
     pinchIterator->getNextAlignment = (stPinch *(*)(void *)) pairwiseAlignmentToPinch_getNext;
     pinchIterator->destructAlignmentArg = (void(*)(void *)) pairwiseAlignmentToPinch_destructForFile;
     pinchIterator->startAlignmentStack = (void *(*)(void *)) pairwiseAlignmentToPinch_resetForFile;
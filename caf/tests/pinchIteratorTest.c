@@ -8,6 +8,7 @@
 #include "sonLib.h"
 #include "stPinchIterator.h"
 #include "pairwiseAlignment.h"
+#include "cactus.h"
 #include <math.h>
 
 static void testIterator(CuTest *testCase, stPinchIterator *pinchIterator, stList *randomPairwiseAlignments) {
@@ -106,6 +107,30 @@ static void testPinchIteratorFromFile(CuTest *testCase) {
     }
 }
 
+static void testPinchIteratorFromBinaryFile(CuTest *testCase) {
+    for (int64_t test = 0; test < 100; test++) {
+        stList *pairwiseAlignments = getRandomPairwiseAlignments();
+        st_logInfo("Doing a random pinch iterator from binary file test %" PRIi64 " with %" PRIi64 " alignments\n", test, stList_length(pairwiseAlignments));
+        //Put alignments in a binary file
+        char *tempFile = "tempFileForPinchIteratorTest.bin";
+        FILE *fileHandle = fopen(tempFile, "w");
+        BinaryAlignmentWriter *binaryAlignmentWriter = binaryAlignmentWriter_construct(fileHandle);
+        for (int64_t i = 0; i < stList_length(pairwiseAlignments); i++) {
+            binaryAlignmentWriter_write(binaryAlignmentWriter, stList_get(pairwiseAlignments, i));
+        }
+        binaryAlignmentWriter_destruct(binaryAlignmentWriter);
+        fclose(fileHandle);
+        //Get an iterator
+        stPinchIterator *pinchIterator = stPinchIterator_constructFromFile(tempFile);
+        //Now test it
+        testIterator(testCase, pinchIterator, pairwiseAlignments);
+        //Cleanup
+        stPinchIterator_destruct(pinchIterator);
+        stFile_rmrf(tempFile);
+        stList_destruct(pairwiseAlignments);
+    }
+}
+
 static void testPinchIteratorFromList(CuTest *testCase) {
     for (int64_t test = 0; test < 100; test++) {
         stList *pairwiseAlignments = getRandomPairwiseAlignments();
@@ -123,6 +148,7 @@ static void testPinchIteratorFromList(CuTest *testCase) {
 CuSuite* pinchIteratorTestSuite(void) {
     CuSuite* suite = CuSuiteNew();
     SUITE_ADD_TEST(suite, testPinchIteratorFromFile);
+    SUITE_ADD_TEST(suite, testPinchIteratorFromBinaryFile);
     SUITE_ADD_TEST(suite, testPinchIteratorFromList);
     return suite;
 }
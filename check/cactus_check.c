@@ -172,6 +172,12 @@ static void checkFlowers(Flower *flower, int64_t recursive, bool checkNormalised
         checkFlower(flower, checkNormalised);
     }
 
+    //Get the nested flowers in bulk, rather than one at a time.
+    stList *flowers = stList_construct();
+    stList_append(flowers, flower);
+    preCacheNestedFlowers(flower_getCactusDisk(flower), flowers);
+    stList_destruct(flowers);
+
     Group *group;
     Flower_GroupIterator *groupIt = flower_getGroupIterator(flower);
     while ((group = flower_getNextGroup(groupIt)) != NULL) { //We only check the children, to avoid constructing
@@ -267,8 +273,7 @@ int main(int argc, char *argv[]) {
     //Load the database
     //////////////////////////////////////////////
 
-    stKVDatabaseConf *kvDatabaseConf = stKVDatabaseConf_constructFromString(cactusDiskDatabaseString);
-    cactusDisk = cactusDisk_construct(kvDatabaseConf, false, true);
+    cactusDisk = cactusDisk_constructFromString(cactusDiskDatabaseString, false, true);
     st_logInfo("Set up the flower disk\n");
 
     stList *flowers = flowerWriter_parseFlowersFromStdin(cactusDisk);
@@ -293,7 +298,6 @@ int main(int argc, char *argv[]) {
     return 0; //Exit without clean up is quicker, enable cleanup when doing memory leak detection.
 
     stList_destruct(flowers);
-    stKVDatabaseConf_destruct(kvDatabaseConf);
 
     return 0;
 }
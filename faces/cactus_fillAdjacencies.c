@@ -1137,8 +1137,7 @@ int main(int argc, char ** argv) {
     //Load the database
     //////////////////////////////////////////////
 
-    stKVDatabaseConf *kvDatabaseConf = stKVDatabaseConf_constructFromString(cactusDiskDatabaseString);
-    cactusDisk = cactusDisk_construct(kvDatabaseConf, false, true);
+    cactusDisk = cactusDisk_constructFromString(cactusDiskDatabaseString, false, true);
     st_logInfo("Set up the flower disk\n");
 
     //////////////////////////////////////////////
@@ -1216,7 +1215,6 @@ int main(int argc, char ** argv) {
     //Destruct stuff
     startTime = time(NULL);
     cactusDisk_destruct(cactusDisk);
-    stKVDatabaseConf_destruct(kvDatabaseConf);
 
     st_logInfo("Cleaned stuff up and am finished in: %" PRIi64 " seconds\n", time(NULL)
             - startTime);
@@ -99,9 +99,7 @@ int main(int argc, char *argv[]) {
     //Load the database
     //////////////////////////////////////////////
 
-    stKVDatabaseConf *kvDatabaseConf = stKVDatabaseConf_constructFromString(
-            cactusDiskDatabaseString);
-    CactusDisk *cactusDisk = cactusDisk_construct(kvDatabaseConf, false, true);
+    CactusDisk *cactusDisk = cactusDisk_constructFromString(cactusDiskDatabaseString, false, true);
     st_logInfo("Set up the flower disk\n");
 
     ///////////////////////////////////////////////////////////////////////////
@@ -148,7 +146,6 @@ int main(int argc, char *argv[]) {
     return 0; //Exit without clean up is quicker, enable cleanup when doing memory leak detection.
 
     //Destruct stuff
-    stKVDatabaseConf_destruct(kvDatabaseConf);
     if(logLevelString != NULL) {
         free(logLevelString);
     }
@@ -84,9 +84,7 @@ int main(int argc, char *argv[]) {
     st_setLogLevelFromString(argv[1]);
     st_logDebug("Set up logging\n");
 
-    stKVDatabaseConf *kvDatabaseConf = stKVDatabaseConf_constructFromString(argv[2]);
-    CactusDisk *cactusDisk = cactusDisk_construct(kvDatabaseConf, false, true);
-    stKVDatabaseConf_destruct(kvDatabaseConf);
+    CactusDisk *cactusDisk = cactusDisk_constructFromString(argv[2], false, true);
     stHash *sequenceHeaderToCapHash = makeSequenceHeaderToCapHash(cactusDisk);
     st_logDebug("Set up the flower disk and built hash\n");
 
@@ -275,14 +275,12 @@ int main(int argc, char *argv[]) {
     //Load the database
     //////////////////////////////////////////////
 
-    stKVDatabaseConf *kvDatabaseConf = kvDatabaseConf = stKVDatabaseConf_constructFromString(cactusDiskDatabaseString);
+    stKVDatabaseConf *kvDatabaseConf = stKVDatabaseConf_constructFromString(cactusDiskDatabaseString);
     if (stKVDatabaseConf_getType(kvDatabaseConf) == stKVDatabaseTypeTokyoCabinet || stKVDatabaseConf_getType(kvDatabaseConf)
             == stKVDatabaseTypeKyotoTycoon) {
         assert(stKVDatabaseConf_getDir(kvDatabaseConf) != NULL);
-        cactusDisk = cactusDisk_construct(kvDatabaseConf, true, true);
-    } else {
-        cactusDisk = cactusDisk_construct(kvDatabaseConf, true, true);
     }
+    cactusDisk = cactusDisk_constructFromString(cactusDiskDatabaseString, true, true);
     st_logInfo("Set up the flower disk\n");
 
     //////////////////////////////////////////////
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+"""Compact binary container for pairwise alignments.
+
+Holds the same information as a file of cigar lines (less any
+per-operation scores), but stored by column in compressed blocks. Contig names are kept in a dictionary and
+referred to by number, coordinates are varints (each end stored
+relative to its start), and the operations are packed four types to a
+byte followed by their varint lengths.
+
+Layout: the magic string, then a sequence of blocks, each of which is
+the 4-byte little-endian compressed and uncompressed lengths of its
+data followed by that many bytes of zlib-compressed block data. A
+block holds the contig names first used in it (so the dictionary can be
+built while streaming) and then the columns for its alignments.
+
+api/impl/cactusBinaryAlignments.c reads and writes the same format, so
+cactus_convertAlignmentsToInternalNames can hand alignments to cactus_caf
+in it.
+"""
+import struct
+import zlib
+from argparse import ArgumentParser
+from collections import namedtuple
+
+MAGIC = "CACTUSALN\x01"
+
+OP_TYPES = "MID"
+
+Alignment = namedtuple("Alignment", ["contig1", "start1", "end1", "strand1",
+                                     "contig2", "start2", "end2", "strand2",
+                                     "score", "operations"])
+
+def parseCigarLine(line):
+    """Get an Alignment from a cigar line, or None if it isn't one."""
+    tokens = line.split()
+    if len(tokens) < 10 or tokens[0] != "cigar:":
+        return None
+    score = float(tokens[9]) if '.' in tokens[9] or 'e' in tokens[9] else int(tokens[9])
+    operations = [(tokens[i], int(tokens[i + 1])) for i in xrange(10, len(tokens) - 1, 2)]
+    return Alignment(tokens[1], int(tokens[2]), int(tokens[3]), tokens[4],
+                     tokens[5], int(tokens[6]), int(tokens[7]), tokens[8],
+                     score, operations)
+
+def formatCigarLine(alignment):
+    return "cigar: %s %d %d %s %s %d %d %s %s%s\n" % (
+        alignment.contig1, alignment.start1, alignment.end1, alignment.strand1,
+        alignment.contig2, alignment.start2, alignment.end2, alignment.strand2,
+        repr(alignment.score) if isinstance(alignment.score, float) else str(alignment.score),
+        "".join(" %s %d" % operation for operation in alignment.operations))
+
+def encodeVarint(value, out):
+    """Append the unsigned LEB128 encoding of value to the bytearray out."""
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def decodeVarint(data, offset):
+    """Get (value, offset past it) for the varint at offset in data."""
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+def zigzag(value):
+    return value << 1 if value >= 0 else ((-value) << 1) - 1
+
+def unzigzag(value):
+    return value >> 1 if value & 1 == 0 else -((value + 1) >> 1)
+
+class AlignmentWriter(object):
+    """Writes alignments to a file in the binary format."""
+    def __init__(self, outFile, blockSize=10000):
+        self.outFile = outFile
+        self.blockSize = blockSize
+        self.contigIDs = {}
+        self.block = []
+        self.outFile.write(MAGIC)
+
+    def write(self, alignment):
+        self.block.append(alignment)
+        if len(self.block) >= self.blockSize:
+            self.flush()
+
+    def flush(self):
+        if len(self.block) == 0:
+            return
+        newContigs = []
+        for alignment in self.block:
+            for contig in (alignment.contig1, alignment.contig2):
+                if contig not in self.contigIDs:
+                    self.contigIDs[contig] = len(self.contigIDs)
+                    newContigs.append(contig)
+        data = bytearray()
+        encodeVarint(len(newContigs), data)
+        for contig in newContigs:
+            encodeVarint(len(contig), data)
+            data.extend(contig)
+        encodeVarint(len(self.block), data)
+        for column in ("contig1", "contig2"):
+            for alignment in self.block:
+                encodeVarint(self.contigIDs[getattr(alignment, column)], data)
+        for start, end in (("start1", "end1"), ("start2", "end2")):
+            for alignment in self.block:
+                encodeVarint(getattr(alignment, start), data)
+            for alignment in self.block:
+                encodeVarint(zigzag(getattr(alignment, end) - getattr(alignment, start)), data)
+        # Strands and the type of the score, as bit flags.
+        for alignment in self.block:
+            data.append((alignment.strand1 == '+') | (alignment.strand2 == '+') << 1 |
+                        isinstance(alignment.score, float) << 2)
+        for alignment in self.block:
+            if isinstance(alignment.score, float):
+                data.extend(struct.pack("<d", alignment.score))
+            else:
+                encodeVarint(zigzag(alignment.score), data)
+        for alignment in self.block:
+            encodeVarint(len(alignment.operations), data)
+        for alignment in self.block:
+            operations = alignment.operations
+            for i in xrange(0, len(operations), 4):
+                packed = 0
+                for j, (opType, _) in enumerate(operations[i:i + 4]):
+                    packed |= OP_TYPES.index(opType) << (2 * j)
+                data.append(packed)
+        for alignment in self.block:
+            for _, length in alignment.operations:
+                encodeVarint(length, data)
+        compressed = zlib.compress(str(data))
+        self.outFile.write(struct.pack("<II", len(compressed), len(data)))
+        self.outFile.write(compressed)
+        self.block = []
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def readAlignments(inFile):
+    """Iterate over the alignments in an open binary alignment file."""
+    if inFile.read(len(MAGIC)) != MAGIC:
+        raise RuntimeError("Not a binary alignment file")
+    contigs = []
+    while True:
+        header = inFile.read(8)
+        if len(header) == 0:
+            return
+        if len(header) < 8:
+            raise RuntimeError("Truncated binary alignment file")
+        blockLength, _ = struct.unpack("<II", header)
+        compressed = inFile.read(blockLength)
+        if len(compressed) < blockLength:
+            raise RuntimeError("Truncated binary alignment file")
+        data = bytearray(zlib.decompress(compressed))
+        numNewContigs, offset = decodeVarint(data, 0)
+        for _ in xrange(numNewContigs):
+            length, offset = decodeVarint(data, offset)
+            contigs.append(str(data[offset:offset + length]))
+            offset += length
+        numAlignments, offset = decodeVarint(data, offset)
+        def column():
+            values = []
+            position = offset
+            for _ in xrange(numAlignments):
+                value, position = decodeVarint(data, position)
+                values.append(value)
+            return values, position
+        contigs1, offset = column()
+        contigs2, offset = column()
+        starts1, offset = column()
+        lengths1, offset = column()
+        starts2, offset = column()
+        lengths2, offset = column()
+        flags = data[offset:offset + numAlignments]
+        offset += numAlignments
+        scores = []
+        for flag in flags:
+            if flag & 4:
+                scores.append(struct.unpack_from("<d", buffer(data), offset)[0])
+                offset += 8
+            else:
+                score, offset = decodeVarint(data, offset)
+                scores.append(unzigzag(score))
+        numOperations, offset = column()
+        opTypes = []
+        for count in numOperations:
+            types = []
+            for i in xrange(0, count, 4):
+                packed = data[offset]
+                offset += 1
+                for j in xrange(min(4, count - i)):
+                    types.append(OP_TYPES[(packed >> (2 * j)) & 3])
+            opTypes.append(types)
+        for i in xrange(numAlignments):
+            operations = []
+            for opType in opTypes[i]:
+                length, offset = decodeVarint(data, offset)
+                operations.append((opType, length))
+            yield Alignment(contigs[contigs1[i]], starts1[i], starts1[i] + unzigzag(lengths1[i]),
+                            '+' if flags[i] & 1 else '-',
+                            contigs[contigs2[i]], starts2[i], starts2[i] + unzigzag(lengths2[i]),
+                            '+' if flags[i] & 2 else '-',
+                            scores[i], operations)
+
+def isBinaryAlignmentFile(path):
+    with open(path, 'rb') as inFile:
+        return inFile.read(len(MAGIC)) == MAGIC
+
+def readAlignmentFile(path):
+    """Iterate over the alignments in a file, which may either be binary
+    or a cigar file."""
+    if isBinaryAlignmentFile(path):
+        with open(path, 'rb') as inFile:
+            for alignment in readAlignments(inFile):
+                yield alignment
+    else:
+        with open(path) as inFile:
+            for line in inFile:
+                alignment = parseCigarLine(line)
+                if alignment is not None:
+                    yield alignment
+
+def cigarToBinary(cigarPath, binaryPath):
+    with open(binaryPath, 'wb') as outFile:
+        with AlignmentWriter(outFile) as writer:
+            for alignment in readAlignmentFile(cigarPath):
+                writer.write(alignment)
+
+def binaryToCigar(binaryPath, cigarPath):
+    with open(cigarPath, 'w') as outFile:
+        for alignment in readAlignmentFile(binaryPath):
+            outFile.write(formatCigarLine(alignment))
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("direction", choices=["toBinary", "toCigar"])
+    parser.add_argument("inputFile")
+    parser.add_argument("outputFile")
+    args = parser.parse_args()
+    if args.direction == "toBinary":
+        cigarToBinary(args.inputFile, args.outputFile)
+    else:
+        binaryToCigar(args.inputFile, args.outputFile)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+import unittest
+import os
+import random
+from sonLib.bioio import getTempFile
+from cactus.blast.binaryAlignments import Alignment, AlignmentWriter, readAlignments, \
+    readAlignmentFile, parseCigarLine, formatCigarLine, cigarToBinary, binaryToCigar, \
+    isBinaryAlignmentFile
+
+def randomAlignment(contigs):
+    operations = [(random.choice("MID"), random.randint(1, 100000)) for _ in xrange(random.randint(0, 9))]
+    start1 = random.randint(0, 10**9)
+    start2 = random.randint(0, 10**9)
+    score = random.choice([random.randint(-1000, 10**7), random.random() * 1000])
+    return Alignment(random.choice(contigs), start1, start1 + random.randint(-10**6, 10**6), random.choice("+-"),
+                     random.choice(contigs), start2, start2 + random.randint(-10**6, 10**6), random.choice("+-"),
+                     score, operations)
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.tempFiles = []
+
+    def tearDown(self):
+        for tempFile in self.tempFiles:
+            os.remove(tempFile)
+        unittest.TestCase.tearDown(self)
+
+    def getTempFile(self):
+        tempFile = getTempFile()
+        self.tempFiles.append(tempFile)
+        return tempFile
+
+    def testCigarLine(self):
+        line = "cigar: id=1|chr1|100 5 0 - chr2 10 15 + 3.5 M 2 I 1 D 3 M 2\n"
+        alignment = parseCigarLine(line)
+        self.assertEqual(alignment, Alignment("id=1|chr1|100", 5, 0, '-', "chr2", 10, 15, '+', 3.5,
+                                              [('M', 2), ('I', 1), ('D', 3), ('M', 2)]))
+        self.assertEqual(formatCigarLine(alignment), line)
+        self.assertEqual(parseCigarLine("cigar: a 0 0 + b 0 0 + 0\n").operations, [])
+        self.assertEqual(parseCigarLine("\n"), None)
+
+    def testRoundTrip(self):
+        contigs = ["a", "id=2|chr%d" % random.randint(0, 100), "x" * 300]
+        alignments = [randomAlignment(contigs) for _ in xrange(1000)]
+        path = self.getTempFile()
+        with open(path, 'wb') as outFile:
+            with AlignmentWriter(outFile, blockSize=random.randint(1, 300)) as writer:
+                for alignment in alignments:
+                    writer.write(alignment)
+        self.assertTrue(isBinaryAlignmentFile(path))
+        with open(path, 'rb') as inFile:
+            self.assertEqual(list(readAlignments(inFile)), alignments)
+
+    def testCigarConversion(self):
+        cigarPath = self.getTempFile()
+        contigs = ["a", "b", "c"]
+        lines = [formatCigarLine(randomAlignment(contigs)) for _ in xrange(100)]
+        open(cigarPath, 'w').write("".join(lines))
+        binaryPath = self.getTempFile()
+        cigarToBinary(cigarPath, binaryPath)
+        self.assertFalse(isBinaryAlignmentFile(cigarPath))
+        self.assertEqual(list(readAlignmentFile(binaryPath)), list(readAlignmentFile(cigarPath)))
+        self.assertTrue(os.path.getsize(binaryPath) < os.path.getsize(cigarPath))
+        cigarPath2 = self.getTempFile()
+        binaryToCigar(binaryPath, cigarPath2)
+        self.assertEqual(open(cigarPath2).readlines(), lines)
+
+        # An empty file converts to an empty file.
+        open(cigarPath, 'w').close()
+        cigarToBinary(cigarPath, binaryPath)
+        binaryToCigar(binaryPath, cigarPath2)
+        self.assertEqual(open(cigarPath2).read(), "")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,20 +8,24 @@ sequences. Uses the toil framework to parallelise the blasts.
 """
 import os
 import shutil
+from multiprocessing.pool import ThreadPool
 from toil.lib.bioio import logger
 from toil.lib.bioio import system
 
-from sonLib.bioio import catFiles, nameValue, popenCatch, getTempDirectory
+from sonLib.bioio import nameValue, popenCatch, getTempDirectory
 
 from cactus.shared.common import RoundedJob
 from cactus.shared.common import cactus_call
 from cactus.shared.common import runLastz, runSelfLastz
 from cactus.shared.common import runCactusRealign, runCactusSelfRealign
+from cactus.shared.common import runPipelinedBlast
 from cactus.shared.common import runGetChunks
-from cactus.shared.common import readGlobalFileWithoutCache
 from cactus.shared.common import ChildTreeJob
+from cactus.shared.fastaIndex import indexFasta, getFastaIndex
+from cactus.shared.readCache import readGlobalFileShared
 from cactus.blast.upconvertCoordinates import upconvertCoords
 from cactus.blast.trimSequences import trimSequences
+from cactus.blast.coverageIntervals import CoverageIntervals
 
 class BlastOptions(object):
     def __init__(self, chunkSize=10000000, overlapSize=10000, 
@@ -40,7 +44,19 @@ class BlastOptions(object):
                  # default because it's needed for the tests (which
                  # don't use realign.)
                  trimOutgroupFlanking=2000,
-                 keepParalogs=False):
+                 keepParalogs=False,
+                 # Connect lastz, realign and coordinate conversion
+                 # with pipes instead of intermediate files
+                 pipeline=False,
+                 # Number of concurrent realign processes (and cores)
+                 # per blast job. Ignored when pipelining.
+                 realignThreads=1,
+                 # Group chunk pairs into jobs of up to this many bytes
+                 # of sequence, run batchCores at a time (0 disables)
+                 batchSize=0, batchCores=1,
+                 # Align each chunk against all the chunks it is paired
+                 # with in one lastz run, building its seed index once
+                 chunkRows=False):
         """Class defining options for blast
         """
         self.chunkSize = chunkSize
@@ -62,6 +78,11 @@ class BlastOptions(object):
         self.trimOutgroupDepth = trimOutgroupDepth
         self.trimOutgroupFlanking = trimOutgroupFlanking
         self.keepParalogs = keepParalogs
+        self.pipeline = pipeline
+        self.realignThreads = realignThreads
+        self.batchSize = batchSize
+        self.batchCores = batchCores
+        self.chunkRows = chunkRows
 
 class BlastSequencesAllAgainstAll(RoundedJob):
     """Take a set of sequences, chunks them up and blasts them.
@@ -78,24 +99,26 @@ class BlastSequencesAllAgainstAll(RoundedJob):
         self.blastOptions.roundsOfCoordinateConversion = 1
 
     def run(self, fileStore):
-        sequenceFiles1 = [fileStore.readGlobalFile(fileID) for fileID in self.sequenceFileIDs1]
+        sequenceFiles1 = [readGlobalFileShared(fileStore, fileID) for fileID in self.sequenceFileIDs1]
         chunks = runGetChunks(sequenceFiles=sequenceFiles1, chunksDir=getTempDirectory(rootDir=fileStore.getLocalTempDir()), chunkSize = self.blastOptions.chunkSize, overlapSize=self.blastOptions.overlapSize)
         assert len(chunks) > 0
         logger.info("Broken up the sequence files into individual 'chunk' files")
         chunkIDs = [fileStore.writeGlobalFile(chunk, cleanup=True) for chunk in chunks]
+        chunkWeights = dict((chunkID, chunkWeight(chunk)) for chunkID, chunk in zip(chunkIDs, chunks))
 
-        diagonalResultsID = self.addChild(MakeSelfBlasts(self.blastOptions, chunkIDs)).rv()
-        offDiagonalResultsID = self.addChild(MakeOffDiagonalBlasts(self.blastOptions, chunkIDs)).rv()
+        diagonalResultsID = self.addChild(MakeSelfBlasts(self.blastOptions, chunkIDs, chunkWeights)).rv()
+        offDiagonalResultsID = self.addChild(MakeOffDiagonalBlasts(self.blastOptions, chunkIDs, chunkWeights)).rv()
         logger.debug("Collating the blasts after blasting all-against-all")
         return self.addFollowOn(CollateBlasts(self.blastOptions, [diagonalResultsID, offDiagonalResultsID])).rv()
         
 class MakeSelfBlasts(ChildTreeJob):
     """Breaks up the inputs into bits and builds a bunch of alignment jobs.
     """
-    def __init__(self, blastOptions, chunkIDs):
+    def __init__(self, blastOptions, chunkIDs, chunkWeights=None):
         super(MakeSelfBlasts, self).__init__(preemptable=True)
         self.blastOptions = blastOptions
         self.chunkIDs = chunkIDs
+        self.chunkWeights = chunkWeights
 
     def run(self, fileStore):
         logger.info("Chunk IDs: %s" % self.chunkIDs)
@@ -103,7 +126,8 @@ class MakeSelfBlasts(ChildTreeJob):
         self.blastOptions.compressFiles = self.blastOptions.compressFiles and len(self.chunkIDs) > 2
         resultsIDs = []
         for i in xrange(len(self.chunkIDs)):
-            resultsIDs.append(self.addChild(RunSelfBlast(self.blastOptions, self.chunkIDs[i])).rv())
+            resultsIDs.append(self.addChild(RunSelfBlast(self.blastOptions, self.chunkIDs[i]),
+                                            cost=blastCost(self.chunkWeights, self.chunkIDs[i])).rv())
         logger.info("Made the list of self blasts")
         #Setup job to make all-against-all blasts
         logger.debug("Collating self blasts.")
@@ -111,18 +135,26 @@ class MakeSelfBlasts(ChildTreeJob):
         return self.addFollowOn(CollateBlasts(self.blastOptions, resultsIDs)).rv()
 
 class MakeOffDiagonalBlasts(ChildTreeJob):
-        def __init__(self, blastOptions, chunkIDs):
+        def __init__(self, blastOptions, chunkIDs, chunkWeights=None):
             super(MakeOffDiagonalBlasts, self).__init__(preemptable=True)
             self.chunkIDs = chunkIDs
+            self.chunkWeights = chunkWeights
             self.blastOptions = blastOptions
             self.blastOptions.compressFiles = False
 
         def run(self, fileStore):
-            resultsIDs = []
             #Make the list of blast jobs.
-            for i in xrange(0, len(self.chunkIDs)):
-                for j in xrange(i+1, len(self.chunkIDs)):
-                    resultsIDs.append(self.addChild(RunBlast(blastOptions=self.blastOptions, seqFileID1=self.chunkIDs[i], seqFileID2=self.chunkIDs[j])).rv())
+            if self.blastOptions.chunkRows:
+                resultsIDs = [self.addChild(RunBlastRow(self.blastOptions, self.chunkIDs[i], self.chunkIDs[i+1:]),
+                                            cost=sum(blastCost(self.chunkWeights, self.chunkIDs[i], chunkID)
+                                                     for chunkID in self.chunkIDs[i+1:])).rv()
+                              for i in xrange(0, len(self.chunkIDs) - 1)]
+            else:
+                chunkIDPairs = []
+                for i in xrange(0, len(self.chunkIDs)):
+                    for j in xrange(i+1, len(self.chunkIDs)):
+                        chunkIDPairs.append((self.chunkIDs[i], self.chunkIDs[j]))
+                resultsIDs = addBlastJobs(self, self.blastOptions, chunkIDPairs, self.chunkWeights)
 
             return self.addFollowOn(CollateBlasts(self.blastOptions, resultsIDs)).rv()
 
@@ -141,19 +173,23 @@ class BlastSequencesAgainstEachOther(ChildTreeJob):
         self.blastOptions.roundsOfCoordinateConversion = 1
 
     def run(self, fileStore):
-        sequenceFiles1 = [fileStore.readGlobalFile(fileID) for fileID in self.sequenceFileIDs1]
-        sequenceFiles2 = [fileStore.readGlobalFile(fileID) for fileID in self.sequenceFileIDs2]
+        sequenceFiles1 = [readGlobalFileShared(fileStore, fileID) for fileID in self.sequenceFileIDs1]
+        sequenceFiles2 = [readGlobalFileShared(fileStore, fileID) for fileID in self.sequenceFileIDs2]
         chunks1 = runGetChunks(sequenceFiles=sequenceFiles1, chunksDir=getTempDirectory(rootDir=fileStore.getLocalTempDir()), chunkSize=self.blastOptions.chunkSize, overlapSize=self.blastOptions.overlapSize)
         chunks2 = runGetChunks(sequenceFiles=sequenceFiles2, chunksDir=getTempDirectory(rootDir=fileStore.getLocalTempDir()), chunkSize=self.blastOptions.chunkSize, overlapSize=self.blastOptions.overlapSize)
         chunkIDs1 = [fileStore.writeGlobalFile(chunk, cleanup=True) for chunk in chunks1]
         chunkIDs2 = [fileStore.writeGlobalFile(chunk, cleanup=True) for chunk in chunks2]
-        resultsIDs = []
+        chunkWeights = dict((chunkID, chunkWeight(chunk)) for chunkID, chunk in zip(chunkIDs1 + chunkIDs2, chunks1 + chunks2))
         #Make the list of blast jobs.
-        for chunkID1 in chunkIDs1:
-            for chunkID2 in chunkIDs2:
-                #TODO: Make the compression work
-                self.blastOptions.compressFiles = False
-                resultsIDs.append(self.addChild(RunBlast(self.blastOptions, chunkID1, chunkID2)).rv())
+        #TODO: Make the compression work
+        self.blastOptions.compressFiles = False
+        if self.blastOptions.chunkRows:
+            resultsIDs = [self.addChild(RunBlastRow(self.blastOptions, chunkID1, chunkIDs2),
+                                        cost=sum(blastCost(chunkWeights, chunkID1, chunkID2) for chunkID2 in chunkIDs2)).rv()
+                          for chunkID1 in chunkIDs1]
+        else:
+            chunkIDPairs = [(chunkID1, chunkID2) for chunkID1 in chunkIDs1 for chunkID2 in chunkIDs2]
+            resultsIDs = addBlastJobs(self, self.blastOptions, chunkIDPairs, chunkWeights)
         logger.info("Made the list of blasts")
         #Set up the job to collate all the results
         return self.addFollowOn(CollateBlasts(self.blastOptions, resultsIDs)).rv()
@@ -189,14 +225,15 @@ class BlastIngroupsAndOutgroups(RoundedJob):
                 outgroupNames=self.outgroupNames,
                 outgroupSequenceIDs=self.outgroupSequenceIDs,
                 outgroupFragmentIDs=[],
-                outgroupResultsID=None,
+                outgroupResultsIDs=[],
                 blastOptions=self.blastOptions,
                 outgroupNumber=1,
-                ingroupCoverageIDs=[]))
-            outgroupAlignmentsID = blastFirstOutgroupJob.rv(0)
+                ingroupCoverageIntervalIDs=[],
+                fastaIndexIDs={}))
+            outgroupAlignmentsIDs = blastFirstOutgroupJob.rv(0)
             outgroupFragmentIDs = blastFirstOutgroupJob.rv(1)
             ingroupCoverageIDs = blastFirstOutgroupJob.rv(2)
-            alignmentsID = self.addFollowOn(CollateBlasts(blastOptions=self.blastOptions, resultsFileIDs=[ingroupAlignmentsID, outgroupAlignmentsID])).rv()
+            alignmentsID = self.addFollowOn(CollateBlasts(blastOptions=self.blastOptions, resultsFileIDs=[ingroupAlignmentsID, outgroupAlignmentsIDs])).rv()
         else:
             alignmentsID = ingroupAlignmentsID
             outgroupFragmentIDs = None
@@ -211,8 +248,8 @@ class BlastFirstOutgroup(RoundedJob):
     """
     def __init__(self, ingroupNames, untrimmedSequenceIDs, sequenceIDs,
                  outgroupNames, outgroupSequenceIDs, outgroupFragmentIDs,
-                 outgroupResultsID, blastOptions, outgroupNumber,
-                 ingroupCoverageIDs):
+                 outgroupResultsIDs, blastOptions, outgroupNumber,
+                 ingroupCoverageIntervalIDs, fastaIndexIDs):
         super(BlastFirstOutgroup, self).__init__(memory=blastOptions.memory, preemptable=True)
         self.ingroupNames = ingroupNames
         self.untrimmedSequenceIDs = untrimmedSequenceIDs
@@ -220,10 +257,12 @@ class BlastFirstOutgroup(RoundedJob):
         self.outgroupNames = outgroupNames
         self.outgroupSequenceIDs = outgroupSequenceIDs
         self.outgroupFragmentIDs = outgroupFragmentIDs
-        self.outgroupResultsID = outgroupResultsID
+        self.outgroupResultsIDs = outgroupResultsIDs
         self.blastOptions = blastOptions
         self.outgroupNumber = outgroupNumber
-        self.ingroupCoverageIDs = ingroupCoverageIDs
+        self.ingroupCoverageIntervalIDs = ingroupCoverageIntervalIDs
+        # The persisted indexes of the untrimmed ingroups, see getFastaIndex.
+        self.fastaIndexIDs = fastaIndexIDs
 
     def run(self, fileStore):
         logger.info("Blasting ingroup sequences to outgroup %s",
@@ -240,20 +279,22 @@ class BlastFirstOutgroup(RoundedJob):
             outgroupSequenceIDs=self.outgroupSequenceIDs,
             outgroupFragmentIDs=self.outgroupFragmentIDs,
             mostRecentResultsID=alignmentsID,
-            outgroupResultsID=self.outgroupResultsID,
+            outgroupResultsIDs=self.outgroupResultsIDs,
             blastOptions=self.blastOptions,
             outgroupNumber=self.outgroupNumber,
-            ingroupCoverageIDs=self.ingroupCoverageIDs))
-        outgroupAlignmentsID = trimRecurseJob.rv(0)
+            ingroupCoverageIntervalIDs=self.ingroupCoverageIntervalIDs,
+            fastaIndexIDs=self.fastaIndexIDs))
+        outgroupAlignmentsIDs = trimRecurseJob.rv(0)
         outgroupFragmentIDs = trimRecurseJob.rv(1)
         ingroupCoverageIDs = trimRecurseJob.rv(2)
-        return (outgroupAlignmentsID, outgroupFragmentIDs, ingroupCoverageIDs)
+        return (outgroupAlignmentsIDs, outgroupFragmentIDs, ingroupCoverageIDs)
 
 class TrimAndRecurseOnOutgroups(RoundedJob):
     def __init__(self, ingroupNames, untrimmedSequenceIDs, sequenceIDs,
                  outgroupNames, outgroupSequenceIDs, outgroupFragmentIDs,
-                 mostRecentResultsID, outgroupResultsID,
-                 blastOptions, outgroupNumber, ingroupCoverageIDs):
+                 mostRecentResultsID, outgroupResultsIDs,
+                 blastOptions, outgroupNumber, ingroupCoverageIntervalIDs,
+                 fastaIndexIDs):
         super(TrimAndRecurseOnOutgroups, self).__init__(preemptable=True)
         self.ingroupNames = ingroupNames
         self.untrimmedSequenceIDs = untrimmedSequenceIDs
@@ -262,16 +303,19 @@ class TrimAndRecurseOnOutgroups(RoundedJob):
         self.outgroupSequenceIDs = outgroupSequenceIDs
         self.outgroupFragmentIDs = outgroupFragmentIDs
         self.mostRecentResultsID = mostRecentResultsID
-        self.outgroupResultsID = outgroupResultsID
+        self.outgroupResultsIDs = outgroupResultsIDs
         self.blastOptions = blastOptions
         self.outgroupNumber = outgroupNumber
-        self.ingroupCoverageIDs = ingroupCoverageIDs
+        self.ingroupCoverageIntervalIDs = ingroupCoverageIntervalIDs
+        # The persisted indexes of the untrimmed ingroups, see getFastaIndex.
+        self.fastaIndexIDs = fastaIndexIDs
 
     def run(self, fileStore):
         # Trim outgroup, convert outgroup coordinates, and add to
         # outgroup fragments dir
 
-        outgroupSequenceFiles = [fileStore.readGlobalFile(fileID) for fileID in self.outgroupSequenceIDs]
+        outgroupSequenceFiles = [readGlobalFileShared(fileStore, fileID) for fileID in self.outgroupSequenceIDs]
+        getFastaIndex(fileStore, self.outgroupSequenceIDs[0], outgroupSequenceFiles[0])
         mostRecentResultsFile = fileStore.readGlobalFile(self.mostRecentResultsID)
         trimmedOutgroup = fileStore.getLocalTempFile()
         outgroupCoverage = fileStore.getLocalTempFile()
@@ -291,8 +335,12 @@ class TrimAndRecurseOnOutgroups(RoundedJob):
                             outputFile=f)
 
         self.outgroupFragmentIDs.append(fileStore.writeGlobalFile(trimmedOutgroup))
-        sequenceFiles = [fileStore.readGlobalFile(path) for path in self.sequenceIDs]
-        untrimmedSequenceFiles = [fileStore.readGlobalFile(path) for path in self.untrimmedSequenceIDs]
+        sequenceFiles = [readGlobalFileShared(fileStore, path) for path in self.sequenceIDs]
+        untrimmedSequenceFiles = [readGlobalFileShared(fileStore, path) for path in self.untrimmedSequenceIDs]
+        # The untrimmed ingroups are the same in every round, so their
+        # indexes are only computed the first time.
+        for fileID, path in zip(self.untrimmedSequenceIDs, untrimmedSequenceFiles):
+            getFastaIndex(fileStore, fileID, path, self.fastaIndexIDs)
 
         # Report coverage of the latest outgroup on the trimmed ingroups.
         for trimmedIngroupSequence, ingroupSequence, ingroupName in zip(sequenceFiles, untrimmedSequenceFiles, self.ingroupNames):
@@ -302,42 +350,45 @@ class TrimAndRecurseOnOutgroups(RoundedJob):
             fileStore.logToMaster("Coverage on %s from outgroup #%d, %s: %s%% (current ingroup length %d, untrimmed length %d). Outgroup trimmed to %d bp from %d" % (ingroupName, self.outgroupNumber, self.outgroupNames[self.outgroupNumber - 1], percentCoverage(trimmedIngroupSequence, tmpIngroupCoverage), sequenceLength(trimmedIngroupSequence), sequenceLength(ingroupSequence), sequenceLength(trimmedOutgroup), sequenceLength(outgroupSequenceFiles[0])))
 
         # Convert the alignments' ingroup coordinates.
-        ingroupConvertedResultsFile = fileStore.getLocalTempFile()
         if self.sequenceIDs == self.untrimmedSequenceIDs:
             # No need to convert ingroup coordinates on first run.
-            shutil.copy(outgroupConvertedResultsFile,
-                        ingroupConvertedResultsFile)
+            ingroupConvertedResultsFile = outgroupConvertedResultsFile
         else:
+            ingroupConvertedResultsFile = fileStore.getLocalTempFile()
             cactus_call(parameters=["cactus_blast_convertCoordinates",
                                     "--onlyContig1",
                                     outgroupConvertedResultsFile,
                                     ingroupConvertedResultsFile,
                                     "1"])
-        # Append the latest results to the accumulated outgroup coverage file
-        if self.outgroupResultsID:
-            outgroupResultsFile = fileStore.readGlobalFile(self.outgroupResultsID, mutable=True)
-        else:
-            outgroupResultsFile = fileStore.getLocalTempFile()
-        with open(ingroupConvertedResultsFile) as results:
-            with open(outgroupResultsFile, 'a') as output:
-                output.write(results.read())
+        # Keep this round's results as a file of its own: the rounds
+        # are only concatenated once, when the results are collated.
+        self.outgroupResultsIDs.append(fileStore.writeGlobalFile(ingroupConvertedResultsFile))
 
-        self.outgroupResultsID = fileStore.writeGlobalFile(outgroupResultsFile)
-
-        # Report coverage of the all outgroup alignments so far on the ingroups.
+        # Update the coverage of all the outgroup alignments so far on
+        # the ingroups with just this round's alignments. The coverage
+        # is carried between rounds as serialized intervals.
         ingroupCoverageFiles = []
-        self.ingroupCoverageIDs = []
-        for ingroupSequence, ingroupName in zip(untrimmedSequenceFiles, self.ingroupNames):
+        previousCoverageIntervalIDs = self.ingroupCoverageIntervalIDs
+        self.ingroupCoverageIntervalIDs = []
+        for i, (ingroupSequence, ingroupName) in enumerate(zip(untrimmedSequenceFiles, self.ingroupNames)):
+            if len(previousCoverageIntervalIDs) > 0:
+                coverage = CoverageIntervals.read(fileStore.readGlobalFile(previousCoverageIntervalIDs[i]))
+            else:
+                coverage = CoverageIntervals()
+            sequenceNames = indexFasta(ingroupSequence).names()
+            coverage.addAlignments(ingroupConvertedResultsFile, sequenceNames,
+                                   depthById=self.blastOptions.trimOutgroupDepth > 1)
+            coverageIntervalsFile = fileStore.getLocalTempFile()
+            coverage.write(coverageIntervalsFile)
+            self.ingroupCoverageIntervalIDs.append(fileStore.writeGlobalFile(coverageIntervalsFile))
             ingroupCoverageFile = fileStore.getLocalTempFile()
-            calculateCoverage(sequenceFile=ingroupSequence, cigarFile=outgroupResultsFile,
-                              outputFile=ingroupCoverageFile, depthById=self.blastOptions.trimOutgroupDepth > 1)
+            coverage.writeBed(ingroupCoverageFile, sequenceNames)
             ingroupCoverageFiles.append(ingroupCoverageFile)
-            self.ingroupCoverageIDs.append(fileStore.writeGlobalFile(ingroupCoverageFile))
             fileStore.logToMaster("Cumulative coverage of %d outgroups on ingroup %s: %s" % (self.outgroupNumber, ingroupName, percentCoverage(ingroupSequence, ingroupCoverageFile)))
 
         if len(self.outgroupSequenceIDs) > 1:
             # Trim ingroup seqs and recurse on the next outgroup.
-            trimmedSeqs = []
+            trimmedSeqIDs = []
             # Use the accumulated results so far to trim away the
             # aligned parts of the ingroups.
             for i, sequenceFile in enumerate(untrimmedSequenceFiles):
@@ -349,15 +400,14 @@ class TrimAndRecurseOnOutgroups(RoundedJob):
                 else:
                     coverageFile = outgroupCoverageFile
 
-                trimmed = fileStore.getLocalTempFile()
-                trimSequences(sequenceFile, coverageFile, trimmed,
-                              complement=True, flanking=self.blastOptions.trimFlanking,
-                              minSize=self.blastOptions.trimMinSize,
-                              threshold=self.blastOptions.trimThreshold,
-                              windowSize=self.blastOptions.trimWindowSize,
-                              depth=self.blastOptions.trimOutgroupDepth)
-                trimmedSeqs.append(trimmed)
-            trimmedSeqIDs = [fileStore.writeGlobalFile(path, cleanup=True) for path in trimmedSeqs]
+                with fileStore.writeGlobalFileStream(cleanup=True) as (trimmed, trimmedID):
+                    trimSequences(sequenceFile, coverageFile, trimmed,
+                                  complement=True, flanking=self.blastOptions.trimFlanking,
+                                  minSize=self.blastOptions.trimMinSize,
+                                  threshold=self.blastOptions.trimThreshold,
+                                  windowSize=self.blastOptions.trimWindowSize,
+                                  depth=self.blastOptions.trimOutgroupDepth)
+                trimmedSeqIDs.append(trimmedID)
             return self.addChild(BlastFirstOutgroup(
                 ingroupNames=self.ingroupNames,
                 untrimmedSequenceIDs=self.untrimmedSequenceIDs,
@@ -365,13 +415,15 @@ class TrimAndRecurseOnOutgroups(RoundedJob):
                 outgroupNames=self.outgroupNames,
                 outgroupSequenceIDs=self.outgroupSequenceIDs[1:],
                 outgroupFragmentIDs=self.outgroupFragmentIDs,
-                outgroupResultsID=self.outgroupResultsID,
+                outgroupResultsIDs=self.outgroupResultsIDs,
                 blastOptions=self.blastOptions,
                 outgroupNumber=self.outgroupNumber + 1,
-                ingroupCoverageIDs=self.ingroupCoverageIDs)).rv()
+                ingroupCoverageIntervalIDs=self.ingroupCoverageIntervalIDs,
+                fastaIndexIDs=self.fastaIndexIDs)).rv()
         else:
             # Finally, put the ingroups and outgroups results together
-            return (self.outgroupResultsID, self.outgroupFragmentIDs, self.ingroupCoverageIDs)
+            ingroupCoverageIDs = [fileStore.writeGlobalFile(path) for path in ingroupCoverageFiles]
+            return (self.outgroupResultsIDs, self.outgroupFragmentIDs, ingroupCoverageIDs)
 
 def compressFastaFile(fileName):
     """Compress a fasta file.
@@ -385,6 +437,99 @@ def decompressFastaFile(fileName, tempFileName):
     system("bunzip2 --stdout %s > %s" % (fileName, tempFileName))
     return tempFileName
         
+def chunkWeight(chunkFile):
+    """Estimate the relative amount of blast work a chunk brings to a
+    pair: its number of unmasked, non-N bases, since lastz doesn't seed
+    in soft-masked sequence or Ns."""
+    index = indexFasta(chunkFile)
+    return max(1, index.totalLength() - index.totalNs() - index.totalMasked())
+
+def blastCost(chunkWeights, chunkID1, chunkID2=None):
+    """Estimate the cost of aligning two chunks (or one against itself)
+    as the product of their weights. Chunks without a weight are weighed
+    by file size."""
+    def weight(chunkID):
+        if chunkWeights is not None and chunkID in chunkWeights:
+            return chunkWeights[chunkID]
+        return getattr(chunkID, "size", 1)
+    if chunkID2 is None:
+        return weight(chunkID1)**2 / 2
+    return weight(chunkID1) * weight(chunkID2)
+
+def addBlastJobs(job, blastOptions, chunkIDPairs, chunkWeights=None):
+    """Add children to job that align each (chunkID1, chunkID2) pair,
+    returning promises of their results. If a batch size is set, pairs
+    are grouped into RunBlastBatch jobs of up to that much sequence.
+    Each child is given its estimated cost, so that a ChildTreeJob
+    starts the most expensive ones first."""
+    if blastOptions.batchSize <= 0 or \
+       not all(hasattr(chunkID, "size") for pair in chunkIDPairs for chunkID in pair):
+        return [job.addChild(RunBlast(blastOptions, chunkID1, chunkID2),
+                             cost=blastCost(chunkWeights, chunkID1, chunkID2)).rv()
+                for chunkID1, chunkID2 in chunkIDPairs]
+    batches = []
+    batch = []
+    batchSize = 0
+    for chunkID1, chunkID2 in chunkIDPairs:
+        pairSize = chunkID1.size + chunkID2.size
+        if len(batch) > 0 and batchSize + pairSize > blastOptions.batchSize:
+            batches.append(batch)
+            batch = []
+            batchSize = 0
+        batch.append((chunkID1, chunkID2))
+        batchSize += pairSize
+    if len(batch) > 0:
+        batches.append(batch)
+    resultsIDs = []
+    for batch in batches:
+        cost = sum(blastCost(chunkWeights, chunkID1, chunkID2) for chunkID1, chunkID2 in batch)
+        if len(batch) == 1:
+            resultsIDs.append(job.addChild(RunBlast(blastOptions, batch[0][0], batch[0][1]), cost=cost).rv())
+        else:
+            resultsIDs.append(job.addChild(RunBlastBatch(blastOptions, batch), cost=cost).rv())
+    return resultsIDs
+
+def runBlastPair(blastOptions, seqFile1, seqFile2, resultsFile, getLocalTempFile, realignThreads=1):
+    """Align seqFile1 against seqFile2 (or against itself, if seqFile2
+    is None), writing the alignments, in sequence coordinates, to the
+    open file resultsFile."""
+    if blastOptions.pipeline:
+        runPipelinedBlast(seqFile1, seqFile2, resultsFile,
+                          lastzArguments=blastOptions.lastzArguments,
+                          realign=blastOptions.realign,
+                          realignArguments=blastOptions.realignArguments,
+                          roundsOfCoordinateConversion=blastOptions.roundsOfCoordinateConversion)
+        return
+    blastResultsFile = getLocalTempFile()
+    if seqFile2 is None:
+        runSelfLastz(seqFile1, blastResultsFile, lastzArguments=blastOptions.lastzArguments)
+    else:
+        runLastz(seqFile1, seqFile2, blastResultsFile, lastzArguments=blastOptions.lastzArguments)
+    if blastOptions.realign:
+        realignResultsFile = getLocalTempFile()
+        if seqFile2 is None:
+            runCactusSelfRealign(seqFile1, inputAlignmentsFile=blastResultsFile,
+                                 outputAlignmentsFile=realignResultsFile,
+                                 realignArguments=blastOptions.realignArguments,
+                                 threads=realignThreads)
+        else:
+            runCactusRealign(seqFile1, seqFile2, inputAlignmentsFile=blastResultsFile,
+                             outputAlignmentsFile=realignResultsFile,
+                             realignArguments=blastOptions.realignArguments,
+                             threads=realignThreads)
+        blastResultsFile = realignResultsFile
+    cactus_call(outfile=resultsFile,
+                parameters=["cactus_blast_convertCoordinates",
+                            blastResultsFile,
+                            "/dev/stdout",
+                            str(blastOptions.roundsOfCoordinateConversion)])
+
+def realignCores(blastOptions):
+    """Cores needed by a blast job: one per realign process."""
+    if blastOptions.realign and not blastOptions.pipeline:
+        return max(1, blastOptions.realignThreads)
+    return None
+
 class RunSelfBlast(RoundedJob):
     """Runs blast as a job.
     """
@@ -392,30 +537,20 @@ class RunSelfBlast(RoundedJob):
         disk = 3*seqFileID.size
         memory = 3*seqFileID.size
         
-        super(RunSelfBlast, self).__init__(memory=memory, disk=disk, preemptable=True)
+        super(RunSelfBlast, self).__init__(memory=memory, disk=disk, cores=realignCores(blastOptions), preemptable=True)
         self.blastOptions = blastOptions
         self.seqFileID = seqFileID
     
     def run(self, fileStore):   
-        blastResultsFile = fileStore.getLocalTempFile()
-        seqFile = fileStore.readGlobalFile(self.seqFileID)
-        runSelfLastz(seqFile, blastResultsFile, lastzArguments=self.blastOptions.lastzArguments)
-        if self.blastOptions.realign:
-            realignResultsFile = fileStore.getLocalTempFile()
-            runCactusSelfRealign(seqFile, inputAlignmentsFile=blastResultsFile,
-                                 outputAlignmentsFile=realignResultsFile,
-                                 realignArguments=self.blastOptions.realignArguments)
-            blastResultsFile = realignResultsFile
-        resultsFile = fileStore.getLocalTempFile()
-        cactus_call(parameters=["cactus_blast_convertCoordinates",
-                                blastResultsFile,
-                                resultsFile,
-                                str(self.blastOptions.roundsOfCoordinateConversion)])
+        seqFile = readGlobalFileShared(fileStore, self.seqFileID)
+        with fileStore.writeGlobalFileStream() as (resultsFile, resultsID):
+            runBlastPair(self.blastOptions, seqFile, None, resultsFile,
+                         fileStore.getLocalTempFile, self.blastOptions.realignThreads)
         if self.blastOptions.compressFiles:
             #TODO: This throws away the compressed file
             seqFile = compressFastaFile(seqFile)
         logger.info("Ran the self blast okay")
-        return fileStore.writeGlobalFile(resultsFile)
+        return resultsID
     
 class RunBlast(RoundedJob):
     """Runs blast as a job.
@@ -427,34 +562,97 @@ class RunBlast(RoundedJob):
         else:
             disk = None
             memory = None
-        super(RunBlast, self).__init__(memory=memory, disk=disk, preemptable=True)
+        super(RunBlast, self).__init__(memory=memory, disk=disk, cores=realignCores(blastOptions), preemptable=True)
         self.blastOptions = blastOptions
         self.seqFileID1 = seqFileID1
         self.seqFileID2 = seqFileID2
     
     def run(self, fileStore):
-        seqFile1 = fileStore.readGlobalFile(self.seqFileID1)
-        seqFile2 = fileStore.readGlobalFile(self.seqFileID2)
+        seqFile1 = readGlobalFileShared(fileStore, self.seqFileID1)
+        seqFile2 = readGlobalFileShared(fileStore, self.seqFileID2)
         if self.blastOptions.compressFiles:
             seqFile1 = decompressFastaFile(seqFile1, fileStore.getLocalTempFile())
             seqFile2 = decompressFastaFile(seqFile2, fileStore.getLocalTempFile())
-        blastResultsFile = fileStore.getLocalTempFile()
-
-        runLastz(seqFile1, seqFile2, blastResultsFile, lastzArguments = self.blastOptions.lastzArguments)
-        if self.blastOptions.realign:
-            realignResultsFile = fileStore.getLocalTempFile()
-            runCactusRealign(seqFile1, seqFile2, inputAlignmentsFile=blastResultsFile,
-                             outputAlignmentsFile=realignResultsFile,
-                             realignArguments=self.blastOptions.realignArguments)
-            blastResultsFile = realignResultsFile
-            
-        resultsFile = fileStore.getLocalTempFile()
-        cactus_call(parameters=["cactus_blast_convertCoordinates",
-                                blastResultsFile,
-                                resultsFile,
-                                str(self.blastOptions.roundsOfCoordinateConversion)])
+        with fileStore.writeGlobalFileStream() as (resultsFile, resultsID):
+            runBlastPair(self.blastOptions, seqFile1, seqFile2, resultsFile,
+                         fileStore.getLocalTempFile, self.blastOptions.realignThreads)
         logger.info("Ran the blast okay")
-        return fileStore.writeGlobalFile(resultsFile)
+        return resultsID
+
+class RunBlastRow(RoundedJob):
+    """Aligns one chunk against a list of others. The other chunks are
+    concatenated into a single query file, so that lastz builds the seed
+    index of the target chunk once and streams the queries through it,
+    rather than rebuilding it for every pair.
+    """
+    def __init__(self, blastOptions, targetChunkID, queryChunkIDs):
+        chunkIDs = [targetChunkID] + list(queryChunkIDs)
+        if all(hasattr(chunkID, "size") for chunkID in chunkIDs):
+            disk = 2*sum(chunkID.size for chunkID in chunkIDs)
+            # lastz only indexes the target and streams the queries
+            # through, so a row needs about what its largest pair does.
+            memory = 2*(targetChunkID.size + max([chunkID.size for chunkID in queryChunkIDs] + [0]))
+        else:
+            disk = None
+            memory = None
+        super(RunBlastRow, self).__init__(memory=memory, disk=disk, cores=realignCores(blastOptions), preemptable=True)
+        self.blastOptions = blastOptions
+        self.targetChunkID = targetChunkID
+        self.queryChunkIDs = queryChunkIDs
+
+    def run(self, fileStore):
+        # lastz wants both sequence files in the same directory
+        workDir = fileStore.getLocalTempDir()
+        targetFile = readGlobalFileShared(fileStore, self.targetChunkID, userPath=os.path.join(workDir, "target.fa"))
+        queryFile = os.path.join(workDir, "queries.fa")
+        with open(queryFile, 'w') as outFile:
+            for queryChunkID in self.queryChunkIDs:
+                with fileStore.readGlobalFileStream(queryChunkID) as inFile:
+                    shutil.copyfileobj(inFile, outFile)
+        with fileStore.writeGlobalFileStream() as (resultsFile, resultsID):
+            runBlastPair(self.blastOptions, targetFile, queryFile, resultsFile,
+                         fileStore.getLocalTempFile, self.blastOptions.realignThreads)
+        logger.info("Ran a row of %d blasts okay" % len(self.queryChunkIDs))
+        return resultsID
+
+class RunBlastBatch(RoundedJob):
+    """Runs a batch of small blasts in one job, several at a time, so
+    that they don't each pay the cost of scheduling and staging a job.
+    """
+    def __init__(self, blastOptions, chunkIDPairs):
+        chunkIDs = set(chunkID for pair in chunkIDPairs for chunkID in pair)
+        cores = max(1, blastOptions.batchCores)
+        disk = 2*sum(chunkID.size for chunkID in chunkIDs)
+        memory = cores*max(2*(chunkID1.size + chunkID2.size) for chunkID1, chunkID2 in chunkIDPairs)
+        super(RunBlastBatch, self).__init__(memory=memory, disk=disk, cores=cores, preemptable=True)
+        self.blastOptions = blastOptions
+        self.chunkIDPairs = chunkIDPairs
+
+    def run(self, fileStore):
+        # Each chunk takes part in several pairs, but is only read once.
+        chunkFiles = {}
+        for chunkIDPair in self.chunkIDPairs:
+            for chunkID in chunkIDPair:
+                if chunkID not in chunkFiles:
+                    chunkFiles[chunkID] = readGlobalFileShared(fileStore, chunkID)
+        def blastPair(chunkIDPair):
+            pairResultsFile = fileStore.getLocalTempFile()
+            with open(pairResultsFile, 'w') as f:
+                runBlastPair(self.blastOptions, chunkFiles[chunkIDPair[0]], chunkFiles[chunkIDPair[1]],
+                             f, fileStore.getLocalTempFile)
+            return pairResultsFile
+        pool = ThreadPool(max(1, self.blastOptions.batchCores))
+        try:
+            pairResultsFiles = pool.map(blastPair, self.chunkIDPairs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        with fileStore.writeGlobalFileStream() as (resultsFile, resultsID):
+            for pairResultsFile in pairResultsFiles:
+                with open(pairResultsFile) as f:
+                    shutil.copyfileobj(f, resultsFile)
+        logger.info("Ran a batch of %d blasts okay" % len(self.chunkIDPairs))
+        return resultsID
 
 class CollateBlasts(RoundedJob):
     def __init__(self, blastOptions, resultsFileIDs):
@@ -463,37 +661,43 @@ class CollateBlasts(RoundedJob):
         self.resultsFileIDs = resultsFileIDs
 
     def run(self, fileStore):
-        return self.addFollowOn(CollateBlasts2(self.blastOptions, self.resultsFileIDs)).rv()
+        # Entries may themselves be lists of IDs, e.g. the per-round
+        # outgroup results.
+        resultsFileIDs = []
+        for entry in self.resultsFileIDs:
+            if isinstance(entry, list):
+                resultsFileIDs.extend(entry)
+            else:
+                resultsFileIDs.append(entry)
+        return self.addFollowOn(CollateBlasts2(self.blastOptions, resultsFileIDs)).rv()
 
 class CollateBlasts2(RoundedJob):
     """Collates all the blasts into a single alignments file.
     """
     def __init__(self, blastOptions, resultsFileIDs):
-        disk = 8*sum([alignmentID.size for alignmentID in resultsFileIDs])
         memory = blastOptions.memory
+        # The inputs are streamed, but the file store may still stage the
+        # collated output on local disk before it goes to the job store.
+        disk = sum([alignmentID.size for alignmentID in resultsFileIDs])
         super(CollateBlasts2, self).__init__(memory=memory, disk=disk, preemptable=True)
         self.resultsFileIDs = resultsFileIDs
     
     def run(self, fileStore):
         logger.info("Results IDs: %s" % self.resultsFileIDs)
-        resultsFiles = [readGlobalFileWithoutCache(fileStore, fileID) for fileID in self.resultsFileIDs]
-        collatedResultsFile = fileStore.getLocalTempFile()
-        catFiles(resultsFiles, collatedResultsFile)
-        logger.info("Collated the alignments to the file: %s",  collatedResultsFile)
-        collatedResultsID = fileStore.writeGlobalFile(collatedResultsFile)
+        # Stream the results straight from the job store into the
+        # collated file, rather than reading a local copy of each first.
+        with fileStore.writeGlobalFileStream() as (collatedResultsFile, collatedResultsID):
+            for resultsFileID in self.resultsFileIDs:
+                with fileStore.jobStore.readFileStream(resultsFileID) as resultsFile:
+                    shutil.copyfileobj(resultsFile, collatedResultsFile)
+        logger.info("Collated the alignments to the file: %s",  collatedResultsID)
         for resultsFileID in self.resultsFileIDs:
             fileStore.deleteGlobalFile(resultsFileID)
         return collatedResultsID
 
 def sequenceLength(sequenceFile):
     """Get the total # of bp from a fasta file."""
-    seqLength = 0
-    for line in open(sequenceFile):
-        line = line.strip()
-        if line == '' or line[0] == '>':
-            continue
-        seqLength += len(line)
-    return seqLength
+    return indexFasta(sequenceFile).totalLength()
 
 def percentCoverage(sequenceFile, coverageFile):
     """Get the % coverage of a sequence from a coverage file."""
@@ -110,6 +110,61 @@ class TestCase(unittest.TestCase):
         """
         self.runComparisonOfBlastScriptVsNaiveBlast(blastMode="againstEachOther")
 
+    def testPipelinedBlast(self):
+        """Connecting lastz, realign and coordinate conversion with
+        pipes should give exactly the same alignments as running them
+        one after another through intermediate files.
+        """
+        regionPath = os.path.join(self.encodePath, "ENm001")
+        seqFile1 = os.path.join(regionPath, "human.ENm001.fa")
+        seqFile2 = os.path.join(regionPath, "mouse.ENm001.fa")
+        for realign in (False, True):
+            for outputFile, pipeline in ((self.tempOutputFile, False), (self.tempOutputFile2, True)):
+                toilDir = os.path.join(getTempDirectory(self.tempDir), "toil")
+                runCactusBlast(sequenceFiles=[ seqFile1 ], alignmentsFile=outputFile,
+                               toilDir=toilDir, chunkSize=500000, overlapSize=10000,
+                               targetSequenceFiles=[ seqFile2 ],
+                               realign=realign, pipeline=pipeline)
+                checkCigar(outputFile)
+            self.assertEqual(sorted(open(self.tempOutputFile).readlines()),
+                             sorted(open(self.tempOutputFile2).readlines()))
+
+    def testBatchedBlast(self):
+        """Running several chunk pairs in one job should give the same
+        alignments as running each pair in its own job.
+        """
+        regionPath = os.path.join(self.encodePath, "ENm001")
+        seqFile1 = os.path.join(regionPath, "human.ENm001.fa")
+        seqFile2 = os.path.join(regionPath, "mouse.ENm001.fa")
+        for outputFile, batchSize in ((self.tempOutputFile, 0), (self.tempOutputFile2, 1000000)):
+            toilDir = os.path.join(getTempDirectory(self.tempDir), "toil")
+            runCactusBlast(sequenceFiles=[ seqFile1 ], alignmentsFile=outputFile,
+                           toilDir=toilDir, chunkSize=100000, overlapSize=10000,
+                           targetSequenceFiles=[ seqFile2 ],
+                           batchSize=batchSize, batchCores=2)
+            checkCigar(outputFile)
+        self.assertEqual(sorted(open(self.tempOutputFile).readlines()),
+                         sorted(open(self.tempOutputFile2).readlines()))
+
+    def testChunkRows(self):
+        """Aligning each chunk against all its partners in one lastz run
+        should give the same alignments as aligning each pair
+        separately, both all-against-all and against a target.
+        """
+        regionPath = os.path.join(self.encodePath, "ENm001")
+        seqFile1 = os.path.join(regionPath, "human.ENm001.fa")
+        seqFile2 = os.path.join(regionPath, "mouse.ENm001.fa")
+        for targetSequenceFiles in (None, [ seqFile2 ]):
+            for outputFile, chunkRows in ((self.tempOutputFile, False), (self.tempOutputFile2, True)):
+                toilDir = os.path.join(getTempDirectory(self.tempDir), "toil")
+                runCactusBlast(sequenceFiles=[ seqFile1 ], alignmentsFile=outputFile,
+                               toilDir=toilDir, chunkSize=100000, overlapSize=10000,
+                               targetSequenceFiles=targetSequenceFiles,
+                               chunkRows=chunkRows)
+                checkCigar(outputFile)
+            self.assertEqual(sorted(open(self.tempOutputFile).readlines()),
+                             sorted(open(self.tempOutputFile2).readlines()))
+
     def testAddingOutgroupsImprovesResult(self):
         """Run blast on "ingroup" and "outgroup" encode regions, and ensure
         that adding an extra outgroup only adds alignments if
@@ -455,13 +510,23 @@ def runCactusBlast(sequenceFiles, alignmentsFile, toilDir,
                    logLevel=None, 
                    compressFiles=None,
                    lastzMemory=None,
-                   targetSequenceFiles=None):
+                   targetSequenceFiles=None,
+                   realign=False,
+                   pipeline=False,
+                   batchSize=0,
+                   batchCores=1,
+                   chunkRows=False):
     
     options = Job.Runner.getDefaultOptions(toilDir)
     options.logLevel = "CRITICAL"
     blastOptions = BlastOptions(chunkSize=chunkSize, overlapSize=overlapSize,
                                 compressFiles=compressFiles,
-                                memory=lastzMemory)
+                                memory=lastzMemory,
+                                realign=realign,
+                                pipeline=pipeline,
+                                batchSize=batchSize,
+                                batchCores=batchCores,
+                                chunkRows=chunkRows)
     with Toil(options) as toil:
         seqIDs = [toil.importFile(makeURL(seqFile)) for seqFile in sequenceFiles]
 
@@ -77,6 +77,27 @@ class TestCase(unittest.TestCase):
                 lastzCigar = cigarReadFromString(lastzLine)
                 self.assertTrue(realignCigar.sameCoordinates(lastzCigar))
     
+    def testCactusRealignThreads(self):
+        """Realigning in parallel batches should give exactly the same
+        output, in the same order, as a single realign process.
+        """
+        for seqFile1, seqFile2 in seqFilePairGenerator():
+            lastzOutput = getTempFile(rootDir=self.tempDir)
+            runLastz(seqFile1, seqFile2, alignmentsFile=lastzOutput,
+                     lastzArguments=self.defaultLastzArguments,
+                     work_dir=self.tempDir)
+            realignOutput = getTempFile(rootDir=self.tempDir)
+            runCactusRealign(seqFile1, seqFile2, inputAlignmentsFile = lastzOutput,
+                             outputAlignmentsFile = realignOutput,
+                             realignArguments=self.defaultRealignArguments,
+                             work_dir=self.tempDir)
+            threadedRealignOutput = getTempFile(rootDir=self.tempDir)
+            runCactusRealign(seqFile1, seqFile2, inputAlignmentsFile = lastzOutput,
+                             outputAlignmentsFile = threadedRealignOutput,
+                             realignArguments=self.defaultRealignArguments,
+                             work_dir=self.tempDir, threads=4)
+            self.assertEquals(open(realignOutput).read(), open(threadedRealignOutput).read())
+
     def testCactusRealignSplitSequences(self):
         """Runs cactus realign, splitting indels longer than 100bp, and check
         that the coverage from the results is the same as the coverage from
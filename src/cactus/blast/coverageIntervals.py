@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+"""Coverage of a genome by alignments, kept as run-length intervals.
+
+Used to track the cumulative coverage of the ingroups by the outgroup
+alignments across outgroup rounds: each round only adds its own
+alignments, and the intervals are serialized compactly between rounds
+instead of recomputing coverage from every round's alignments.
+"""
+import struct
+import zlib
+from collections import defaultdict
+from itertools import groupby
+from operator import itemgetter
+
+from cactus.blast.binaryAlignments import readAlignmentFile
+
+def alignedIntervals(contig, operations, advancingOps):
+    """Get the [start, end) intervals of a contig covered by the matches
+    of an alignment. advancingOps are the operations that move along
+    this contig."""
+    name, start, end, strand = contig
+    position = start
+    forward = strand == '+'
+    intervals = []
+    for opType, length in operations:
+        if opType == 'M':
+            intervals.append((position, position + length) if forward else (position - length, position))
+        if opType in advancingOps:
+            position += length if forward else -length
+    if len(intervals) > 0 and (min(s for s, _ in intervals) < min(start, end) or
+                               max(e for _, e in intervals) > max(start, end)):
+        raise RuntimeError("Alignment on %s:%d-%d goes past the end of its range" % (name, start, end))
+    return intervals
+
+def alignmentIntervals(first, second, operations):
+    """Get the intervals covered on each of the two contigs of an
+    alignment. As in cactus_coverage, matches and insertions move along
+    the first contig and matches and deletions along the second."""
+    return (alignedIntervals(first, operations, 'MI'),
+            alignedIntervals(second, operations, 'MD'))
+
+def unionOfIntervals(intervals):
+    """Merge overlapping [start, end) intervals."""
+    ret = []
+    for start, end in sorted(intervals):
+        if len(ret) > 0 and start <= ret[-1][1]:
+            ret[-1] = (ret[-1][0], max(ret[-1][1], end))
+        else:
+            ret.append((start, end))
+    return ret
+
+class CoverageIntervals(object):
+    """Per-sequence coverage depth, as sorted, disjoint (start, end,
+    depth) runs of non-zero depth."""
+    def __init__(self):
+        self.runs = {}
+
+    def add(self, name, intervals):
+        """Add one to the depth over each of the [start, end) intervals
+        on the given sequence."""
+        changes = []
+        for start, end, depth in self.runs.get(name, []):
+            changes.append((start, depth))
+            changes.append((end, -depth))
+        for start, end in intervals:
+            changes.append((start, 1))
+            changes.append((end, -1))
+        runs = []
+        depth = 0
+        regionStart = 0
+        for position, positionChanges in groupby(sorted(changes), key=itemgetter(0)):
+            prevDepth = depth
+            depth += sum(change for _, change in positionChanges)
+            if depth != prevDepth:
+                if prevDepth != 0:
+                    runs.append((regionStart, position, prevDepth))
+                regionStart = position
+        self.runs[name] = runs
+
+    def addAlignments(self, cigarFile, sequenceNames, depthById=False):
+        """Add the coverage on the given sequences from the matches in a
+        cigar (or binary alignment) file, counting both contigs of each
+        alignment, like cactus_coverage does.
+
+        With depthById, the alignments should all come from one other
+        genome (e.g. one outgroup round), so that depth counts the
+        number of rounds covering each base."""
+        sequenceNames = set(sequenceNames)
+        intervals = defaultdict(list)
+        for alignment in readAlignmentFile(cigarFile):
+            first = alignment[0:4]
+            second = alignment[4:8]
+            firstIntervals, secondIntervals = alignmentIntervals(first, second, alignment.operations)
+            if first[0] in sequenceNames:
+                intervals[first[0]].extend(firstIntervals)
+            if second[0] in sequenceNames:
+                intervals[second[0]].extend(secondIntervals)
+        for name, nameIntervals in intervals.items():
+            if depthById:
+                nameIntervals = unionOfIntervals(nameIntervals)
+            self.add(name, nameIntervals)
+
+    def coveredBases(self):
+        return sum(end - start for runs in self.runs.values() for start, end, _ in runs)
+
+    def writeBed(self, bedFile, sequenceNames):
+        """Write the coverage as a bed in the format output by
+        cactus_coverage, with the sequences in the order given."""
+        with open(bedFile, 'w') as bed:
+            for name in sequenceNames:
+                for start, end, depth in self.runs.get(name, []):
+                    bed.write("%s\t%d\t%d\t\t%d\n" % (name, start, end, depth))
+
+    def write(self, path):
+        """Serialize the runs, delta-encoded as little-endian 64-bit
+        integers and compressed."""
+        chunks = []
+        for name, runs in sorted(self.runs.items()):
+            encoded = []
+            prevEnd = 0
+            for start, end, depth in runs:
+                encoded.extend((start - prevEnd, end - start, depth))
+                prevEnd = end
+            chunks.append(struct.pack("<ii", len(name), len(runs)) + name +
+                          struct.pack("<%dq" % len(encoded), *encoded))
+        with open(path, 'wb') as outFile:
+            outFile.write(zlib.compress("".join(chunks)))
+
+    @staticmethod
+    def read(path):
+        ret = CoverageIntervals()
+        with open(path, 'rb') as inFile:
+            data = zlib.decompress(inFile.read())
+        offset = 0
+        while offset < len(data):
+            nameLength, numRuns = struct.unpack_from("<ii", data, offset)
+            offset += struct.calcsize("<ii")
+            name = data[offset:offset + nameLength]
+            offset += nameLength
+            encoded = struct.unpack_from("<%dq" % (3 * numRuns), data, offset)
+            offset += struct.calcsize("<%dq" % (3 * numRuns))
+            runs = []
+            prevEnd = 0
+            for i in xrange(0, len(encoded), 3):
+                start = prevEnd + encoded[i]
+                prevEnd = start + encoded[i + 1]
+                runs.append((start, prevEnd, encoded[i + 2]))
+            ret.runs[name] = runs
+        return ret
@@ -0,0 +1,78 @@
+import unittest
+import os
+import random
+from sonLib.bioio import getTempFile
+from cactus.blast.coverageIntervals import CoverageIntervals
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.tempFiles = []
+
+    def tearDown(self):
+        for tempFile in self.tempFiles:
+            os.remove(tempFile)
+        unittest.TestCase.tearDown(self)
+
+    def getTempFile(self):
+        tempFile = getTempFile()
+        self.tempFiles.append(tempFile)
+        return tempFile
+
+    def testAdd(self):
+        coverage = CoverageIntervals()
+        coverage.add("a", [(5, 8), (5, 8)])
+        coverage.add("a", [(0, 5), (0, 5), (7, 9)])
+        self.assertEqual(coverage.runs["a"], [(0, 7, 2), (7, 8, 3), (8, 9, 1)])
+        self.assertEqual(coverage.coveredBases(), 9)
+
+    def testAddAlignments(self):
+        cigarFile = self.getTempFile()
+        open(cigarFile, 'w').write("cigar: a 0 10 + b 5 13 + 0 M 4 I 2 M 4\n"
+                                   "cigar: a 10 0 - c 0 8 + 0 M 4 I 2 M 4\n"
+                                   "cigar: c 2 6 + a 8 4 - 0 M 4\n")
+        coverage = CoverageIntervals()
+        coverage.addAlignments(cigarFile, ["a", "b"])
+        self.assertEqual(coverage.runs["a"], [(0, 4, 2), (4, 6, 1), (6, 8, 3), (8, 10, 2)])
+        self.assertEqual(coverage.runs["b"], [(5, 13, 1)])
+        self.assertFalse("c" in coverage.runs)
+
+        coverage = CoverageIntervals()
+        coverage.addAlignments(cigarFile, ["a"], depthById=True)
+        coverage.addAlignments(cigarFile, ["a"], depthById=True)
+        self.assertEqual(coverage.runs["a"], [(0, 10, 2)])
+
+        # Operations that don't fit the conventions are an error, as
+        # they are for cactus_coverage, rather than being reinterpreted.
+        open(cigarFile, 'w').write("cigar: a 0 8 + b 5 15 + 0 M 4 I 2 M 4\n")
+        self.assertRaises(RuntimeError, CoverageIntervals().addAlignments, cigarFile, ["a", "b"])
+
+    def testWriteBed(self):
+        coverage = CoverageIntervals()
+        coverage.add("b", [(0, 10)])
+        coverage.add("a", [(5, 8), (6, 7)])
+        bedFile = self.getTempFile()
+        coverage.writeBed(bedFile, ["a", "b", "c"])
+        self.assertEqual(open(bedFile).read(),
+                         "a\t5\t6\t\t1\n"
+                         "a\t6\t7\t\t2\n"
+                         "a\t7\t8\t\t1\n"
+                         "b\t0\t10\t\t1\n")
+
+    def testSerialization(self):
+        coverage = CoverageIntervals()
+        coverage.add("big", [(2**40, 2**40 + 5)])
+        for name in ["a", "id=1|chr1", ""]:
+            intervals = []
+            for i in xrange(100):
+                start = random.randint(0, 1000000)
+                intervals.append((start, start + random.randint(1, 10000)))
+            coverage.add(name, intervals)
+        path = self.getTempFile()
+        coverage.write(path)
+        self.assertEqual(CoverageIntervals.read(path).runs, coverage.runs)
+        CoverageIntervals().write(path)
+        self.assertEqual(CoverageIntervals.read(path).runs, {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,8 @@
 from collections import defaultdict
 from operator import itemgetter
 
+from cactus.shared.fastaIndex import indexFasta, MappedFasta
+
 def windowFilter(windowSize, threshold, blockDict, seqLengths):
     if windowSize == 1 and threshold == 1:
         # Don't need to do expensive window-filtering
@@ -85,21 +87,6 @@ def getSeparateBedBlocks(bedFile, depth=1):
                                      score))
     return ret
 
-def getSeqLengths(fastaFile):
-    """Get a dict which maps header -> sequence size."""
-    ret = defaultdict(int)
-    chr = ""
-    for line in fastaFile:
-        line = line.strip()
-        if len(line) == 0:
-            # Blank line
-            continue
-        if line[0] == '>':
-            chr = line.split()[0][1:]
-        else:
-            ret[chr] += len(line)
-    return ret
-
 def complementBlocks(blocksDict, seqLengths):
     """Complement a sorted block-dict."""
     ret = defaultdict(list)
@@ -117,34 +104,20 @@ def complementBlocks(blocksDict, seqLengths):
             ret[chr].append((0, len))
     return ret
 
-def printTrimmedSeq(header, seq, blocks, outFile):
-    for block in blocks:
-        outFile.write(">%s|%d\n" % (header, block[0]))
-        outFile.write(seq[block[0]:block[1]])
-        outFile.write("\n")
-
-def printTrimmedFasta(fastaFile, toTrim, outFile):
-    header = None
-    seq = None
-    for line in fastaFile:
-        line = line.strip()
-        if len(line) == 0:
-            # Blank line
-            continue
-        if line[0] == '>':
-            if seq is not None:
-                printTrimmedSeq(header, seq, toTrim[header], outFile)
-            seq = ""
-            header = line[1:].split()[0]
-            continue
-        seq += line
-    if seq is not None:
-        printTrimmedSeq(header, seq, toTrim[header], outFile)
+def printTrimmedFasta(fastaPath, toTrim, outFile, fastaIndex=None):
+    """Print the blocks in toTrim as separate sequences named
+    header|start, reading only the bases in the blocks."""
+    with MappedFasta(fastaPath, fastaIndex) as fasta:
+        for header in fasta.index.names():
+            for block in toTrim.get(header, []):
+                outFile.write(">%s|%d\n" % (header, block[0]))
+                outFile.write(fasta.getSubsequence(header, block[0], block[1]))
+                outFile.write("\n")
 
 def trimSequences(fastaPath, bedPath, outputPathOrFile, flanking=0, minSize=0,
                   windowSize=10, threshold=0.8, depth=1, complement=False):
-    fastaFile = open(fastaPath)
-    seqLengths = getSeqLengths(fastaFile)
+    fastaIndex = indexFasta(fastaPath)
+    seqLengths = fastaIndex.getLengths()
     with open(bedPath) as bedFile:
         toTrim = windowFilter(windowSize, threshold,
                               getSeparateBedBlocks(bedFile, depth), seqLengths)
@@ -160,11 +133,10 @@ def trimSequences(fastaPath, bedPath, outputPathOrFile, flanking=0, minSize=0,
                           v))
                   for k, v in toTrim.items())
 
-    fastaFile.seek(0)
     try:
         outputPathOrFile.write('')
         outputFile = outputPathOrFile
     except:
         # Not a file
         outputFile = open(outputPathOrFile, 'w')
-    printTrimmedFasta(fastaFile, toTrim, outputFile)
+    printTrimmedFasta(fastaPath, toTrim, outputFile, fastaIndex)
@@ -4,36 +4,17 @@ from collections import defaultdict
 import sys
 import os
 from sonLib.bioio import cigarRead, cigarWrite, getTempFile, system
+from cactus.shared.fastaIndex import indexFasta
 
-def getSequenceRanges(fa):
+def getSequenceRanges(fastaIndex):
     """Get dict of (untrimmed header) -> [(start, non-inclusive end)] mappings
-    from a trimmed fasta."""
+    from the index of a trimmed fasta."""
     ret = defaultdict(list)
-    curSeq = ""
-    curHeader = None
-    curTrimmedStart = None
-    for line in fa:
-        line = line.strip()
-        if line == '':
-            continue
-        if line[0] == '>':
-            if curHeader is not None:
-                # Add previous seq info to dict
-                trimmedRange = (curTrimmedStart,
-                                curTrimmedStart + len(curSeq))
-                untrimmedHeader = "|".join(curHeader.split("|")[:-1])
-                ret[untrimmedHeader].append(trimmedRange)
-            curHeader = line[1:].split()[0]
-            curTrimmedStart = int(curHeader.split('|')[-1])
-            curSeq = ""
-        else:
-            curSeq += line
-    if curHeader is not None:
-        # Add final seq info to dict
-        trimmedRange = (curTrimmedStart,
-                        curTrimmedStart + len(curSeq))
-        untrimmedHeader = "|".join(curHeader.split("|")[:-1])
-        ret[untrimmedHeader].append(trimmedRange)
+    for record in fastaIndex.records:
+        trimmedStart = int(record.name.split('|')[-1])
+        untrimmedHeader = "|".join(record.name.split("|")[:-1])
+        ret[untrimmedHeader].append((trimmedStart,
+                                     trimmedStart + record.length))
     for key in ret.keys():
         # Sort by range's start pos
         ret[key] = sorted(ret[key], key=lambda x: x[0])
@@ -64,8 +45,7 @@ def upconvertCoords(cigarPath, fastaPath, contigNum, outputFile):
     """Convert the coordinates of the given alignment, so that the
     alignment refers to a set of trimmed sequences originating from a
     contig rather than to the contig itself."""
-    with open(fastaPath) as f:
-        seqRanges = getSequenceRanges(f)
+    seqRanges = getSequenceRanges(indexFasta(fastaPath))
     validateRanges(seqRanges)
     sortedCigarPath = sortCigarByContigAndPos(cigarPath, contigNum)
     sortedCigarFile = open(sortedCigarPath)
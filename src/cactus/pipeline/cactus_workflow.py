@@ -17,6 +17,8 @@ import math
 import time
 import random
 import copy
+import shutil
+import uuid
 from argparse import ArgumentParser
 from operator import itemgetter
 
@@ -58,7 +60,7 @@ from cactus.shared.common import findRequiredNode
 from cactus.shared.common import runConvertAlignmentsToInternalNames
 from cactus.shared.common import runStripUniqueIDs
 from cactus.shared.common import RoundedJob
-from cactus.shared.common import readGlobalFileWithoutCache
+from cactus.shared.readCache import readGlobalFileShared
 
 from cactus.blast.blast import BlastIngroupsAndOutgroups
 from cactus.blast.blast import BlastOptions
@@ -68,8 +70,12 @@ from cactus.preprocessor.cactus_preprocessor import CactusPreprocessor
 from cactus.shared.experimentWrapper import ExperimentWrapper
 from cactus.shared.experimentWrapper import DbElemWrapper
 from cactus.shared.configWrapper import ConfigWrapper
+from cactus.shared.configWrapper import ResolvedConfig
 from cactus.pipeline.ktserverToil import KtServerService
-from cactus.pipeline.ktserverControl import stopKtserver
+from cactus.pipeline.ktClient import KtClientError
+from cactus.pipeline.ktserverControl import stopKtserver, resetSecondaryDB, releaseSecondaryDB, \
+    checkPrimaryDBWrites
+from cactus.pipeline.snapshotDelta import materializeSnapshot
 
 ############################################################
 ############################################################
@@ -80,9 +86,11 @@ from cactus.pipeline.ktserverControl import stopKtserver
 ############################################################
 
 def extractNode(node):
-    """Make an XML node free of its parent subtree
+    """Make a copy of an XML node whose attributes can be changed
+    without affecting the original. The children are shared, not
+    copied, as jobs only ever change the attributes of their phase node.
     """
-    return ET.fromstring(ET.tostring(node))
+    return node.copy()
 
 def getJobNode(phaseNode, jobClass):
     """Gets a job node for a given job.
@@ -172,6 +180,19 @@ class CactusPhasesJob(CactusJob):
         CactusJob.__init__(self, phaseNode=phaseNode, constantsNode=constantsNode, overlarge=False,
                            checkpoint=checkpoint, preemptable=preemptable)
 
+    def getOptionalPhaseAttrib(self, attribName, typeFn=None, default=None):
+        """Gets an optional attribute of the phase, from the workflow's
+        resolved config rather than by walking the phase node.
+        """
+        return self.cactusWorkflowArguments.resolvedConfig.getAttrib(self.phaseName, attribName, typeFn=typeFn, default=default)
+
+    def setPhaseAttribs(self, **attribs):
+        """Sets attributes of the phase node, for the phase's recursive
+        jobs and the phase jobs that follow it.
+        """
+        self.phaseNode.attrib.update(attribs)
+        self.cactusWorkflowArguments.resolveConfig()
+
     def makeRecursiveChildJob(self, job, launchSecondaryKtForRecursiveJob=False):
         newChild = job(phaseNode=extractNode(self.phaseNode), 
                        constantsNode=extractNode(self.constantsNode),
@@ -181,16 +202,20 @@ class CactusPhasesJob(CactusJob):
                        overlarge=True,
                        cactusWorkflowArguments=self.cactusWorkflowArguments)
 
-        if launchSecondaryKtForRecursiveJob and ExperimentWrapper(self.cactusWorkflowArguments.experimentNode).getDbType() == "kyoto_tycoon":
-            cw = ConfigWrapper(self.cactusWorkflowArguments.configNode)
-            memory = max(2500000000, self.evaluateResourcePoly([4.10201882, 2.01324291e+08]))
-            cpu = cw.getKtserverCpu(default=0.1)
-            dbElem = ExperimentWrapper(self.cactusWorkflowArguments.scratchDbElemNode)
-            dbString = self.addService(KtServerService(dbElem=dbElem, isSecondary=True, memory=memory, cores=cpu)).rv(0)
-            newChild.phaseNode.attrib["secondaryDatabaseString"] = dbString
-            return self.addChild(newChild).rv()
-        else:
-            return self.addChild(newChild).rv()
+        if launchSecondaryKtForRecursiveJob and ExperimentWrapper(self.cactusWorkflowArguments.experimentNode).getDbType() == "kyoto_tycoon" \
+           and not self.cactusWorkflowArguments.secondaryDBPooled:
+            # Otherwise the phase node already points to the pooled secondary DB.
+            newChild.phaseNode.attrib["secondaryDatabaseString"] = self.addSecondaryDBService()
+        return self.addChild(newChild).rv()
+
+    def addSecondaryDBService(self):
+        """Start a secondary (scratch) ktserver as a service of this job,
+        returning a promise of its conf string."""
+        cw = ConfigWrapper(self.cactusWorkflowArguments.configNode)
+        memory = max(2500000000, self.evaluateResourcePoly([4.10201882, 2.01324291e+08]))
+        cpu = cw.getKtserverCpu(default=0.1)
+        dbElem = ExperimentWrapper(self.cactusWorkflowArguments.scratchDbElemNode)
+        return self.addService(KtServerService(dbElem=dbElem, isSecondary=True, memory=memory, cores=cpu)).rv(0)
 
     def makeFollowOnPhaseJob(self, job, phaseName):
         return self.addFollowOn(job(cactusWorkflowArguments=self.cactusWorkflowArguments, phaseName=phaseName, 
@@ -208,11 +233,34 @@ class CactusPhasesJob(CactusJob):
 
     def makeFollowOnCheckpointJob(self, checkpointConstructor, phaseName, ktServerDump=None):
         """Add a follow-on checkpoint phase."""
-        return self.addFollowOn(checkpointConstructor(\
-                   phaseName=phaseName, ktServerDump=ktServerDump,
-                   cactusWorkflowArguments=self.cactusWorkflowArguments,
-                   topFlowerName=self.topFlowerName,
-                   halID=self.halID, fastaID=self.fastaID)).rv()
+        checkpoint = checkpointConstructor(phaseName=phaseName, ktServerDump=ktServerDump,
+                                           cactusWorkflowArguments=self.cactusWorkflowArguments,
+                                           topFlowerName=self.topFlowerName,
+                                           halID=self.halID, fastaID=self.fastaID)
+        job = checkpoint
+        if not self.cactusWorkflowArguments.primaryDBHandedOver and \
+           self.cactusWorkflowArguments.experimentWrapper.getDbType() == "kyoto_tycoon" and \
+           ConfigWrapper(self.cactusWorkflowArguments.configNode).getKtserverHandOver():
+            # Start the primary DB once, for this checkpoint and all the
+            # ones that follow it, which then run while it is up.
+            job = StartPrimaryDB(checkpoint, ktServerDump=ktServerDump, handOver=True,
+                                 cactusWorkflowArguments=self.cactusWorkflowArguments,
+                                 phaseName=phaseName, topFlowerName=self.topFlowerName)
+        if checkpointConstructor.startsSecondaryDBPool and self.shouldPoolSecondaryDB():
+            # Likewise, start the secondary DB once for the phases that use it.
+            job = StartSecondaryDB(job, cactusWorkflowArguments=self.cactusWorkflowArguments,
+                                   phaseName=phaseName, topFlowerName=self.topFlowerName)
+        return self.addFollowOn(job).rv()
+
+    def shouldPoolSecondaryDB(self):
+        """Should one secondary DB be started for the phases that follow,
+        rather than one for each phase that uses it?"""
+        configNode = self.cactusWorkflowArguments.configNode
+        return not self.cactusWorkflowArguments.secondaryDBPooled and \
+            self.cactusWorkflowArguments.experimentWrapper.getDbType() == "kyoto_tycoon" and \
+            ConfigWrapper(configNode).getKtserverPoolSecondaryDB() and \
+            (self.cactusWorkflowArguments.resolvedConfig.getAttrib("reference", "buildReference", bool, False) or
+             ConfigWrapper(configNode).getBuildHal())
 
     def getPhaseNumber(self):
         return len(self.cactusWorkflowArguments.configNode.findall(self.phaseNode.tag))
@@ -222,7 +270,10 @@ class CactusPhasesJob(CactusJob):
         """
         confXML = ET.fromstring(self.cactusWorkflowArguments.secondaryDatabaseString)
         dbElem = DbElemWrapper(confXML)
-        if dbElem.getDbType() != "kyoto_tycoon":
+        if self.cactusWorkflowArguments.secondaryDBPooled:
+            # Wipe whatever the last phase to use the DB left behind.
+            resetSecondaryDB(dbElem, self.phaseName)
+        elif dbElem.getDbType() != "kyoto_tycoon":
             runCactusSecondaryDatabase(self.cactusWorkflowArguments.secondaryDatabaseString, create=True)
 
     def cleanupSecondaryDatabase(self):
@@ -230,7 +281,9 @@ class CactusPhasesJob(CactusJob):
         """
         confXML = ET.fromstring(self.cactusWorkflowArguments.secondaryDatabaseString)
         dbElem = DbElemWrapper(confXML)
-        if dbElem.getDbType() != "kyoto_tycoon":
+        if self.cactusWorkflowArguments.secondaryDBPooled:
+            releaseSecondaryDB(dbElem, self.phaseName)
+        elif dbElem.getDbType() != "kyoto_tycoon":
             runCactusSecondaryDatabase(self.cactusWorkflowArguments.secondaryDatabaseString, create=False)
 
 class CactusCheckpointJob(CactusPhasesJob):
@@ -243,6 +296,10 @@ class CactusCheckpointJob(CactusPhasesJob):
     that the checkpointed job is technically this job's child, which
     starts the database.
     """
+    # Set if the phases from this checkpoint on share a secondary DB,
+    # see StartSecondaryDB.
+    startsSecondaryDBPool = False
+
     def __init__(self, ktServerDump=None, *args, **kwargs):
         self.ktServerDump = ktServerDump
         super(CactusCheckpointJob, self).__init__(*args, **kwargs)
@@ -252,17 +309,62 @@ class CactusCheckpointJob(CactusPhasesJob):
         """
         job = jobConstructor(cactusWorkflowArguments=self.cactusWorkflowArguments,
                              phaseName=self.phaseName, topFlowerName=self.topFlowerName)
+        if self.cactusWorkflowArguments.primaryDBHandedOver:
+            # The DB is still up from the last phase.
+            return self.addChild(job)
         startDBJob = StartPrimaryDB(job, ktServerDump=self.ktServerDump,
                                     cactusWorkflowArguments=self.cactusWorkflowArguments,
                                     phaseName=self.phaseName, topFlowerName=self.topFlowerName)
         promise = self.addChild(startDBJob)
         return promise
 
+def checkpointLocalDB(localDBDir, phaseName):
+    """Keep a copy of the local primary DB as it is when the given
+    checkpoint first runs. If the checkpoint is being rerun, put that copy
+    back instead, so the phase reruns against the DB it started with
+    rather than the one its failed attempt left.
+
+    The copies of earlier checkpoints are dropped, since their phases
+    have succeeded by the time the next checkpoint runs, so at most one
+    copy is kept. Copying the DB at each checkpoint costs about what
+    saving and reloading a ktserver snapshot would, which is why only
+    small alignments use a local DB."""
+    primaryDir = os.path.join(localDBDir, "primary")
+    savedDir = os.path.join(localDBDir, "primary-%s" % phaseName)
+    if os.path.exists(savedDir):
+        shutil.rmtree(primaryDir, ignore_errors=True)
+        shutil.copytree(savedDir, primaryDir)
+        return
+    if os.path.exists(savedDir + ".done"):
+        raise RuntimeError("Can't rerun the %s checkpoint, the local DB it started "
+                           "from was dropped once its phase succeeded" % phaseName)
+    for name in os.listdir(localDBDir):
+        if name.startswith("primary-") and not name.endswith(".done") and not name.endswith(".tmp"):
+            shutil.rmtree(os.path.join(localDBDir, name))
+            # Remember the phase succeeded, rather than rerunning it
+            # against a later DB.
+            open(os.path.join(localDBDir, name + ".done"), 'w').close()
+    # Copy to a temporary name first, so a copy cut short is never
+    # mistaken for a complete one.
+    tempDir = savedDir + ".tmp"
+    shutil.rmtree(tempDir, ignore_errors=True)
+    if os.path.exists(primaryDir):
+        shutil.copytree(primaryDir, tempDir)
+    else:
+        # The DB has not been created yet.
+        os.makedirs(tempDir)
+    os.rename(tempDir, savedDir)
+
 class StartPrimaryDB(CactusPhasesJob):
-    """Launches a primary Cactus DB."""
-    def __init__(self, nextJob, ktServerDump=None, *args, **kwargs):
+    """Launches a primary Cactus DB.
+
+    If handOver is set, the DB is kept up for all the checkpoints that
+    follow nextJob rather than being saved at the end of its phase.
+    """
+    def __init__(self, nextJob, ktServerDump=None, handOver=False, *args, **kwargs):
         self.nextJob = nextJob
         self.ktServerDump = ktServerDump
+        self.handOver = handOver
         kwargs['checkpoint'] = True
         kwargs['preemptable'] = False
         super(StartPrimaryDB, self).__init__(*args, **kwargs)
@@ -271,22 +373,80 @@ class StartPrimaryDB(CactusPhasesJob):
         cw = ConfigWrapper(self.cactusWorkflowArguments.configNode)
 
         if self.cactusWorkflowArguments.experimentWrapper.getDbType() == "kyoto_tycoon":
-            memory = max(2500000000, self.evaluateResourcePoly([4.10201882, 2.01324291e+08]))
+            shards = self.cactusWorkflowArguments.experimentWrapper.getDbShards()
+            # Each shard holds its share of the records.
+            memory = max(2500000000, int(self.evaluateResourcePoly([4.10201882, 2.01324291e+08]) / shards))
             cores = cw.getKtserverCpu(default=0.1)
-            dbElem = ExperimentWrapper(self.cactusWorkflowArguments.experimentNode)
-            service = self.addService(KtServerService(dbElem=dbElem,
-                                                      existingSnapshotID=self.ktServerDump,
-                                                      isSecondary=False,
-                                                      memory=memory, cores=cores))
-            dbString = service.rv(0)
-            snapshotID = service.rv(1)
-            self.nextJob.cactusWorkflowArguments.cactusDiskDatabaseString = dbString
-            # TODO: This part needs to be cleaned up
-            self.nextJob.cactusWorkflowArguments.snapshotID = snapshotID
-            return self.addChild(self.nextJob).rv()
+            # The snapshot is about as big as the DB is in memory. The
+            # server writes its new snapshot next to the one it loaded,
+            # and to take a delta the babysitter keeps another copy of
+            # the loaded one.
+            snapshotCopies = 3 if self.cactusWorkflowArguments.experimentWrapper.getDbSnapshotDeltas() else 2
+            disk = snapshotCopies * memory
+            if shards == 1:
+                existingSnapshotIDs = [self.ktServerDump]
+            elif self.ktServerDump is None:
+                existingSnapshotIDs = [None] * shards
+            else:
+                existingSnapshotIDs = self.ktServerDump
+                assert len(existingSnapshotIDs) == shards
+            # Each shard is a service of its own, so they are started in
+            # parallel and can be placed on different nodes.
+            services = []
+            for existingSnapshotID in existingSnapshotIDs:
+                dbElem = ExperimentWrapper(self.cactusWorkflowArguments.experimentNode)
+                services.append(self.addService(KtServerService(dbElem=dbElem,
+                                                                existingSnapshotID=existingSnapshotID,
+                                                                isSecondary=False,
+                                                                memory=memory, cores=cores, disk=disk)))
+            self.nextJob.cactusWorkflowArguments.primaryDBHandedOver = self.handOver
+            if shards == 1:
+                dbString = services[0].rv(0)
+                snapshotID = services[0].rv(1)
+                self.nextJob.cactusWorkflowArguments.cactusDiskDatabaseString = dbString
+                # TODO: This part needs to be cleaned up
+                self.nextJob.cactusWorkflowArguments.snapshotID = snapshotID
+                return self.addChild(self.nextJob).rv()
+            joinJob = self.addChild(JoinPrimaryDBShards([service.rv(0) for service in services]))
+            self.nextJob.cactusWorkflowArguments.cactusDiskDatabaseString = joinJob.rv()
+            self.nextJob.cactusWorkflowArguments.snapshotID = [service.rv(1) for service in services]
+            return joinJob.addFollowOn(self.nextJob).rv()
         else:
+            if self.cactusWorkflowArguments.localDBDir is not None:
+                checkpointLocalDB(self.cactusWorkflowArguments.localDBDir, self.phaseName)
             return self.addFollowOn(self.nextJob).rv()
 
+class StartSecondaryDB(CactusPhasesJob):
+    """Launches a secondary (scratch) DB shared by nextJob and all the
+    phases that follow it, which then run while it is up.
+
+    Each phase using it takes it over with setupSecondaryDatabase, which
+    clears it and records the phase as its namespace, and clears it again
+    with cleanupSecondaryDatabase.
+    """
+    def __init__(self, nextJob, *args, **kwargs):
+        self.nextJob = nextJob
+        super(StartSecondaryDB, self).__init__(*args, **kwargs)
+
+    def run(self, fileStore):
+        self.nextJob.cactusWorkflowArguments.secondaryDatabaseString = self.addSecondaryDBService()
+        self.nextJob.cactusWorkflowArguments.secondaryDBPooled = True
+        return self.addChild(self.nextJob).rv()
+
+class JoinPrimaryDBShards(Job):
+    """Joins the conf strings of the shards of the primary DB into one
+    conf string listing them all."""
+    def __init__(self, shardDbStrings):
+        Job.__init__(self, memory=100000000, preemptable=True)
+        self.shardDbStrings = shardDbStrings
+
+    def run(self, fileStore):
+        dbElem = DbElemWrapper(ET.fromstring(self.shardDbStrings[0]))
+        for shardDbString in self.shardDbStrings[1:]:
+            shardElem = DbElemWrapper(ET.fromstring(shardDbString))
+            dbElem.addDbShard(shardElem.getDbHost(), shardElem.getDbPort())
+        return dbElem.getConfString()
+
 class SavePrimaryDB(CactusPhasesJob):
     """Saves the DB to a file and clears the DB."""
     def __init__(self, *args, **kwargs):
@@ -296,22 +456,57 @@ class SavePrimaryDB(CactusPhasesJob):
         stats = runCactusFlowerStats(cactusDiskDatabaseString=self.cactusWorkflowArguments.cactusDiskDatabaseString,
                                      flowerName=0)
         fileStore.logToMaster("At end of %s phase, got stats %s" % (self.phaseName, stats))
+        if self.cactusWorkflowArguments.experimentWrapper.getDbType() != "kyoto_tycoon":
+            # Nothing to save, the DB is already on disk.
+            return None
         dbElem = DbElemWrapper(ET.fromstring(self.cactusWorkflowArguments.cactusDiskDatabaseString))
-        # Send the terminate message
-        stopKtserver(dbElem)
-        # Wait for the file to appear in the right place. This may take a while
-        while True:
-            with fileStore.readGlobalFileStream(self.cactusWorkflowArguments.snapshotID) as f:
-                if f.read(1) != '':
-                    # The file is no longer empty
-                    break
-            time.sleep(10)
-        # We have the file now
+        shardElems = dbElem.getDbShardElems()
+        # A write torn by a binary that died can't be repaired, and mustn't
+        # be saved. Failing here makes the checkpoint rerun the phase from
+        # the snapshot it started from.
+        try:
+            checkPrimaryDBWrites(shardElems[0])
+        except KtClientError:
+            # Already stopped by an earlier attempt at this job, which
+            # did the check.
+            pass
+        if self.cactusWorkflowArguments.primaryDBHandedOver:
+            # The DB stays up for the next phase, and is only saved
+            # once the last one is done.
+            if getattr(self.cactusWorkflowArguments, 'intermediateResultsUrl', None) is not None:
+                fileStore.logToMaster("Not dumping the DB at the end of the %s phase, as it is being"
+                                      " handed over to the next phase" % self.phaseName)
+            return self.cactusWorkflowArguments.snapshotID
+        snapshotIDs = self.cactusWorkflowArguments.snapshotID
+        if len(shardElems) == 1:
+            snapshotIDs = [snapshotIDs]
+        # Send the terminate message to all the shards, so they save
+        # their snapshots at the same time
+        for shardElem in shardElems:
+            stopKtserver(shardElem)
+        # Wait for the files to appear in the right place. This may take a
+        # while, so back off from checking every half-second.
+        for snapshotID in snapshotIDs:
+            interval = 0.5
+            while True:
+                with fileStore.readGlobalFileStream(snapshotID) as f:
+                    if f.read(1) != '':
+                        # The file is no longer empty
+                        break
+                time.sleep(interval)
+                interval = min(interval * 2, 10)
+        # We have the files now
         intermediateResultsUrl = getattr(self.cactusWorkflowArguments, 'intermediateResultsUrl', None)
         if intermediateResultsUrl is not None:
-            # The user requested to keep the DB dumps in a separate place. Export it there.
-            url = intermediateResultsUrl + "-dump-" + self.phaseName
-            fileStore.exportFile(self.cactusWorkflowArguments.snapshotID, url)
+            # The user requested to keep the DB dumps in a separate place. Export them there.
+            for i, snapshotID in enumerate(snapshotIDs):
+                url = intermediateResultsUrl + "-dump-" + self.phaseName
+                if len(snapshotIDs) > 1:
+                    url += "-shard%d" % i
+                # The snapshot may be a delta against the last phase's, so
+                # export a full one that can be loaded on its own.
+                snapshotPath, _ = materializeSnapshot(fileStore, snapshotID, fileStore.getLocalTempFile())
+                fileStore.exportFile(fileStore.writeGlobalFile(snapshotPath), url)
         return self.cactusWorkflowArguments.snapshotID
 
 class CactusRecursionJob(CactusJob):
@@ -477,6 +672,7 @@ def setupDivergenceArgs(cactusWorkflowArguments):
         cactusWorkflowArguments.longestPath += distanceToAddToRootAlignment
     cw = ConfigWrapper(cactusWorkflowArguments.configNode)
     cw.substituteAllDivergenceContolledParametersWithLiterals(cactusWorkflowArguments.longestPath)
+    cactusWorkflowArguments.resolveConfig()
 
 def setupFilteringByIdentity(cactusWorkflowArguments):
     #Filter by identity
@@ -486,6 +682,7 @@ def setupFilteringByIdentity(cactusWorkflowArguments):
         float(cafNode.attrib["minimumDistance"]))
         identity = str(100 - math.ceil(100 * inverseJukesCantor(adjustedPath)))
         cafNode.attrib["lastzArguments"] = cafNode.attrib["lastzArguments"] + (" --identity=%s" % identity)
+        cactusWorkflowArguments.resolveConfig()
 
 
 class CactusTrimmingBlastPhase(CactusPhasesJob):
@@ -497,9 +694,17 @@ class CactusTrimmingBlastPhase(CactusPhasesJob):
 
         # Get ingroup and outgroup sequences
         sequenceIDs = self.cactusWorkflowArguments.experimentWrapper.seqIDMap.values()
-        sequences = [fileStore.readGlobalFile(seqID) for seqID in sequenceIDs]
+        sequences = [readGlobalFileShared(fileStore, seqID) for seqID in sequenceIDs]
         self.cactusWorkflowArguments.totalSequenceSize = sum(os.stat(x).st_size for x in sequences)
 
+        if self.shouldUseLocalDB(fileStore):
+            # Small enough to skip the ktservers (and their snapshots) entirely.
+            config = fileStore.jobStore.config
+            dbDir = os.path.join(Toil.getWorkflowDir(config.workflowID, config.workDir), "cactusDB-%s" % uuid.uuid4())
+            fileStore.logToMaster("Using a local DB in %s for %i bytes of sequence"
+                                  % (dbDir, self.cactusWorkflowArguments.totalSequenceSize))
+            self.cactusWorkflowArguments.useLocalDB(dbDir)
+
         # Prepend unique ID to fasta headers to prevent name collision
         renamedInputSeqDir = os.path.join(fileStore.getLocalTempDir(), "renamedInputs")
         os.mkdir(renamedInputSeqDir)
@@ -517,24 +722,30 @@ class CactusTrimmingBlastPhase(CactusPhasesJob):
         setupFilteringByIdentity(self.cactusWorkflowArguments)
 
         # FIXME: this is really ugly and steals the options from the caf tag
+        config = self.cactusWorkflowArguments.resolvedConfig
         blastJob = self.addChild(BlastIngroupsAndOutgroups(
-            BlastOptions(chunkSize=getOptionalAttrib(findRequiredNode(self.cactusWorkflowArguments.configNode, "caf"), "chunkSize", int),
-                         overlapSize=getOptionalAttrib(findRequiredNode(self.cactusWorkflowArguments.configNode, "caf"), "overlapSize", int),
-                         lastzArguments=getOptionalAttrib(findRequiredNode(self.cactusWorkflowArguments.configNode, "caf"), "lastzArguments"),
-                         compressFiles=getOptionalAttrib(findRequiredNode(self.cactusWorkflowArguments.configNode, "caf"), "compressFiles", bool),
-                         realign=getOptionalAttrib(findRequiredNode(self.cactusWorkflowArguments.configNode, "caf"), "realign", bool), 
-                         realignArguments=getOptionalAttrib(findRequiredNode(self.cactusWorkflowArguments.configNode, "caf"), "realignArguments"),
-                         memory=getOptionalAttrib(findRequiredNode(self.cactusWorkflowArguments.configNode, "caf"), "lastzMemory", int, sys.maxint),
-                         smallDisk=getOptionalAttrib(findRequiredNode(self.cactusWorkflowArguments.configNode, "caf"), "lastzSmallDisk", int, sys.maxint),
-                         largeDisk=getOptionalAttrib(findRequiredNode(self.cactusWorkflowArguments.configNode, "caf"), "lastzLargeDisk", int, sys.maxint),
-                         minimumSequenceLength=getOptionalAttrib(findRequiredNode(self.cactusWorkflowArguments.configNode, "caf"), "minimumSequenceLengthForBlast", int, 1),
+            BlastOptions(chunkSize=config.getAttrib("caf", "chunkSize", int),
+                         overlapSize=config.getAttrib("caf", "overlapSize", int),
+                         lastzArguments=config.getAttrib("caf", "lastzArguments"),
+                         compressFiles=config.getAttrib("caf", "compressFiles", bool),
+                         realign=config.getAttrib("caf", "realign", bool), 
+                         realignArguments=config.getAttrib("caf", "realignArguments"),
+                         memory=config.getAttrib("caf", "lastzMemory", int, sys.maxint),
+                         smallDisk=config.getAttrib("caf", "lastzSmallDisk", int, sys.maxint),
+                         largeDisk=config.getAttrib("caf", "lastzLargeDisk", int, sys.maxint),
+                         minimumSequenceLength=config.getAttrib("caf", "minimumSequenceLengthForBlast", int, 1),
                          trimFlanking=self.getOptionalPhaseAttrib("trimFlanking", int, 10),
                          trimMinSize=self.getOptionalPhaseAttrib("trimMinSize", int, 0),
                          trimThreshold=self.getOptionalPhaseAttrib("trimThreshold", float, 0.8),
                          trimWindowSize=self.getOptionalPhaseAttrib("trimWindowSize", int, 10),
                          trimOutgroupFlanking=self.getOptionalPhaseAttrib("trimOutgroupFlanking", int, 100),
                          trimOutgroupDepth=self.getOptionalPhaseAttrib("trimOutgroupDepth", int, 1),
-                         keepParalogs=self.getOptionalPhaseAttrib("keepParalogs", bool, False)),
+                         keepParalogs=self.getOptionalPhaseAttrib("keepParalogs", bool, False),
+                         pipeline=config.getAttrib("caf", "pipelineBlast", bool, False),
+                         realignThreads=config.getAttrib("caf", "realignThreads", int, 1),
+                         batchSize=config.getAttrib("caf", "blastBatchSize", int, 0),
+                         batchCores=config.getAttrib("caf", "blastBatchCores", int, 1),
+                         chunkRows=config.getAttrib("caf", "blastChunkRows", bool, False)),
             map(itemgetter(0), ingroupItems), map(itemgetter(1), ingroupItems),
             map(itemgetter(0), outgroupItems), map(itemgetter(1), outgroupItems)))
 
@@ -544,6 +755,16 @@ class CactusTrimmingBlastPhase(CactusPhasesJob):
 
         return self.makeFollowOnCheckpointJob(CactusSetupCheckpoint, "setup")
 
+    def shouldUseLocalDB(self, fileStore):
+        """Should the DBs be tokyo cabinet files rather than ktservers? Only
+        if every job runs on this machine, so they can all open them."""
+        experimentWrapper = self.cactusWorkflowArguments.experimentWrapper
+        maxSize = ConfigWrapper(self.cactusWorkflowArguments.configNode).getKtserverLocalDBMaxSequenceSize()
+        return maxSize > 0 and experimentWrapper.getDbType() == "kyoto_tycoon" and \
+            experimentWrapper.getDbShards() == 1 and \
+            fileStore.jobStore.config.batchSystem == "singleMachine" and \
+            self.cactusWorkflowArguments.totalSequenceSize <= maxSize
+
 ############################################################
 ############################################################
 ############################################################
@@ -587,12 +808,12 @@ class CactusSetupPhase(CactusPhasesJob):
             if tree.isLeaf(node):
                 seqID = self.cactusWorkflowArguments.experimentWrapper.seqIDMap[tree.getName(node)]
                 sequenceIDs.append(seqID)
-                seq = fileStore.readGlobalFile(seqID)
+                seq = readGlobalFileShared(fileStore, seqID)
                 sequenceNames.append(tree.getName(node))
                 with open(seq, 'r') as fh:
                     firstLines.append(fh.readline())
 
-        sequences = [fileStore.readGlobalFile(fileID) for fileID in sequenceIDs]
+        sequences = [readGlobalFileShared(fileStore, fileID) for fileID in sequenceIDs]
         logger.info("Sequences in cactus setup: %s" % sequenceNames)
         logger.info("Sequences in cactus setup filenames: %s" % firstLines)
         messages = runCactusSetup(cactusDiskDatabaseString=self.cactusWorkflowArguments.cactusDiskDatabaseString, 
@@ -653,7 +874,8 @@ class CactusCafPhase(CactusPhasesJob):
         alignmentsFile = fileStore.readGlobalFile(self.cactusWorkflowArguments.alignmentsID)
         convertedAlignmentsFile = fileStore.getLocalTempFile()
         # Convert the cigar file to use 64-bit cactus Names instead of the headers.
-        runConvertAlignmentsToInternalNames(cactusDiskString=self.cactusWorkflowArguments.cactusDiskDatabaseString, alignmentsFile=alignmentsFile, outputFile=convertedAlignmentsFile, flowerName=self.topFlowerName)
+        # CAF reads the result directly in the (much smaller) binary format.
+        runConvertAlignmentsToInternalNames(cactusDiskString=self.cactusWorkflowArguments.cactusDiskDatabaseString, alignmentsFile=alignmentsFile, outputFile=convertedAlignmentsFile, flowerName=self.topFlowerName, binary=True)
         fileStore.logToMaster("Converted headers of cigar file %s to internal names, new file %s" % (self.cactusWorkflowArguments.alignmentsID, convertedAlignmentsFile))
         self.cactusWorkflowArguments.alignmentsID = fileStore.writeGlobalFile(convertedAlignmentsFile, cleanup=True)
         # While we're at it, remove the unique IDs prepended to
@@ -679,7 +901,7 @@ class CactusCafWrapper(CactusRecursionJob):
     def runCactusCafInWorkflow(self, alignmentFile, fileStore, constraints=None):
         debugFilePath = self.getOptionalPhaseAttrib("phylogenyDebugPrefix")
         if debugFilePath != None:
-            debugFilePath += getOptionalAttrib(findRequiredNode(self.cactusWorkflowArguments.configNode, "reference"), "reference")
+            debugFilePath += self.cactusWorkflowArguments.resolvedConfig.getAttrib("reference", "reference")
         messages = runCactusCaf(cactusDiskDatabaseString=self.cactusDiskDatabaseString,
                           features=self.featuresFn(),
                           fileStore=fileStore,
@@ -733,10 +955,12 @@ class CactusCafWrapper(CactusRecursionJob):
             logger.info(message)
 
     def run(self, fileStore):
-        alignments = fileStore.readGlobalFile(self.cactusWorkflowArguments.alignmentsID)
+        # Every CAF job reads the same (large) alignments, so share a
+        # single copy between all the jobs on this node.
+        alignments = readGlobalFileShared(fileStore, self.cactusWorkflowArguments.alignmentsID)
         constraints = None
         if self.cactusWorkflowArguments.constraintsID is not None:
-            constraints = fileStore.readGlobalFile(self.cactusWorkflowArguments.constraintsID)
+            constraints = readGlobalFileShared(fileStore, self.cactusWorkflowArguments.constraintsID)
         logger.info("Alignments file: %s" % alignments)
         self.runCactusCafInWorkflow(alignmentFile=alignments, fileStore=fileStore,
                                     constraints=constraints)
@@ -908,7 +1132,7 @@ class CactusBarWrapperWithPrecomputedEndAlignments(CactusRecursionJob):
 
     def run(self, fileStore):
         if self.precomputedAlignmentIDs:
-            precomputedAlignments = [readGlobalFileWithoutCache(fileStore, fileID) for fileID in self.precomputedAlignmentIDs]
+            precomputedAlignments = [readGlobalFileShared(fileStore, fileID) for fileID in self.precomputedAlignmentIDs]
             messages = runBarForJob(self, features=self.featuresFn(),
                                     fileStore=fileStore,
                                     precomputedAlignments=precomputedAlignments)
@@ -931,8 +1155,7 @@ class CactusNormalPhase(CactusPhasesJob):
     def run(self, fileStore):
         normalisationIterations = self.getOptionalPhaseAttrib("iterations", int, default=0)
         if normalisationIterations > 0:
-            self.phaseNode.attrib["normalised"] = "1"
-            self.phaseNode.attrib["iterations"] = str(normalisationIterations-1)
+            self.setPhaseAttribs(normalised="1", iterations=str(normalisationIterations-1))
             return self.runPhase(CactusNormalRecursion, CactusNormalPhase, "normal")
         else:
             return self.makeFollowOnPhaseJob(CactusAVGPhase, "avg")
@@ -1001,6 +1224,8 @@ class CactusAVGWrapper(CactusRecursionJob):
 
 class CactusReferenceCheckpoint(CactusCheckpointJob):
     """Run reference phase, then save the DB and run the HAL phase."""
+    startsSecondaryDBPool = True
+
     def run(self, fileStore):
         child = self.runPhaseWithPrimaryDB(CactusReferencePhase)
         experiment = child.rv(0)
@@ -1013,8 +1238,8 @@ class CactusReferencePhase(CactusPhasesJob):
     """Runs the reference problem algorithm"""
     def run(self, fileStore):
         self.setupSecondaryDatabase()
-        self.phaseNode.attrib["experimentPath"] = self.cactusWorkflowArguments.experimentFile
-        self.phaseNode.attrib["secondaryDatabaseString"] = self.cactusWorkflowArguments.secondaryDatabaseString
+        self.setPhaseAttribs(experimentPath=self.cactusWorkflowArguments.experimentFile,
+                             secondaryDatabaseString=self.cactusWorkflowArguments.secondaryDatabaseString)
         return self.runPhase(CactusReferenceRecursion, CactusSetReferenceCoordinatesDownPhase, "reference", 
                              doRecursion=self.getOptionalPhaseAttrib("buildReference", bool, False),
                              launchSecondaryKtForRecursiveJob=True)
@@ -1156,8 +1381,7 @@ class CactusCheckPhase(CactusPhasesJob):
     """The check phase, where we verify everything is as it should be
     """
     def run(self, fileStore):
-        normalNode = findRequiredNode(self.cactusWorkflowArguments.configNode, "normal")
-        self.phaseNode.attrib["checkNormalised"] = getOptionalAttrib(normalNode, "normalised", default="0")
+        self.setPhaseAttribs(checkNormalised=self.cactusWorkflowArguments.resolvedConfig.getAttrib("normal", "normalised", default="0"))
         return self.runPhase(CactusCheckRecursion, SavePrimaryDB, "check", doRecursion=self.getOptionalPhaseAttrib("runCheck", bool, False))
 
 class CactusCheckRecursion(CactusRecursionJob):
@@ -1188,9 +1412,9 @@ class CactusHalCheckpoint(CactusCheckpointJob):
 
 class CactusHalGeneratorPhase(CactusPhasesJob):
     def run(self, fileStore):
-        referenceNode = findRequiredNode(self.cactusWorkflowArguments.configNode, "reference")
-        if referenceNode.attrib.has_key("reference"):
-            self.phaseNode.attrib["reference"] = referenceNode.attrib["reference"]
+        reference = self.cactusWorkflowArguments.resolvedConfig.getAttrib("reference", "reference")
+        if reference is not None:
+            self.setPhaseAttribs(reference=reference)
         if self.getOptionalPhaseAttrib("buildFasta", bool, default=False):
             self.fastaID = self.makeRecursiveChildJob(CactusFastaGenerator)
         return self.makeFollowOnPhaseJob(CactusHalGeneratorPhase2, "hal")
@@ -1199,9 +1423,9 @@ class CactusHalGeneratorPhase2(CactusPhasesJob):
     def run(self, fileStore):
         if self.getOptionalPhaseAttrib("buildHal", bool, default=False):
             self.setupSecondaryDatabase()
-            self.phaseNode.attrib["experimentPath"] = self.cactusWorkflowArguments.experimentFile
-            self.phaseNode.attrib["secondaryDatabaseString"] = self.cactusWorkflowArguments.secondaryDatabaseString
-            self.phaseNode.attrib["outputFile"] = "1"
+            self.setPhaseAttribs(experimentPath=self.cactusWorkflowArguments.experimentFile,
+                                 secondaryDatabaseString=self.cactusWorkflowArguments.secondaryDatabaseString,
+                                 outputFile="1")
 
             self.halID = self.makeRecursiveChildJob(CactusHalGeneratorRecursion, launchSecondaryKtForRecursiveJob=True)
 
@@ -1211,6 +1435,9 @@ class CactusHalGeneratorPhase3(CactusPhasesJob):
     def run(self, fileStore):
         self.cactusWorkflowArguments.experimentWrapper.setHalID(self.halID)
         self.cactusWorkflowArguments.experimentWrapper.setHalFastaID(self.fastaID)
+        if self.cactusWorkflowArguments.localDBDir is not None:
+            # This is the last phase, so the local DB is no longer needed.
+            shutil.rmtree(self.cactusWorkflowArguments.localDBDir, ignore_errors=True)
         return self.cactusWorkflowArguments.experimentWrapper
 
 class CactusFastaGenerator(CactusRecursionJob):
@@ -1317,11 +1544,20 @@ class CactusWorkflowArguments:
         # -caf, -avg, etc.
         self.intermediateResultsUrl = options.intermediateResultsUrl
         self.ktServerDump = None
+        # Set while the primary DB is being kept up between checkpoint
+        # phases, see StartPrimaryDB.
+        self.primaryDBHandedOver = False
 
         #Secondary, scratch DB
         secondaryConf = copy.deepcopy(self.experimentNode.find("cactus_disk").find("st_kv_database_conf"))
         secondaryElem = DbElemWrapper(secondaryConf)
         self.secondaryDatabaseString = secondaryElem.getConfString()
+        # Set once a secondary ktserver has been started for the phases
+        # to share, see StartSecondaryDB.
+        self.secondaryDBPooled = False
+        # The directory holding the DBs, if they are local files rather
+        # than ktservers, see useLocalDB.
+        self.localDBDir = None
 
         #The config node
         self.configNode = configNode
@@ -1336,7 +1572,24 @@ class CactusWorkflowArguments:
             findRequiredNode(self.configNode, "avg").attrib["buildAvgs"] = "1"
         if options.buildReference:
             findRequiredNode(self.configNode, "reference").attrib["buildReference"] = "1"
-            
+        self.resolveConfig()
+
+    def resolveConfig(self):
+        """Refresh the resolved copy of the config that the phase jobs
+        read their attributes from. Must follow any change to configNode.
+        """
+        self.resolvedConfig = ResolvedConfig(self.configNode)
+
+    def useLocalDB(self, dbDir):
+        """Switch the primary and secondary DBs to tokyo cabinet files in
+        dbDir, which the binaries open directly."""
+        os.makedirs(dbDir)
+        self.localDBDir = dbDir
+        self.experimentWrapper.setDbTokyoCabinet(os.path.join(dbDir, "primary"))
+        self.cactusDiskDatabaseString = self.experimentWrapper.getConfString().translate(None, '\n')
+        secondaryElem = DbElemWrapper(copy.deepcopy(self.experimentWrapper.confElem))
+        secondaryElem.setDbTokyoCabinet(os.path.join(dbDir, "secondary"))
+        self.secondaryDatabaseString = secondaryElem.getConfString()
 
 def addCactusWorkflowOptions(parser):
     parser.add_argument("--experiment", dest="experimentFile", 
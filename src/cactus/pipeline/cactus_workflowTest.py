@@ -8,9 +8,10 @@
 
 import unittest
 import os
+import shutil
 import xml.etree.ElementTree as ET
 
-from sonLib.bioio import TestStatus, newickTreeParser, getTempFile
+from sonLib.bioio import TestStatus, newickTreeParser, getTempFile, getTempDirectory
 
 from cactus.shared.test import getCactusInputs_random
 from cactus.shared.test import getCactusInputs_randomWithConstraints
@@ -26,7 +27,7 @@ from cactus.shared.common import cactusRootPath
 
 from cactus.pipeline.cactus_workflow import getOptionalAttrib, extractNode, findRequiredNode, \
     getJobNode, CactusJob, getLongestPath, inverseJukesCantor, \
-    CactusSetReferenceCoordinatesDownRecursion
+    CactusSetReferenceCoordinatesDownRecursion, checkpointLocalDB
 
 class TestCase(unittest.TestCase):
     
@@ -104,6 +105,47 @@ class TestCase(unittest.TestCase):
                                      configFile=tempConfigFile)
         os.remove(tempConfigFile)
 
+    @silentOnSuccess
+    def testCactus_localDB(self):
+        """Run on a single machine with local tokyo cabinet DBs in place of
+        ktservers."""
+        if self.batchSystem != "singleMachine":
+            return
+        initialiseGlobalDatabaseConf('<st_kv_database_conf type="kyoto_tycoon"><kyoto_tycoon in_memory="1" port="1978" snapshot="0"/></st_kv_database_conf>')
+        # The inputs are well under the default threshold.
+        runWorkflow_multipleExamples(getCactusInputs_random,
+                                     testNumber=1,
+                                     buildReference=True,
+                                     batchSystem=self.batchSystem,
+                                     configFile=self.configFile,
+                                     localDB=True)
+
+    def testCheckpointLocalDB(self):
+        """A rerun checkpoint should get back the local DB it first ran with."""
+        localDBDir = getTempDirectory()
+        primaryDir = os.path.join(localDBDir, "primary")
+        # Before the DB is created
+        checkpointLocalDB(localDBDir, "setup")
+        os.makedirs(primaryDir)
+        with open(os.path.join(primaryDir, "data"), "w") as fh:
+            fh.write("setup")
+        checkpointLocalDB(localDBDir, "setup")
+        self.assertEquals(os.listdir(primaryDir), [])
+
+        with open(os.path.join(primaryDir, "data"), "w") as fh:
+            fh.write("setup")
+        checkpointLocalDB(localDBDir, "bar")
+        with open(os.path.join(primaryDir, "data"), "w") as fh:
+            fh.write("bar, half done")
+        checkpointLocalDB(localDBDir, "bar")
+        with open(os.path.join(primaryDir, "data")) as fh:
+            self.assertEquals(fh.read(), "setup")
+        # Only the running checkpoint's copy is kept.
+        self.assertEquals(sorted(os.listdir(localDBDir)), ["primary", "primary-bar", "primary-setup.done"])
+        # A checkpoint whose phase succeeded can't go back.
+        self.assertRaises(RuntimeError, checkpointLocalDB, localDBDir, "setup")
+        shutil.rmtree(localDBDir)
+
     def testGetOptionalAttrib(self):
         self.assertEquals("0", getOptionalAttrib(self.barNode, "minimumBlockDegree"))
         self.assertEquals(0, getOptionalAttrib(self.barNode, "minimumBlockDegree", typeFn=int, default=1))
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+"""
+Minimal client for KyotoTycoon's HTTP RPC protocol.
+
+Used for the few calls the workflow itself makes to a ktserver (setting
+and polling the TERMINATE key, checking the server is up, resetting a
+pooled secondary DB, checking the binaries' write counts), which would
+otherwise each spawn a ktremotemgr process, possibly inside a
+container. Requests go over a single persistent connection.
+"""
+
+import base64
+import httplib
+import quopri
+import socket
+import urllib
+
+class KtClientError(RuntimeError):
+    pass
+
+def encodeTsv(params):
+    """Encode a dict as the URL-encoded TSV that KT takes as input."""
+    return "".join("%s\t%s\n" % (urllib.quote(str(key)), urllib.quote(str(value)))
+                   for key, value in params.items())
+
+def decodeTsv(body, contentType):
+    """Decode a KT TSV response, according to the column encoding
+    given in its content type."""
+    colenc = None
+    for field in contentType.split(";"):
+        field = field.strip()
+        if field.startswith("colenc="):
+            colenc = field[len("colenc="):]
+    decode = {None: lambda s: s,
+              "B": base64.b64decode,
+              "U": urllib.unquote,
+              "Q": quopri.decodestring}[colenc]
+    ret = {}
+    for line in body.split("\n"):
+        if line == "":
+            continue
+        key, _, value = line.partition("\t")
+        ret[decode(key)] = decode(value)
+    return ret
+
+class KtClient(object):
+    """Connection to one ktserver."""
+    def __init__(self, host, port, timeout=60):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.connection = None
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _request(self, procedure, body, timeout):
+        if self.connection is None:
+            self.connection = httplib.HTTPConnection(self.host, self.port, timeout=timeout)
+        elif self.connection.sock is not None:
+            self.connection.sock.settimeout(timeout)
+        self.connection.request("POST", "/rpc/" + procedure, body,
+                                {"Content-Type": "text/tab-separated-values; colenc=U"})
+        response = self.connection.getresponse()
+        return response.status, response.read(), response.getheader("Content-Type", "")
+
+    def call(self, procedure, params=None, timeout=None):
+        """Call an RPC procedure, returning (status, output dict)."""
+        body = encodeTsv(params or {})
+        timeout = self.timeout if timeout is None else timeout
+        try:
+            status, responseBody, contentType = self._request(procedure, body, timeout)
+        except (httplib.HTTPException, socket.error):
+            # The server may have dropped the idle connection: try once
+            # more on a fresh one.
+            self.close()
+            try:
+                status, responseBody, contentType = self._request(procedure, body, timeout)
+            except (httplib.HTTPException, socket.error) as e:
+                self.close()
+                raise KtClientError("Can't reach ktserver at %s:%s: %s" % (self.host, self.port, e))
+        return status, decodeTsv(responseBody, contentType)
+
+    def _check(self, procedure, status, output):
+        if status != 200:
+            raise KtClientError("ktserver call %s failed with status %d: %s" % (procedure, status, output.get("ERROR", "")))
+
+    def get(self, key, wait=None, waitTime=None):
+        """Get the value of key, or None if it isn't set. If wait is
+        given, the server first waits (for up to waitTime seconds) for
+        a signal on the condition variable of that name."""
+        params = {"key": key}
+        timeout = None
+        if wait is not None:
+            params["WAIT"] = wait
+            if waitTime is not None:
+                params["WAITTIME"] = waitTime
+                timeout = self.timeout + waitTime
+        status, output = self.call("get", params, timeout=timeout)
+        if status == 450 or (wait is not None and status == 503):
+            # No such record, or the wait timed out.
+            return None
+        self._check("get", status, output)
+        return output.get("value")
+
+    def set(self, key, value, signal=None):
+        """Set key to value, then signal the condition variable signal
+        (if given), waking anyone waiting on it."""
+        params = {"key": key, "value": value}
+        if signal is not None:
+            params["SIGNAL"] = signal
+        status, output = self.call("set", params)
+        self._check("set", status, output)
+
+    def remove(self, key):
+        """Remove key. Returns whether it was set."""
+        status, output = self.call("remove", {"key": key})
+        if status == 450:
+            return False
+        self._check("remove", status, output)
+        return True
+
+    def increment(self, key, num=1):
+        """Add num to the integer record key (taken as 0 if it isn't
+        set), returning the new value. With num=0 this reads an integer
+        record without caring how it is stored."""
+        status, output = self.call("increment", {"key": key, "num": num})
+        self._check("increment", status, output)
+        return int(output["num"])
+
+    def clear(self):
+        """Remove every record."""
+        status, output = self.call("clear")
+        self._check("clear", status, output)
+
+    def isAlive(self):
+        """Whether the server answers requests."""
+        try:
+            status, _ = self.call("void", timeout=min(self.timeout, 10))
+        except KtClientError:
+            return False
+        return status == 200
@@ -0,0 +1,140 @@
+import unittest
+import base64
+import time
+import socket
+from threading import Thread, Condition
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+from cactus.pipeline.ktClient import KtClient, KtClientError, decodeTsv
+
+class FakeKtHandler(BaseHTTPRequestHandler):
+    """Speaks enough of KT's RPC protocol for the client: get, set,
+    remove, increment, clear and void, with the WAIT and SIGNAL
+    parameters."""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def respond(self, status, output):
+        body = "".join("%s\t%s\n" % (base64.b64encode(k), base64.b64encode(v)) for k, v in output.items())
+        self.send_response(status)
+        self.send_header("Content-Type", "text/tab-separated-values; colenc=B")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        params = decodeTsv(body, self.headers["Content-Type"])
+        procedure = self.path[len("/rpc/"):]
+        server = self.server
+        with server.condition:
+            if "WAIT" in params:
+                server.condition.wait(float(params.get("WAITTIME", 30)))
+                if params["WAIT"] not in server.signaled:
+                    self.respond(503, {"ERROR": "timeout"})
+                    return
+            if procedure == "get":
+                if params["key"] in server.records:
+                    self.respond(200, {"value": server.records[params["key"]]})
+                else:
+                    self.respond(450, {"ERROR": "no record"})
+            elif procedure == "set":
+                server.records[params["key"]] = params["value"]
+                if "SIGNAL" in params:
+                    server.signaled.add(params["SIGNAL"])
+                    server.condition.notify_all()
+                self.respond(200, {})
+            elif procedure == "remove":
+                self.respond(200 if server.records.pop(params["key"], None) is not None else 450, {})
+            elif procedure == "increment":
+                server.records[params["key"]] = str(int(server.records.get(params["key"], "0")) + int(params["num"]))
+                self.respond(200, {"num": server.records[params["key"]]})
+            elif procedure == "clear":
+                server.records.clear()
+                self.respond(200, {})
+            elif procedure == "void":
+                self.respond(200, {})
+            else:
+                self.respond(501, {"ERROR": "not implemented"})
+
+class FakeKtServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ("localhost", 0), FakeKtHandler)
+        self.records = {}
+        self.signaled = set()
+        self.condition = Condition()
+        self.connections = 0
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.server = FakeKtServer()
+        self.serverThread = Thread(target=self.server.serve_forever)
+        self.serverThread.daemon = True
+        self.serverThread.start()
+        self.client = KtClient("localhost", self.server.server_address[1], timeout=10)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        unittest.TestCase.tearDown(self)
+
+    def testGetSetRemove(self):
+        self.assertTrue(self.client.isAlive())
+        self.assertEqual(self.client.get("TERMINATE"), None)
+        self.client.set("TERMINATE", "1")
+        self.assertEqual(self.client.get("TERMINATE"), "1")
+        self.client.set("key\twith\nodd characters", "value\t%")
+        self.assertEqual(self.server.records["key\twith\nodd characters"], "value\t%")
+        self.assertEqual(self.client.get("key\twith\nodd characters"), "value\t%")
+        self.assertTrue(self.client.remove("TERMINATE"))
+        self.assertFalse(self.client.remove("TERMINATE"))
+        self.assertEqual(self.client.get("TERMINATE"), None)
+        self.assertEqual(self.client.increment("count", 0), 0)
+        self.assertEqual(self.client.increment("count"), 1)
+        self.assertEqual(self.client.increment("count", 2), 3)
+        self.client.clear()
+        self.assertEqual(self.server.records, {})
+        # All over the one connection.
+        self.assertEqual(self.server.connections, 1)
+
+    def testWait(self):
+        self.assertEqual(self.client.get("TERMINATE", wait="TERMINATE", waitTime=0.1), None)
+        def stop():
+            time.sleep(0.5)
+            with KtClient("localhost", self.server.server_address[1]) as client:
+                client.set("TERMINATE", "1", signal="TERMINATE")
+        thread = Thread(target=stop)
+        start = time.time()
+        thread.start()
+        self.assertEqual(self.client.get("TERMINATE", wait="TERMINATE", waitTime=30), "1")
+        self.assertTrue(time.time() - start < 10)
+        thread.join()
+
+    def testReconnect(self):
+        self.client.set("a", "b")
+        # Drop the connection, as the server would when idle.
+        self.client.connection.sock.close()
+        self.assertEqual(self.client.get("a"), "b")
+
+        # Nothing listening.
+        sock = socket.socket()
+        sock.bind(("localhost", 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        with KtClient("localhost", port) as client:
+            self.assertFalse(client.isAlive())
+            self.assertRaises(KtClientError, client.get, "a")
+
+if __name__ == '__main__':
+    unittest.main()
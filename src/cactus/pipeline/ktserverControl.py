@@ -4,18 +4,25 @@ Functions to launch and manage KyotoTycoon servers.
 """
 
 import os
+import errno
+import fcntl
 import platform
 import random
+import shutil
 import socket
 import signal
+import struct
 import sys
+import tempfile
 import traceback
 from glob import glob
 from multiprocessing import Process, Queue
-from time import sleep
+from time import sleep, time
 
 from toil.lib.bioio import logger
 from cactus.shared.common import cactus_call
+from cactus.pipeline.ktClient import KtClient, KtClientError
+from cactus.pipeline.snapshotDelta import materializeSnapshot, writeDelta, MAX_CHAIN_LENGTH
 
 # For some reason ktserver believes there are only 32768 TCP ports.
 MAX_KTSERVER_PORT = 32767
@@ -23,6 +30,25 @@ MAX_KTSERVER_PORT = 32767
 # The name of the snapshot that KT outputs.
 KTSERVER_SNAPSHOT_NAME = "00000000.ktss"
 
+# The key that is set to tell the babysitter to shut down the server,
+# and the condition variable that is signaled when it is set.
+TERMINATE_KEY = "TERMINATE"
+
+# Longest time the babysitter waits for the terminate signal before
+# checking on the server.
+TERMINATE_POLL_INTERVAL = 1
+
+# The key holding the namespace (the phase) a pooled secondary DB is
+# currently being used for. The binaries only use 8-byte keys, so it
+# can't clash with their records.
+NAMESPACE_KEY = "NAMESPACE"
+
+# The keys (int64s, as the binaries store them) counting the cactus disk
+# writes that have been split over several bulk sets, and so aren't
+# atomic, when they start and when they finish. See cactusDisk.c.
+WRITES_STARTED_KEY = struct.pack("<q", -100001)
+WRITES_FINISHED_KEY = struct.pack("<q", -100002)
+
 def runKtserver(dbElem, fileStore, existingSnapshotID=None, snapshotExportID=None):
     """
     Run a KTServer. This function launches a separate python process that manages the server.
@@ -38,21 +64,17 @@ def runKtserver(dbElem, fileStore, existingSnapshotID=None, snapshotExportID=Non
     dbElem.setDbHost(getHostName())
 
     # Find a suitable port to run on.
-    try:
-        occupiedPorts = findOccupiedPorts()
-        unoccupiedPorts = set(xrange(1025,MAX_KTSERVER_PORT)) - occupiedPorts
-        port = random.choice(list(unoccupiedPorts))
-    except:
-        logger.warning("Can't find which ports are occupied--likely netstat is not installed."
-                       " Choosing a random port to start the DB on, good luck!")
-        port = random.randint(1025,MAX_KTSERVER_PORT)
+    port, portLock = reservePort()
     dbElem.setDbPort(port)
 
     process = ServerProcess(dbElem, logPath, fileStore, existingSnapshotID, snapshotExportID)
     process.daemon = True
     process.start()
+    # The babysitter has its own copy of the lock, which it holds until
+    # it exits. Keep ours for as long as the process is around.
+    process.portLock = portLock
 
-    if not blockUntilKtserverIsRunning(logPath):
+    if not blockUntilKtserverIsRunning(logPath, host=dbElem.getDbHost(), port=port):
         try:
             with open(logPath) as f:
                 log = f.read()
@@ -87,34 +109,41 @@ class ServerProcess(Process):
         snapshotDir = os.path.join(fileStore.getLocalTempDir(), 'snapshot')
         os.mkdir(snapshotDir)
         snapshotPath = os.path.join(snapshotDir, KTSERVER_SNAPSHOT_NAME)
+        basePath = None
         if existingSnapshotID is not None:
             # Extract the existing snapshot to the snapshot
             # directory so it will be automatically loaded
-            fileStore.readGlobalFile(existingSnapshotID, userPath=snapshotPath)
+            _, chainLength = materializeSnapshot(fileStore, existingSnapshotID, snapshotPath)
+            if dbElem.getDbSnapshotDeltas() and chainLength < MAX_CHAIN_LENGTH:
+                # Keep a copy to take the delta against, since ktserver
+                # overwrites its snapshot.
+                basePath = fileStore.getLocalTempFile()
+                shutil.copyfile(snapshotPath, basePath)
         process = cactus_call(server=True, shell=False,
                               parameters=getKtserverCommand(dbElem, logPath, snapshotDir),
                               port=dbElem.getDbPort())
 
+        log = KtserverLog(logPath)
         blockUntilKtserverIsRunning(logPath)
+        client = getKtClient(dbElem)
         if existingSnapshotID is not None:
             # Clear the termination flag from the snapshot
-            cactus_call(parameters=["ktremotemgr", "remove"] + getRemoteParams(dbElem) + ["TERMINATE"])
-
-        while True:
-            # Check for the termination signal
-            try:
-                cactus_call(parameters=["ktremotemgr", "get"] + getRemoteParams(dbElem) + ["TERMINATE"])
-            except:
-                # No terminate signal sent yet
-                pass
-            else:
-                # Terminate signal received
-                break
-            # Check that the DB is still alive
-            if process.poll() is not None or isKtServerFailed(logPath):
-                with open(logPath) as f:
-                    raise RuntimeError("KTServer failed. Log: %s" % f.read())
-            sleep(60)
+            client.remove(TERMINATE_KEY)
+
+        try:
+            while client.get(TERMINATE_KEY) is None:
+                # Check that the DB is still alive
+                if process.poll() is not None or log.update().failed:
+                    break
+                # Sleep until the terminate flag is set, or for a short while.
+                client.get(TERMINATE_KEY, wait=TERMINATE_KEY, waitTime=TERMINATE_POLL_INTERVAL)
+        except KtClientError:
+            if process.poll() is None and not log.update().failed:
+                raise
+        client.close()
+        if process.poll() is not None or log.update().failed:
+            with open(logPath) as f:
+                raise RuntimeError("KTServer failed. Log: %s" % f.read())
         process.send_signal(signal.SIGINT)
         process.wait()
         blockUntilKtserverIsFinished(logPath)
@@ -128,57 +157,96 @@ class ServerProcess(Process):
                 # don't support it right now.
                 raise RuntimeError("KTServer left more than one snapshot.")
 
+            exportPath = snapshotPath
+            if basePath is not None:
+                deltaPath = fileStore.getLocalTempFile()
+                if writeDelta(basePath, existingSnapshotID, snapshotPath, deltaPath):
+                    exportPath = deltaPath
+
             # Export the snapshot file to the file store
-            fileStore.jobStore.updateFile(snapshotExportID, snapshotPath)
+            fileStore.jobStore.updateFile(snapshotExportID, exportPath)
+
+class KtserverLog(object):
+    """Follows a ktserver log, reading only what has been written since
+    it last looked, and remembering whether the server has started
+    listening, logged an error, or finished."""
+    def __init__(self, logPath):
+        self.logPath = logPath
+        self.offset = 0
+        self.partialLine = ""
+        self.running = False
+        self.failed = False
+        self.finished = False
+
+    def scan(self, line):
+        lowerLine = line.lower()
+        if "listening" in lowerLine:
+            self.running = True
+        if "error" in lowerLine:
+            self.failed = True
+        if "[FINISH]" in line:
+            self.finished = True
+
+    def update(self):
+        with open(self.logPath) as f:
+            f.seek(self.offset)
+            data = f.read()
+        self.offset += len(data)
+        lines = (self.partialLine + data).split("\n")
+        self.partialLine = lines.pop()
+        for line in lines:
+            self.scan(line)
+        # The last line may not have been completely written yet, but
+        # is checked anyway so it isn't missed if it never is.
+        self.scan(self.partialLine)
+        return self
+
+def isPortOpen(host, port, timeout=1):
+    """Can we connect to port on host?"""
+    try:
+        socket.create_connection((host, port), timeout).close()
+    except socket.error:
+        return False
+    return True
 
-def blockUntilKtserverIsRunning(logPath, createTimeout=1800):
+def blockUntilKtserverIsRunning(logPath, createTimeout=1800, host=None, port=None, timeStep=0.05):
     """Check status until it's successful, an error is found, or we timeout.
+    If a port is given, also wait until it accepts connections.
 
     Returns True if the ktserver is now running, False if something went wrong."""
-    success = False
-    for i in xrange(createTimeout):
-        if isKtServerFailed(logPath):
+    log = KtserverLog(logPath)
+    startTime = time()
+    while time() - startTime < createTimeout:
+        log.update()
+        if log.failed:
             logger.critical('Error starting ktserver.')
-            success = False
-            break
-        if isKtServerRunning(logPath):
+            return False
+        if log.running and (port is None or isPortOpen(host or 'localhost', port)):
             logger.info('Ktserver running.')
-            success = True
-            break
-        sleep(1)
-    return success
+            return True
+        sleep(timeStep)
+    return False
 
 def blockUntilKtserverIsFinished(logPath, timeout=1800,
-                                 timeStep=10):
+                                 timeStep=0.1):
     """Wait for the ktserver log to indicate that it shut down properly.
 
     Returns True if the server shut down, False if the timeout expired."""
-    for i in xrange(0, timeout, timeStep):
-        with open(logPath) as f:
-            log = f.read()
-            if '[FINISH]' in log:
-                return True
+    log = KtserverLog(logPath)
+    startTime = time()
+    while time() - startTime < timeout:
+        if log.update().finished:
+            return True
         sleep(timeStep)
     raise RuntimeError("Timeout reached while waiting for ktserver.")
 
 def isKtServerRunning(logPath):
     """Check if the server started running."""
-    success = False
-    with open(logPath) as f:
-        for line in f:
-            if line.lower().find("listening") >= 0:
-                success = True
-    return success
+    return KtserverLog(logPath).update().running
 
 def isKtServerFailed(logPath):
     """Does the server log contain an error?"""
-    isFailed = False
-    with open(logPath) as f:
-        for line in f:
-            if line.lower().find("error") >= 0:
-                isFailed = True
-                break
-    return isFailed
+    return KtserverLog(logPath).update().failed
 
 def getKtTuningOptions(dbElem):
     """Get the appropriate KTServer tuning parameters (bucket size, etc.)"""
@@ -213,20 +281,51 @@ def getKtserverCommand(dbElem, logPath, snapshotDir):
     cmd += [":" + tuning]
     return cmd
 
-def getRemoteParams(dbElem):
-    """Get parameters to supply to ktremotemgr to connect to the right DB."""
-    host = dbElem.getDbHost() or 'localhost'
-    return ['-port', str(dbElem.getDbPort()),
-            '-host', host]
+def getKtClient(dbElem):
+    """Get a client connected to the DB."""
+    return KtClient(dbElem.getDbHost() or 'localhost', dbElem.getDbPort())
 
 def stopKtserver(dbElem):
     """Attempt to send the terminate signal to a ktserver."""
     try:
-        cactus_call(parameters=['ktremotemgr', 'set'] + getRemoteParams(dbElem) + ['TERMINATE', '1'])
-    except:
+        with getKtClient(dbElem) as client:
+            client.set(TERMINATE_KEY, '1', signal=TERMINATE_KEY)
+    except KtClientError:
         # The server is likely already down.
         pass
 
+def checkPrimaryDBWrites(dbElem):
+    """Raise RuntimeError if a binary died part way through writing to
+    the primary DB (given its first shard), so some of its records are
+    written and others aren't. Only meaningful once nothing is writing."""
+    with getKtClient(dbElem) as client:
+        started = client.increment(WRITES_STARTED_KEY, 0)
+        finished = client.increment(WRITES_FINISHED_KEY, 0)
+    if started != finished:
+        raise RuntimeError("%d of the %d split writes to the primary DB never finished, so it is"
+                           " inconsistent" % (started - finished, started))
+
+def resetSecondaryDB(dbElem, namespace):
+    """Clear a pooled secondary DB and hand it to the given namespace,
+    whatever was using it before."""
+    with getKtClient(dbElem) as client:
+        client.clear()
+        client.set(NAMESPACE_KEY, namespace)
+
+def releaseSecondaryDB(dbElem, namespace):
+    """Clear a pooled secondary DB once the given namespace is done with
+    it. Raises RuntimeError if it has since been handed to another.
+    Clearing it also removes the namespace, so finding none means it has
+    already been released (by an earlier attempt at the same job)."""
+    with getKtClient(dbElem) as client:
+        owner = client.get(NAMESPACE_KEY)
+        if owner is None:
+            return
+        if owner != namespace:
+            raise RuntimeError("Tried to release the secondary DB for %s, but it is being used for %s"
+                               % (namespace, owner))
+        client.clear()
+
 ###############################################################################
 # Hostnames of swarm nodes (ex kkr18u57.local) are not visible from
 # other swarm nodes (dropping the .local does work).  So we try to
@@ -251,18 +350,64 @@ def getHostName():
         return hostIp
     return hostName
 
-def findOccupiedPorts():
-    """Attempt to find all currently taken TCP ports.
-
-    Returns a set of ints, representing taken ports."""
-    netstatOutput = cactus_call(parameters=["netstat", "-tuplen"], check_output=True)
-    ports = set()
-    for line in netstatOutput.split("\n"):
-        fields = line.split()
-        if len(fields) != 9:
-            # Header or other garbage line
+def getPortRegistryDir():
+    """Get the node-local directory that holds a lock file for each port
+    reserved for a ktserver."""
+    registryDir = os.path.join(tempfile.gettempdir(), "cactus-ktserver-ports")
+    if not os.path.isdir(registryDir):
+        try:
+            os.makedirs(registryDir)
+            # Shared by all users on the node.
+            os.chmod(registryDir, 0o1777)
+        except OSError:
+            # Another job created it first.
+            if not os.path.isdir(registryDir):
+                raise
+    return registryDir
+
+def isPortFree(port):
+    """Check that nothing is listening on, or connected from, port."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.bind(('', port))
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+    return True
+
+def reservePort(registryDir=None, minPort=1025, maxPort=MAX_KTSERVER_PORT):
+    """Find a free port for a ktserver to listen on.
+
+    Each port is reserved in a node-local registry by holding an
+    exclusive lock on its lock file, so that jobs starting servers at
+    the same time on the same node can't pick the same port. The lock
+    is released when the returned file (and any copy of it inherited
+    by a child process) is closed, including when the process dies.
+
+    Returns the port and the open lock file."""
+    if registryDir is None:
+        registryDir = getPortRegistryDir()
+    # Start from a random port, so that jobs don't all contend for the
+    # first few.
+    start = random.randint(minPort, maxPort)
+    for i in xrange(maxPort - minPort + 1):
+        port = minPort + (start - minPort + i) % (maxPort - minPort + 1)
+        lockPath = os.path.join(registryDir, "%d.lock" % port)
+        try:
+            lockFile = open(lockPath, 'a')
+        except IOError:
+            # Left behind by another user.
+            continue
+        try:
+            fcntl.flock(lockFile.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as e:
+            lockFile.close()
+            if e.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
             continue
-        port = int(fields[3].split(':')[-1])
-        ports.add(port)
-    logger.debug('Detected ports in use: %s' % repr(ports))
-    return ports
+        if isPortFree(port):
+            logger.debug("Reserved port %d for ktserver" % port)
+            return port, lockFile
+        lockFile.close()
+    raise RuntimeError("Unable to find a free port for ktserver")
@@ -0,0 +1,139 @@
+import unittest
+import os
+import time
+import shutil
+import socket
+from threading import Thread
+from sonLib.bioio import getTempDirectory
+from cactus.pipeline.ktserverControl import reservePort, isPortFree, KtserverLog, \
+    blockUntilKtserverIsRunning, blockUntilKtserverIsFinished, resetSecondaryDB, releaseSecondaryDB, \
+    checkPrimaryDBWrites, NAMESPACE_KEY, WRITES_STARTED_KEY, WRITES_FINISHED_KEY
+from cactus.pipeline.ktClientTest import FakeKtServer
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.registryDir = getTempDirectory()
+
+    def tearDown(self):
+        shutil.rmtree(self.registryDir)
+        unittest.TestCase.tearDown(self)
+
+    def testReservePort(self):
+        reservations = [reservePort(self.registryDir) for _ in xrange(50)]
+        ports = [port for port, _ in reservations]
+        self.assertEqual(len(set(ports)), len(ports))
+        # A reserved port isn't handed out again until it is released.
+        port, lockFile = reservations[0]
+        self.assertRaises(RuntimeError, reservePort, self.registryDir, port, port)
+        lockFile.close()
+        self.assertEqual(reservePort(self.registryDir, port, port)[0], port)
+
+    def testPortInUse(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('', 0))
+        sock.listen(1)
+        port = sock.getsockname()[1]
+        try:
+            self.assertFalse(isPortFree(port))
+            self.assertRaises(RuntimeError, reservePort, self.registryDir, port, port)
+        finally:
+            sock.close()
+        self.assertTrue(isPortFree(port))
+
+    def testKtserverLog(self):
+        logPath = os.path.join(self.registryDir, "log")
+        open(logPath, 'w').close()
+        log = KtserverLog(logPath)
+        self.assertFalse(log.update().running)
+        with open(logPath, 'a') as f:
+            f.write("2017-01-01T00:00:00: [SYSTEM]: starting the server\n2017-01-01T00:00:00: [SYSTEM]: lis")
+        self.assertFalse(log.update().running)
+        with open(logPath, 'a') as f:
+            f.write("tening\n")
+        self.assertTrue(log.update().running)
+        self.assertFalse(log.failed)
+        # Only the new part of the log is read.
+        self.assertEqual(log.offset, os.path.getsize(logPath))
+        with open(logPath, 'a') as f:
+            f.write("[ERROR]: something\n[SYSTEM]: [FINISH]\n")
+        log.update()
+        self.assertTrue(log.failed)
+        self.assertTrue(log.finished)
+        self.assertTrue(blockUntilKtserverIsFinished(logPath))
+
+    def testBlockUntilRunning(self):
+        logPath = os.path.join(self.registryDir, "log")
+        open(logPath, 'w').close()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('localhost', 0))
+        port = sock.getsockname()[1]
+        def start():
+            time.sleep(0.2)
+            with open(logPath, 'a') as f:
+                f.write("[SYSTEM]: listening server\n")
+            time.sleep(0.2)
+            sock.listen(1)
+        thread = Thread(target=start)
+        thread.start()
+        startTime = time.time()
+        self.assertTrue(blockUntilKtserverIsRunning(logPath, createTimeout=10, host='localhost', port=port))
+        self.assertTrue(time.time() - startTime >= 0.35)
+        thread.join()
+        sock.close()
+
+        with open(logPath, 'a') as f:
+            f.write("[ERROR]: can't open the database\n")
+        self.assertFalse(blockUntilKtserverIsRunning(logPath, createTimeout=10))
+
+    def startFakeKtServer(self):
+        """Start a fake ktserver, returning it and a DB elem for it."""
+        server = FakeKtServer()
+        thread = Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        class FakeDbElem(object):
+            def getDbHost(self):
+                return "localhost"
+            def getDbPort(self):
+                return server.server_address[1]
+        return server, FakeDbElem
+
+    def testPrimaryDBWrites(self):
+        server, FakeDbElem = self.startFakeKtServer()
+        try:
+            # Nothing has been written yet.
+            checkPrimaryDBWrites(FakeDbElem())
+            server.records[WRITES_STARTED_KEY] = "3"
+            server.records[WRITES_FINISHED_KEY] = "2"
+            self.assertRaises(RuntimeError, checkPrimaryDBWrites, FakeDbElem())
+            server.records[WRITES_FINISHED_KEY] = "3"
+            checkPrimaryDBWrites(FakeDbElem())
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def testSecondaryDBNamespaces(self):
+        server, FakeDbElem = self.startFakeKtServer()
+        try:
+            server.records["leftover"] = "1"
+            resetSecondaryDB(FakeDbElem(), "reference")
+            self.assertEqual(server.records, {NAMESPACE_KEY: "reference"})
+            server.records["record"] = "1"
+            # Only the phase holding the DB can release it.
+            self.assertRaises(RuntimeError, releaseSecondaryDB, FakeDbElem(), "hal")
+            releaseSecondaryDB(FakeDbElem(), "reference")
+            self.assertEqual(server.records, {})
+            # A retry of the job releasing it finds it already released.
+            releaseSecondaryDB(FakeDbElem(), "reference")
+            releaseSecondaryDB(FakeDbElem(), "hal")
+            # The next phase gets it regardless.
+            server.records["record"] = "1"
+            resetSecondaryDB(FakeDbElem(), "hal")
+            self.assertEqual(server.records, {NAMESPACE_KEY: "hal"})
+        finally:
+            server.shutdown()
+            server.server_close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+
+#Released under the MIT license, see LICENSE.txt
+
+"""Delta snapshots of the primary DB.
+
+Each checkpoint phase starts the primary ktserver from the snapshot the
+previous phase left behind and, on shutdown, exports a new snapshot of
+the whole DB, even though most records haven't changed. Instead of the
+full snapshot we can export a delta against the snapshot the server was
+started from: the new snapshot is cut into content-defined chunks, and
+chunks that also appear in the base are replaced by references to it.
+Cutting the chunks where the content has some fixed pattern (rather than
+at fixed offsets) means that records inserted or resized in one part of
+the file don't change the chunks in the rest of it.
+
+A delta file names the file-store ID of its base (which may itself be a
+delta), so a snapshot ID can be passed around as before and turned back
+into a full snapshot, loadable by ktserver, with materializeSnapshot.
+Rebuilding a snapshot means reading and rewriting it once per delta in
+its chain, so chains are kept to at most MAX_CHAIN_LENGTH deltas, after
+which a full snapshot is exported again.
+"""
+
+import os
+import mmap
+import zlib
+import struct
+import hashlib
+
+MAGIC = "CACTUSKTDELTA\x01"
+
+# Chunks end just after this marker, but are never shorter than
+# MIN_CHUNK_SIZE or longer than MAX_CHUNK_SIZE. In random-looking data
+# (e.g. compressed records) a two-byte marker gives an average chunk of
+# MIN_CHUNK_SIZE + 64KiB.
+CHUNK_MARKER = "\x8f\x3a"
+MIN_CHUNK_SIZE = 16 * 1024
+MAX_CHUNK_SIZE = 1024 * 1024
+
+COPY_OP = "C"
+LITERAL_OP = "L"
+END_OP = "E"
+
+MAX_CHAIN_LENGTH = 2
+
+def chunkBoundaries(data, minSize=MIN_CHUNK_SIZE, maxSize=MAX_CHUNK_SIZE):
+    """Yield the (offset, length) of each content-defined chunk of data
+    (a string or mmap)."""
+    size = len(data)
+    start = 0
+    while start < size:
+        pos = data.find(CHUNK_MARKER, start + minSize, start + maxSize)
+        if pos == -1:
+            end = min(start + maxSize, size)
+        else:
+            end = pos + len(CHUNK_MARKER)
+        yield start, end - start
+        start = end
+
+def mapFile(f):
+    """Memory-map an open file, or return "" if it is empty (which can't be mapped)."""
+    if os.fstat(f.fileno()).st_size == 0:
+        return ""
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def isDelta(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+def readHeader(f):
+    """Read (baseID, length, md5 digest) from the start of a delta file."""
+    if f.read(len(MAGIC)) != MAGIC:
+        raise RuntimeError("Not a snapshot delta")
+    baseIDLength, = struct.unpack(">I", f.read(4))
+    baseID = f.read(baseIDLength)
+    length, = struct.unpack(">Q", f.read(8))
+    digest = f.read(16)
+    return baseID, length, digest
+
+def getDeltaBaseID(path):
+    with open(path, 'rb') as f:
+        return readHeader(f)[0]
+
+def writeDelta(basePath, baseID, newPath, deltaPath, maxFraction=0.5):
+    """Write a delta that turns the snapshot at basePath (with file-store
+    ID baseID) into the one at newPath. Returns True, or False (leaving
+    deltaPath in an unspecified state) if the delta would be more than
+    maxFraction of the size of the new snapshot, in which case it is
+    better to keep the full snapshot."""
+    baseID = str(baseID)
+    with open(basePath, 'rb') as baseFile, open(newPath, 'rb') as newFile, open(deltaPath, 'wb') as out:
+        base = mapFile(baseFile)
+        new = mapFile(newFile)
+        baseChunks = {}
+        for offset, length in chunkBoundaries(base):
+            baseChunks.setdefault(hashlib.md5(base[offset:offset + length]).digest(), (offset, length))
+
+        digest = hashlib.md5()
+        out.write(MAGIC)
+        out.write(struct.pack(">I", len(baseID)))
+        out.write(baseID)
+        out.write(struct.pack(">Q", len(new)))
+        # Filled in at the end.
+        digestOffset = out.tell()
+        out.write("\0" * 16)
+
+        maxSize = maxFraction * len(new)
+        # Runs of chunks that are contiguous in the base become one copy.
+        copyStart = copyLength = None
+        def flushCopy():
+            if copyStart is not None:
+                out.write(COPY_OP + struct.pack(">QQ", copyStart, copyLength))
+        for offset, length in chunkBoundaries(new):
+            chunk = new[offset:offset + length]
+            digest.update(chunk)
+            baseChunk = baseChunks.get(hashlib.md5(chunk).digest())
+            if baseChunk is not None and base[baseChunk[0]:baseChunk[0] + length] == chunk:
+                if copyStart is not None and copyStart + copyLength == baseChunk[0]:
+                    copyLength += length
+                else:
+                    flushCopy()
+                    copyStart, copyLength = baseChunk
+                continue
+            flushCopy()
+            copyStart = copyLength = None
+            compressed = zlib.compress(chunk, 1)
+            out.write(LITERAL_OP + struct.pack(">QI", length, len(compressed)))
+            out.write(compressed)
+            if out.tell() > maxSize:
+                return False
+        flushCopy()
+        out.write(END_OP)
+        out.seek(digestOffset)
+        out.write(digest.digest())
+        return True
+
+def applyDelta(basePath, deltaPath, outPath):
+    """Rebuild the snapshot that deltaPath was made from, given its base."""
+    with open(basePath, 'rb') as baseFile, open(deltaPath, 'rb') as delta, open(outPath, 'wb') as out:
+        base = mapFile(baseFile)
+        _, length, expectedDigest = readHeader(delta)
+        digest = hashlib.md5()
+        while True:
+            op = delta.read(1)
+            if op == COPY_OP:
+                offset, copyLength = struct.unpack(">QQ", delta.read(16))
+                if offset + copyLength > len(base):
+                    raise RuntimeError("Snapshot delta refers past the end of its base")
+                # Copy in bounded pieces to keep the memory use down.
+                for pieceOffset in xrange(offset, offset + copyLength, MAX_CHUNK_SIZE):
+                    piece = base[pieceOffset:min(pieceOffset + MAX_CHUNK_SIZE, offset + copyLength)]
+                    digest.update(piece)
+                    out.write(piece)
+            elif op == LITERAL_OP:
+                literalLength, compressedLength = struct.unpack(">QI", delta.read(12))
+                chunk = zlib.decompress(delta.read(compressedLength))
+                if len(chunk) != literalLength:
+                    raise RuntimeError("Corrupt snapshot delta")
+                digest.update(chunk)
+                out.write(chunk)
+            elif op == END_OP:
+                break
+            else:
+                raise RuntimeError("Truncated or corrupt snapshot delta")
+        if out.tell() != length or digest.digest() != expectedDigest:
+            raise RuntimeError("Snapshot rebuilt from delta does not match the original")
+
+def materializeSnapshot(fileStore, snapshotID, path):
+    """Write the full snapshot with ID snapshotID (a full snapshot or a
+    delta) to path, reading the chain of bases it depends on. Returns the
+    path and the number of deltas in the chain."""
+    chain = []
+    fileID = snapshotID
+    while True:
+        localPath = fileStore.readGlobalFile(fileID, userPath=fileStore.getLocalTempFile() + ".snapshot")
+        if not isDelta(localPath):
+            break
+        chain.append(localPath)
+        fileID = getDeltaBaseID(localPath)
+    basePath = localPath
+    for deltaPath in reversed(chain):
+        newPath = fileStore.getLocalTempFile() + ".snapshot"
+        applyDelta(basePath, deltaPath, newPath)
+        os.remove(basePath)
+        os.remove(deltaPath)
+        basePath = newPath
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(basePath, path)
+    return path, len(chain)
@@ -0,0 +1,110 @@
+import unittest
+import os
+import random
+import shutil
+import tempfile
+from sonLib.bioio import getTempDirectory
+from cactus.pipeline.snapshotDelta import writeDelta, applyDelta, isDelta, getDeltaBaseID, \
+    materializeSnapshot, chunkBoundaries
+
+class FakeFileStore(object):
+    """Keeps "global" files in a directory, named by their IDs."""
+    def __init__(self, tempDir):
+        self.tempDir = tempDir
+        self.globalDir = os.path.join(tempDir, "global")
+        os.mkdir(self.globalDir)
+
+    def writeGlobalFile(self, path):
+        fileID = "file%d" % len(os.listdir(self.globalDir))
+        shutil.copyfile(path, os.path.join(self.globalDir, fileID))
+        return fileID
+
+    def readGlobalFile(self, fileID, userPath):
+        shutil.copyfile(os.path.join(self.globalDir, fileID), userPath)
+        return userPath
+
+    def getLocalTempFile(self):
+        handle, path = tempfile.mkstemp(dir=self.tempDir)
+        os.close(handle)
+        return path
+
+def randomRecords(n):
+    return [os.urandom(random.randint(10, 5000)) for _ in xrange(n)]
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.tempDir = getTempDirectory()
+        self.fileStore = FakeFileStore(self.tempDir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+        unittest.TestCase.tearDown(self)
+
+    def writeSnapshot(self, records):
+        path = self.fileStore.getLocalTempFile()
+        with open(path, 'wb') as f:
+            f.write("".join(records))
+        return path
+
+    def testChunkBoundaries(self):
+        data = os.urandom(1000000)
+        chunks = list(chunkBoundaries(data, minSize=100, maxSize=10000))
+        self.assertEqual("".join(data[offset:offset + length] for offset, length in chunks), data)
+        self.assertTrue(all(length <= 10000 for _, length in chunks))
+        # Boundaries resynchronize after an insertion.
+        shifted = list(chunkBoundaries("x" * 77 + data, minSize=100, maxSize=10000))
+        self.assertTrue(len(set(chunks) & set((offset - 77, length) for offset, length in shifted)) > len(chunks) / 2)
+        self.assertEqual(list(chunkBoundaries("")), [])
+
+    def testDelta(self):
+        records = randomRecords(10000)
+        basePath = self.writeSnapshot(records)
+        # Change, remove and insert a few records.
+        for i in random.sample(xrange(len(records)), 10):
+            records[i] = os.urandom(random.randint(10, 5000))
+        del records[100]
+        records.insert(500, os.urandom(3000))
+        newPath = self.writeSnapshot(records)
+        deltaPath = self.fileStore.getLocalTempFile()
+        self.assertTrue(writeDelta(basePath, "base", newPath, deltaPath))
+        self.assertTrue(isDelta(deltaPath))
+        self.assertFalse(isDelta(newPath))
+        self.assertEqual(getDeltaBaseID(deltaPath), "base")
+        self.assertTrue(os.path.getsize(deltaPath) < os.path.getsize(newPath) / 2)
+        outPath = self.fileStore.getLocalTempFile()
+        applyDelta(basePath, deltaPath, outPath)
+        self.assertEqual(open(outPath, 'rb').read(), open(newPath, 'rb').read())
+
+        # A delta can't be applied to the wrong base.
+        self.assertRaises(RuntimeError, applyDelta, newPath, deltaPath, outPath)
+
+        # If most of the snapshot is new, there is no point in a delta.
+        otherPath = self.writeSnapshot(randomRecords(10000))
+        self.assertFalse(writeDelta(basePath, "base", otherPath, deltaPath))
+
+    def testMaterializeChain(self):
+        records = randomRecords(5000)
+        snapshotPath = self.writeSnapshot(records)
+        snapshotID = self.fileStore.writeGlobalFile(snapshotPath)
+        for _ in xrange(3):
+            records = records[:]
+            for i in random.sample(xrange(len(records)), 10):
+                records[i] = os.urandom(random.randint(10, 5000))
+            newPath = self.writeSnapshot(records)
+            deltaPath = self.fileStore.getLocalTempFile()
+            self.assertTrue(writeDelta(snapshotPath, snapshotID, newPath, deltaPath))
+            snapshotID = self.fileStore.writeGlobalFile(deltaPath)
+            snapshotPath = newPath
+        path, chainLength = materializeSnapshot(self.fileStore, snapshotID, self.fileStore.getLocalTempFile())
+        self.assertEqual(open(path, 'rb').read(), "".join(records))
+        self.assertEqual(chainLength, 3)
+
+        # An empty snapshot materializes as itself.
+        emptyID = self.fileStore.writeGlobalFile(self.writeSnapshot([]))
+        path, chainLength = materializeSnapshot(self.fileStore, emptyID, self.fileStore.getLocalTempFile())
+        self.assertEqual(os.path.getsize(path), 0)
+        self.assertEqual(chainLength, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -10,6 +10,7 @@ sequences. Uses the jobTree framework to parallelise the blasts.
 """
 import os
 import math
+import string
 from argparse import ArgumentParser
 import xml.etree.ElementTree as ET
 
@@ -23,7 +24,7 @@ from cactus.shared.common import RoundedJob
 from cactus.shared.common import getOptionalAttrib
 from cactus.shared.common import runGetChunks
 from cactus.shared.common import makeURL
-from cactus.shared.common import readGlobalFileWithoutCache
+from cactus.shared.readCache import readGlobalFileShared
 from cactus.shared.configWrapper import ConfigWrapper
 
 from toil.lib.bioio import setLoggingFromOptions
@@ -57,9 +58,10 @@ class PreprocessChunk(RoundedJob):
 
     def run(self, fileStore):
         outChunkID = None
+        inChunk = None
         if self.prepOptions.preprocessJob == "checkUniqueHeaders":
-            inChunk = fileStore.readGlobalFile(self.inChunkID)
-            seqPaths = [fileStore.readGlobalFile(fileID) for fileID in self.seqIDs]
+            inChunk = readGlobalFileShared(fileStore, self.inChunkID)
+            seqPaths = [readGlobalFileShared(fileStore, fileID) for fileID in self.seqIDs]
             seqString = " ".join(seqPaths)
             args = [inChunk]
             if self.prepOptions.checkAssemblyHub:
@@ -68,13 +70,28 @@ class PreprocessChunk(RoundedJob):
                         parameters=["cactus_checkUniqueHeaders.py"] + args)
             outChunkID = self.inChunkID
         elif self.prepOptions.preprocessJob == "lastzRepeatMask":
+            # Unmasking is done by lastz and the softmasking script
+            # as they read the sequences, rather than as a separate
+            # pass over the input.
             repeatMaskOptions = RepeatMaskOptions(proportionSampled=self.prepOptions.proportionToSample,
-                    minPeriod=self.prepOptions.minPeriod)
-            outChunkID = self.addChild(LastzRepeatMaskJob(repeatMaskOptions=repeatMaskOptions, 
+                    minPeriod=self.prepOptions.minPeriod,
+                    unmaskInput=self.prepOptions.unmask,
+                    unmaskOutput=self.prepOptions.unmask)
+            return self.addChild(LastzRepeatMaskJob(repeatMaskOptions=repeatMaskOptions, 
                     queryID=self.inChunkID, targetIDs=self.seqIDs)).rv()
         elif self.prepOptions.preprocessJob == "none":
             outChunkID = self.inChunkID
 
+        if self.prepOptions.unmask and outChunkID is not None:
+            # The chunk is read locally anyway, so uppercase it on the
+            # way out instead of pushing an unmasked copy of the whole
+            # input through the job store beforehand.
+            if inChunk is None:
+                inChunk = readGlobalFileShared(fileStore, self.inChunkID)
+            unmaskedChunk = fileStore.getLocalTempFile()
+            unmaskFasta(inChunk, unmaskedChunk)
+            outChunkID = fileStore.writeGlobalFile(unmaskedChunk)
+
         return outChunkID
 
 class MergeChunks(RoundedJob):
@@ -96,7 +113,7 @@ class MergeChunks2(RoundedJob):
         self.chunkIDList = chunkIDList
 
     def run(self, fileStore):
-        chunkList = [readGlobalFileWithoutCache(fileStore, fileID) for fileID in self.chunkIDList]
+        chunkList = [readGlobalFileShared(fileStore, fileID) for fileID in self.chunkIDList]
 
         #Docker expects paths relative to the work dir
         chunkList = [os.path.basename(chunk) for chunk in chunkList]
@@ -119,7 +136,7 @@ class PreprocessSequence(RoundedJob):
     def run(self, fileStore):
         logger.info("Preparing sequence for preprocessing")
         # chunk it up
-        inSequence = fileStore.readGlobalFile(self.inSequenceID)
+        inSequence = readGlobalFileShared(fileStore, self.inSequenceID)
         inChunkDirectory = getTempDirectory(rootDir=fileStore.getLocalTempDir())
         inChunkList = runGetChunks(sequenceFiles=[inSequence], chunksDir=inChunkDirectory,
                                    chunkSize=self.prepOptions.chunkSize,
@@ -147,14 +164,56 @@ class PreprocessSequence(RoundedJob):
         # follow on to merge chunks
         return self.addFollowOn(MergeChunks(self.prepOptions, outChunkIDList)).rv()
 
-def unmaskFasta(inFasta, outFasta):
-    """Uppercase a fasta file (removing the soft-masking)."""
-    with open(outFasta, 'w') as out:
-        for line in open(inFasta):
-            if len(line) > 0 and line[0] != ">":
-                out.write(line.upper())
-            else:
-                out.write(line)
+# Translation table mapping lowercase bases to uppercase.
+_unmaskTable = string.maketrans(string.ascii_lowercase, string.ascii_uppercase)
+
+def unmaskFastaBlock(block, inHeader, atLineStart):
+    """Uppercase one block of a fasta file, leaving header lines untouched.
+
+    inHeader and atLineStart describe the state at the end of the
+    previous block. Returns the translated block and the state at the
+    end of this one.
+    """
+    out = []
+    pos = 0
+    while pos < len(block):
+        if inHeader:
+            lineEnd = block.find('\n', pos)
+            if lineEnd == -1:
+                out.append(block[pos:])
+                return "".join(out), True, False
+            out.append(block[pos:lineEnd + 1])
+            pos = lineEnd + 1
+            inHeader = False
+            atLineStart = True
+        elif atLineStart and block[pos] == '>':
+            inHeader = True
+        else:
+            headerStart = block.find('\n>', pos)
+            if headerStart == -1:
+                out.append(block[pos:].translate(_unmaskTable))
+                return "".join(out), False, block[-1] == '\n'
+            out.append(block[pos:headerStart + 1].translate(_unmaskTable))
+            pos = headerStart + 1
+            inHeader = True
+    return "".join(out), inHeader, atLineStart
+
+def unmaskFasta(inFasta, outFasta, blockSize=1 << 22):
+    """Uppercase a fasta file (removing the soft-masking).
+
+    The file is streamed through in large blocks rather than line by
+    line.
+    """
+    inHeader = False
+    atLineStart = True
+    with open(inFasta) as inFile:
+        with open(outFasta, 'w') as out:
+            while True:
+                block = inFile.read(blockSize)
+                if block == '':
+                    break
+                block, inHeader, atLineStart = unmaskFastaBlock(block, inHeader, atLineStart)
+                out.write(block)
 
 class BatchPreprocessor(RoundedJob):
     def __init__(self, prepXmlElems, inSequenceID, iteration = 0):
@@ -181,12 +240,8 @@ class BatchPreprocessor(RoundedJob):
         
         lastIteration = self.iteration == len(self.prepXmlElems) - 1
 
-        if prepOptions.unmask:
-            inSequence = fileStore.readGlobalFile(self.inSequenceID)
-            unmaskedInputFile = fileStore.getLocalTempFile()
-            unmaskFasta(inSequence, unmaskedInputFile)
-            self.inSequenceID = fileStore.writeGlobalFile(inSequence)
-            
+        # Unmasking (prepOptions.unmask) is applied by PreprocessChunk
+        # as each chunk is processed.
         if prepOptions.chunkSize <= 0: #In this first case we don't need to break up the sequence
             outSeqID = self.addChild(PreprocessChunk(prepOptions, [ self.inSequenceID ], 1.0, self.inSequenceID)).rv()
         else:
@@ -7,6 +7,7 @@ from cactus.preprocessor.lastzRepeatMasking.cactus_lastzRepeatMask import LastzR
 from cactus.preprocessor.cactus_preprocessor import CactusPreprocessor
 import xml.etree.ElementTree as ET
 from cactus.preprocessor.cactus_preprocessor import runCactusPreprocessor
+from cactus.preprocessor.cactus_preprocessor import unmaskFasta
 
 from toil.common import Toil
 from toil.job import Job
@@ -16,6 +17,18 @@ from cactus.shared.common import makeURL
 """
 
 class TestCase(PreprocessorTestCase):
+    def testUnmaskFasta(self):
+        """Unmasking should uppercase sequence lines, but leave headers alone,
+        regardless of where the block boundaries fall."""
+        inFasta = os.path.join(self.tempDir, "masked.fa")
+        outFasta = os.path.join(self.tempDir, "unmasked.fa")
+        with open(inFasta, 'w') as f:
+            f.write(">seq1 lowercase header\nacgtNNacgt\nACgt\n>seq2\n\nnnnaC\n>seq3")
+        for blockSize in [1, 2, 3, 5, 8, 13, 1 << 22]:
+            unmaskFasta(inFasta, outFasta, blockSize=blockSize)
+            self.assertEquals(open(outFasta).read(),
+                              ">seq1 lowercase header\nACGTNNACGT\nACGT\n>seq2\n\nNNNAC\n>seq3")
+
     def testCactusPreprocessor(self):
         #Demo sequences
         sequenceNames = [ "%s.ENm001.fa" % species for species in ['human', 'hedgehog'] ]
@@ -22,7 +22,6 @@ from toil.common import Toil
 from cactus.shared.common import makeURL
 from cactus.shared.common import cactus_call
 from cactus.shared.common import RoundedJob
-from cactus.shared.common import readGlobalFileWithoutCache
 
 class RepeatMaskOptions:
     def __init__(self, 
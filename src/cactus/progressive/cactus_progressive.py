@@ -38,7 +38,7 @@ from cactus.pipeline.cactus_workflow import CactusTrimmingBlastPhase
 
 from cactus.progressive.multiCactusProject import MultiCactusProject
 from cactus.shared.experimentWrapper import ExperimentWrapper
-from cactus.shared.configWrapper import ConfigWrapper
+from cactus.shared.configWrapper import ResolvedConfig
 from cactus.progressive.schedule import Schedule
 from cactus.progressive.projectWrapper import ProjectWrapper
 
@@ -54,9 +54,7 @@ class ProgressiveDown(RoundedJob):
         self.schedule = schedule
     
     def run(self, fileStore):
-        self.configNode = ET.parse(fileStore.readGlobalFile(self.project.getConfigID())).getroot()
-        self.configWrapper = ConfigWrapper(self.configNode)
-        self.configWrapper.substituteAllPredefinedConstantsWithLiterals()
+        config = self.project.getConfig()
         logger.info("Progressive Down: " + self.event)
 
         depProjects = dict()
@@ -69,7 +67,7 @@ class ProgressiveDown(RoundedJob):
                                                                self.schedule)).rv()
 
         return self.addFollowOn(ProgressiveNext(self.options, self.project, self.event,
-                                                              self.schedule, depProjects, memory=self.configWrapper.getDefaultMemory())).rv()
+                                                              self.schedule, depProjects, memory=config.getDefaultMemory())).rv()
 class ProgressiveNext(RoundedJob):
     def __init__(self, options, project, event, schedule, depProjects, memory=None, cores=None):
         RoundedJob.__init__(self, memory=memory, cores=cores, preemptable=True)
@@ -80,9 +78,7 @@ class ProgressiveNext(RoundedJob):
         self.depProjects = depProjects
     
     def run(self, fileStore):
-        self.configNode = ET.parse(fileStore.readGlobalFile(self.project.getConfigID())).getroot()
-        self.configWrapper = ConfigWrapper(self.configNode)
-        self.configWrapper.substituteAllPredefinedConstantsWithLiterals()
+        config = self.project.getConfig()
 
         fileStore.logToMaster("Project has %i dependencies" % len(self.depProjects))
         for projName in self.depProjects:
@@ -98,8 +94,8 @@ class ProgressiveNext(RoundedJob):
         eventExpWrapper = None
         logger.info("Progressive Next: " + self.event)
         if not self.schedule.isVirtual(self.event):
-            eventExpWrapper = self.addChild(ProgressiveUp(self.options, self.project, self.event, memory=self.configWrapper.getDefaultMemory())).rv()
-        return self.addFollowOn(ProgressiveOut(self.options, self.project, self.event, eventExpWrapper, self.schedule, memory=self.configWrapper.getDefaultMemory())).rv()
+            eventExpWrapper = self.addChild(ProgressiveUp(self.options, self.project, self.event, memory=config.getDefaultMemory())).rv()
+        return self.addFollowOn(ProgressiveOut(self.options, self.project, self.event, eventExpWrapper, self.schedule, memory=config.getDefaultMemory())).rv()
 
 class ProgressiveOut(RoundedJob):
     def __init__(self, options, project, event, eventExpWrapper, schedule, memory=None, cores=None):
@@ -111,9 +107,7 @@ class ProgressiveOut(RoundedJob):
         self.schedule = schedule
         
     def run(self, fileStore):
-        self.configNode = ET.parse(fileStore.readGlobalFile(self.project.getConfigID())).getroot()
-        self.configWrapper = ConfigWrapper(self.configNode)
-        self.configWrapper.substituteAllPredefinedConstantsWithLiterals()
+        config = self.project.getConfig()
 
         if not self.schedule.isVirtual(self.event):
             tmpExp = fileStore.getLocalTempFile()
@@ -123,7 +117,7 @@ class ProgressiveOut(RoundedJob):
         if followOnEvent is not None:
             logger.info("Adding follow-on event %s" % followOnEvent)
             return self.addFollowOn(ProgressiveDown(self.options, self.project, followOnEvent,
-                                                    self.schedule, memory=self.configWrapper.getDefaultMemory())).rv()
+                                                    self.schedule, memory=config.getDefaultMemory())).rv()
 
         return self.project
     
@@ -135,10 +129,6 @@ class ProgressiveUp(RoundedJob):
         self.event = event
     
     def run(self, fileStore):
-        self.configNode = ET.parse(fileStore.readGlobalFile(self.project.getConfigID())).getroot()
-        self.configWrapper = ConfigWrapper(self.configNode)
-        self.configWrapper.substituteAllPredefinedConstantsWithLiterals()
-
         logger.info("Progressive Up: " + self.event)
 
         # open up the experiment
@@ -174,9 +164,7 @@ class ProgressiveUp(RoundedJob):
             self.options.buildFasta = getOptionalAttrib(halNode, "buildFasta", bool, False)
 
         # get parameters that cactus_workflow stuff wants
-        configFile = fileStore.readGlobalFile(experiment.getConfigID())
-        configNode = ET.parse(configFile).getroot()
-        workFlowArgs = CactusWorkflowArguments(self.options, experimentFile=experimentFile, configNode=configNode, seqIDMap = seqIDMap)
+        workFlowArgs = CactusWorkflowArguments(self.options, experimentFile=experimentFile, configNode=configXml, seqIDMap = seqIDMap)
 
         # copy over the options so we don't trail them around
         workFlowArgs.buildReference = self.options.buildReference
@@ -207,22 +195,16 @@ class RunCactusPreprocessorThenProgressiveDown(RoundedJob):
         self.project = project
         
     def run(self, fileStore):
-        self.configNode = ET.parse(fileStore.readGlobalFile(self.project.getConfigID())).getroot()
-        self.configWrapper = ConfigWrapper(self.configNode)
-        self.configWrapper.substituteAllPredefinedConstantsWithLiterals()
+        config = self.project.getConfig()
 
         # Log the stats for the un-preprocessed assemblies
         for name, sequence in self.project.getInputSequenceIDMap().items():
             self.addChildJobFn(logAssemblyStats, "Before preprocessing", name, sequence)
 
         # Create jobs to create the output sequences
-        logger.info("Reading config file from: %s" % self.project.getConfigID())
-        configFile = fileStore.readGlobalFile(self.project.getConfigID())
-        configNode = ET.parse(configFile).getroot()
-        ConfigWrapper(configNode).substituteAllPredefinedConstantsWithLiterals() #This is necessary..
         #Add the preprocessor child job. The output is a job promise value that will be
         #converted into a list of the IDs of the preprocessed sequences in the follow on job.
-        preprocessorJob = self.addChild(CactusPreprocessor(self.project.getInputSequenceIDs(), configNode))
+        preprocessorJob = self.addChild(CactusPreprocessor(self.project.getInputSequenceIDs(), config.getNode()))
         self.project.setOutputSequenceIDs([preprocessorJob.rv(i) for i in range(len(self.project.getInputSequenceIDs()))])
 
         #Now build the progressive-down job
@@ -234,7 +216,7 @@ class RunCactusPreprocessorThenProgressiveDown(RoundedJob):
         fileStore.logToMaster("Leaf names = %s" % leafNames)
         self.options.globalLeafEventSet = set(leafNames)
 
-        return self.addFollowOn(RunCactusPreprocessorThenProgressiveDown2(options=self.options, project=self.project, event=self.options.event, schedule=schedule, memory=self.configWrapper.getDefaultMemory())).rv()
+        return self.addFollowOn(RunCactusPreprocessorThenProgressiveDown2(options=self.options, project=self.project, event=self.options.event, schedule=schedule, memory=config.getDefaultMemory())).rv()
 
 
 class RunCactusPreprocessorThenProgressiveDown2(RoundedJob):
@@ -246,9 +228,7 @@ class RunCactusPreprocessorThenProgressiveDown2(RoundedJob):
         self.schedule = schedule
 
     def run(self, fileStore):
-        self.configNode = ET.parse(fileStore.readGlobalFile(self.project.getConfigID())).getroot()
-        self.configWrapper = ConfigWrapper(self.configNode)
-        self.configWrapper.substituteAllPredefinedConstantsWithLiterals()
+        config = self.project.getConfig()
 
         # Save preprocessed sequences
         if self.options.intermediateResultsUrl is not None:
@@ -260,11 +240,11 @@ class RunCactusPreprocessorThenProgressiveDown2(RoundedJob):
         for name, sequence in self.project.getOutputSequenceIDMap().items():
             self.addChildJobFn(logAssemblyStats, "After preprocessing", name, sequence)
 
-        project = self.addChild(ProgressiveDown(options=self.options, project=self.project, event=self.event, schedule=self.schedule, memory=self.configWrapper.getDefaultMemory())).rv()
+        project = self.addChild(ProgressiveDown(options=self.options, project=self.project, event=self.event, schedule=self.schedule, memory=config.getDefaultMemory())).rv()
 
         #Combine the smaller HAL files from each experiment
-        return self.addFollowOnJobFn(exportHal, project=project, memory=self.configWrapper.getDefaultMemory(),
-                                     disk=self.configWrapper.getExportHalDisk(),
+        return self.addFollowOnJobFn(exportHal, project=project, memory=config.getDefaultMemory(),
+                                     disk=config.getExportHalDisk(),
                                      preemptable=False).rv()
 
 def exportHal(job, project, event=None, cacheBytes=None, cacheMDC=None, cacheRDC=None, cacheW0=None, chunk=None, deflate=None, inMemory=False):
@@ -396,6 +376,10 @@ def main():
                       help="Database type: tokyo_cabinet or kyoto_tycoon"
                       " [default: %(default)s]",
                       default="kyoto_tycoon")
+    parser.add_argument("--databaseShards", dest="databaseShards", type=int,
+                      help="Number of ktservers to spread each primary kyoto_tycoon"
+                      " database over [default: %(default)s]",
+                      default=1)
     parser.add_argument("--configFile", dest="configFile",
                       help="Specify cactus configuration file",
                       default=None)
@@ -470,13 +454,13 @@ def main():
             project.setConfigID(cactusConfigID)
 
             project.syncToFileStore(toil)
-            configNode = ET.parse(project.getConfigPath()).getroot()
-            configWrapper = ConfigWrapper(configNode)
-            configWrapper.substituteAllPredefinedConstantsWithLiterals()
-
+            # Parse and resolve the config just once: the jobs carry it
+            # around with the project.
+            configPath = options.configFile if options.configFile else project.getConfigPath()
+            project.setConfig(ResolvedConfig(ET.parse(configPath).getroot()))
 
             project.writeXML(pjPath)
-            halID = toil.start(RunCactusPreprocessorThenProgressiveDown(options, project, memory=configWrapper.getDefaultMemory()))
+            halID = toil.start(RunCactusPreprocessorThenProgressiveDown(options, project, memory=project.getConfig().getDefaultMemory()))
 
         toil.exportFile(halID, makeURL(options.outputHal))
 
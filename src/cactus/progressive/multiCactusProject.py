@@ -25,6 +25,8 @@ class MultiCactusProject:
         self.inputSequenceIDs = None
         self.outputSequenceIDMap = None
         self.configID = None
+        # The ResolvedConfig for configID. Not saved in the XML.
+        self.config = None
 
     def readXML(self, path):
         xmlRoot = ET.parse(path).getroot()
@@ -131,6 +133,12 @@ class MultiCactusProject:
     def setConfigID(self, configID):
         self.configID = configID
 
+    def setConfig(self, config):
+        self.config = config
+
+    def getConfig(self):
+        return self.config
+
     def getConfigID(self):
         return self.configID
 
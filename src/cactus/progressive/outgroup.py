@@ -20,7 +20,7 @@ from optparse import OptionParser
 
 from cactus.progressive.multiCactusProject import MultiCactusProject
 
-from cactus.shared.common import cactus_call
+from cactus.shared.fastaIndex import indexFastaPaths
 
 class GreedyOutgroup(object):
     def __init__(self):
@@ -459,39 +459,21 @@ class DynamicOutgroup(GreedyOutgroup):
             assert x != None
         return dist
 
-    # use cactus_analyseAssembly to get some very basic stats about the
-    # length and fragmentation of an assembly.  there is certainly
-    # room for investigation of more sophisticated stats...
-    #
-    # Warning: we are tightly coupled to the output format of
-    # cactus_analyseAssembly here... any change may cause an
-    # assertion error
+    # use the sequences' fasta indexes to get some very basic stats
+    # about the length and fragmentation of an assembly.  there is
+    # certainly room for investigation of more sophisticated stats...
     def __getSeqInfo(self, faPaths, event):
-        cmdLine = ["cactus_analyseAssembly"]
         for faPath in faPaths:
             if not os.path.isfile(faPath):
                 raise RuntimeError("Unable to open sequence file %s" % faPath)
-            cmdLine += [faPath]
         isCandidate = False
         if self.candidateSet is not None and event in self.candidateSet:
             isCandidate = True
-        analyseOutput = cactus_call(parameters=cmdLine, work_dir=os.path.dirname(faPath), check_output=True)
-        tsIdx = analyseOutput.index("Total-sequences:")
-        assert tsIdx >= 0 and tsIdx < len(analyseOutput) - 1
-        numSequences = int(analyseOutput[tsIdx + len("Total-sequences:") + 1])
-        tlIdx = analyseOutput.index("Total-length:")
-        assert tlIdx >= 0 and tlIdx < len(analyseOutput) - 1
-        totalLength = int(analyseOutput[tlIdx + len("Total-length:") + 1])
-        nsIdx = analyseOutput.index("ProportionNs:")
-        assert nsIdx >= 0 and nsIdx < len(analyseOutput) - 1
-        nsPct = float(analyseOutput[nsIdx + len("ProportionNs:") + 1])
-        rmIdx = analyseOutput.index("Proportion-repeat-masked:")
-        assert rmIdx >= 0 and rmIdx < len(analyseOutput) - 1
-        rmPct = float(analyseOutput[rmIdx + len("Proportion-repeat-masked:") + 1])
-        assert rmPct <= 1. and rmPct >= 0.
-        n50Idx = analyseOutput.index("N50:")
-        assert n50Idx >= 0 and n50Idx < len(analyseOutput) - 1
-        n50 = int(analyseOutput[n50Idx + 1])
+        fastaIndex = indexFastaPaths(faPaths)
+        numSequences = len(fastaIndex.records)
+        totalLength = fastaIndex.totalLength()
+        nsPct = float(fastaIndex.totalNs()) / totalLength if totalLength > 0 else 0.
+        n50 = fastaIndex.n50()
         
         if isCandidate is True:
             totalLength *= self.candidateBoost
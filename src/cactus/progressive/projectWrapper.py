@@ -55,6 +55,9 @@ class ProjectWrapper:
         confElem.attrib["type"] = database
         ET.SubElement(confElem, database)
         self.expWrapper = ExperimentWrapper(expXml)
+        shards = getattr(self.options, "databaseShards", 1)
+        if database == "kyoto_tycoon" and shards > 1:
+            self.expWrapper.setDbShards(shards)
         if not os.path.exists(self.workingDir):
             os.makedirs(self.workingDir)
 
@@ -30,12 +30,11 @@ from optparse import OptionParser
 from optparse import OptionGroup
 import imp
 import string
-import re
 
 from sonLib.bioio import absSymPath
 from sonLib.nxtree import NXTree
 from sonLib.nxnewick import NXNewick
-from sonLib.bioio import popenCatch
+from cactus.shared.fastaIndex import indexFastaPaths
 
 # parse the input seqfile for progressive cactus.  this file is in the
 # format of:
@@ -131,24 +130,16 @@ class SeqFile:
 
     def sanityCheckSequence(self, path):
         """Warns the user about common problems with the input sequences."""
-        # Relies on cactus_analyseAssembly output staying in the
-        # format it's currently in.
-        cmdline = "cactus_analyseAssembly"
-        if os.path.isdir(path):
-            cmdline = "cat %s/* | %s -" % (path, cmdline)
-        else:
-            cmdline += " %s" % path
-        output = popenCatch(cmdline)
-        try:
-            repeatMaskedFrac = float(re.search(r'Proportion-repeat-masked: ([0-9.]*)', output).group(1))
-            nFrac = float(re.search(r'ProportionNs: ([0-9.]*)', output).group(1))
-        except ValueError:
-            # This can happen if the genome has 0 length, making the fractions NaN.
+        fastaIndex = indexFastaPaths([path])
+        totalLength = fastaIndex.totalLength()
+        if totalLength == 0:
             # We warn the user but return afterwards, as the rest of the checks are
             # dependent on the fraction values.
             sys.stderr.write("WARNING: sequence path %s has 0 length. Consider "
                              "removing it from your input file.\n\n" % path)
             return
+        repeatMaskedFrac = float(fastaIndex.totalMasked()) / totalLength
+        nFrac = float(fastaIndex.totalNs()) / totalLength
         # These thresholds are pretty arbitrary, but should be good for
         # badly- to well-assembled vertebrate genomes.
         if repeatMaskedFrac > 0.70:
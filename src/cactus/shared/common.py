@@ -16,6 +16,8 @@ import uuid
 import json
 import time
 import signal
+import tempfile
+from multiprocessing.pool import ThreadPool
 
 from toil.lib.bioio import logger
 from toil.lib.bioio import system
@@ -219,11 +221,15 @@ def runCactusSetup(cactusDiskDatabaseString, sequences,
     logger.info("Ran cactus setup okay")
     return [ i for i in masterMessages.split("\n") if i != '' ]
 
-def runConvertAlignmentsToInternalNames(cactusDiskString, alignmentsFile, outputFile, flowerName, isBedFile=False):
+def runConvertAlignmentsToInternalNames(cactusDiskString, alignmentsFile, outputFile, flowerName, isBedFile=False, binary=False):
+    """With binary, the alignments are written in the format of
+    cactus.blast.binaryAlignments rather than as cigars."""
     args = [alignmentsFile, outputFile,
             "--cactusDisk", cactusDiskString]
     if isBedFile:
         args += ["--bed"]
+    if binary:
+        args += ["--binary"]
     cactus_call(stdin_string=encodeFlowerNames((flowerName,)),
                 parameters=["cactus_convertAlignmentsToInternalNames"] + args)
 
@@ -738,36 +744,106 @@ def runToilStatusAndFailIfNotComplete(toilDir):
     command = "toil status %s --failIfNotComplete --verbose" % toilDir
     system(command)
 
+def lastzParameters(seq1, seq2, lastzArguments):
+    """Get the cPecanLastz command line for aligning seq1 against seq2,
+    to be run in the directory containing the sequences."""
+    return ["cPecanLastz",
+            "--format=cigar",
+            "--notrivial"] + lastzArguments.split() + \
+           ["%s[multiple][nameparse=darkspace]" % os.path.basename(seq1),
+            "%s[nameparse=darkspace]" % os.path.basename(seq2)]
+
 def runLastz(seq1, seq2, alignmentsFile, lastzArguments, work_dir=None):
     #Have to specify the work_dir manually for this, since
     #we're adding arguments to the filename
     assert os.path.dirname(seq1) == os.path.dirname(seq2)
     work_dir = os.path.dirname(seq1)
     cactus_call(work_dir=work_dir, outfile=alignmentsFile,
-                parameters=["cPecanLastz",
-                            "--format=cigar",
-                            "--notrivial"] + lastzArguments.split() +
-                           ["%s[multiple][nameparse=darkspace]" % os.path.basename(seq1),
-                            "%s[nameparse=darkspace]" % os.path.basename(seq2)],
+                parameters=lastzParameters(seq1, seq2, lastzArguments),
                 soft_timeout=5400)
 
 def runSelfLastz(seq, alignmentsFile, lastzArguments, work_dir=None):
     work_dir = os.path.dirname(seq)
     cactus_call(work_dir=work_dir, outfile=alignmentsFile,
-                parameters=["cPecanLastz",
-                            "--format=cigar",
-                            "--notrivial"] + lastzArguments.split() +
-                           ["%s[multiple][nameparse=darkspace]" % os.path.basename(seq),
-                            "%s[nameparse=darkspace]" % os.path.basename(seq)],
+                parameters=lastzParameters(seq, seq, lastzArguments),
                 soft_timeout=5400)
 
-def runCactusRealign(seq1, seq2, inputAlignmentsFile, outputAlignmentsFile, realignArguments, work_dir=None):
-    cactus_call(infile=inputAlignmentsFile, outfile=outputAlignmentsFile, work_dir=work_dir,
-                parameters=["cPecanRealign"] + realignArguments.split() + [seq1, seq2])
-
-def runCactusSelfRealign(seq, inputAlignmentsFile, outputAlignmentsFile, realignArguments, work_dir=None):
-    cactus_call(infile=inputAlignmentsFile, outfile=outputAlignmentsFile, work_dir=work_dir,
-                parameters=["cPecanRealign"] + realignArguments.split() + [seq])
+def splitCigarFile(cigarFile, numBatches, batchDir):
+    """Split a cigar file into at most numBatches files of roughly equal
+    size, keeping each alignment (line) whole and the alignments in
+    order. Returns the batch file paths."""
+    targetSize = max(1, os.path.getsize(cigarFile) / numBatches)
+    batchFiles = []
+    batch = None
+    batchSize = 0
+    with open(cigarFile) as inFile:
+        for line in inFile:
+            if batch is None or (batchSize >= targetSize and len(batchFiles) < numBatches):
+                if batch is not None:
+                    batch.close()
+                batchFiles.append(os.path.join(batchDir, "batch%d.cigar" % len(batchFiles)))
+                batch = open(batchFiles[-1], 'w')
+                batchSize = 0
+            batch.write(line)
+            batchSize += len(line)
+    if batch is not None:
+        batch.close()
+    return batchFiles
+
+def runRealignBatches(parameters, inputAlignmentsFile, outputAlignmentsFile, threads, work_dir=None):
+    """Run cPecanRealign over the input alignments, split into batches
+    that are realigned by a pool of threads concurrent processes. The
+    output is concatenated in input order, so it doesn't depend on
+    scheduling."""
+    if threads <= 1:
+        cactus_call(infile=inputAlignmentsFile, outfile=outputAlignmentsFile,
+                    work_dir=work_dir, parameters=parameters)
+        return
+    batchDir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(outputAlignmentsFile)))
+    try:
+        # Several batches per thread so that a few slow batches don't
+        # leave the other threads idle.
+        batchFiles = splitCigarFile(inputAlignmentsFile, 4 * threads, batchDir)
+        def realignBatch(batchFile):
+            cactus_call(infile=batchFile, outfile=batchFile + ".realigned",
+                        work_dir=work_dir, parameters=parameters)
+        pool = ThreadPool(threads)
+        try:
+            pool.map(realignBatch, batchFiles, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        with open(outputAlignmentsFile, 'w') as outFile:
+            for batchFile in batchFiles:
+                with open(batchFile + ".realigned") as realigned:
+                    shutil.copyfileobj(realigned, outFile)
+    finally:
+        shutil.rmtree(batchDir)
+
+def runCactusRealign(seq1, seq2, inputAlignmentsFile, outputAlignmentsFile, realignArguments, work_dir=None, threads=1):
+    runRealignBatches(["cPecanRealign"] + realignArguments.split() + [seq1, seq2],
+                      inputAlignmentsFile, outputAlignmentsFile, threads, work_dir=work_dir)
+
+def runCactusSelfRealign(seq, inputAlignmentsFile, outputAlignmentsFile, realignArguments, work_dir=None, threads=1):
+    runRealignBatches(["cPecanRealign"] + realignArguments.split() + [seq],
+                      inputAlignmentsFile, outputAlignmentsFile, threads, work_dir=work_dir)
+
+def runPipelinedBlast(seq1, seq2, outputAlignmentsFile, lastzArguments,
+                      realign, realignArguments, roundsOfCoordinateConversion):
+    """Run lastz, realign (if asked for) and coordinate conversion
+    connected by pipes, so that no intermediate alignment files are
+    written and the stages run concurrently. seq2 may be None for a
+    self-alignment. outputAlignmentsFile may be a path or an open file."""
+    assert seq2 is None or os.path.dirname(seq1) == os.path.dirname(seq2)
+    work_dir = os.path.dirname(seq1)
+    commands = [lastzParameters(seq1, seq1 if seq2 is None else seq2, lastzArguments)]
+    if realign:
+        commands.append(["cPecanRealign"] + realignArguments.split() +
+                        ([seq1] if seq2 is None else [seq1, seq2]))
+    commands.append(["cactus_blast_convertCoordinates", "/dev/stdin", "/dev/stdout",
+                     str(roundsOfCoordinateConversion)])
+    cactus_call_pipeline(commands, outfile=outputAlignmentsFile, work_dir=work_dir,
+                         soft_timeout=5400)
 
 def runCactusCoverage(sequenceFile, alignmentsFile, work_dir=None):
     return cactus_call(check_output=True, work_dir=work_dir,
@@ -927,35 +1003,43 @@ def prepareWorkDir(work_dir, parameters):
         parameters = [adjustPath(par, work_dir) for par in parameters]
     return work_dir, parameters
 
-def cactus_call(tool=None,
-                work_dir=None,
-                parameters=None,
-                rm=True,
-                check_output=False,
-                infile=None,
-                outfile=None,
-                stdin_string=None,
-                server=False,
-                shell=False,
-                port=None,
-                check_result=False,
-                dockstore=None,
-                soft_timeout=None,
-                job_name=None,
-                features=None,
-                fileStore=None):
+def openOutfile(outfile):
+    """Get a file handle for the outfile argument of cactus_call, which
+    is either a path or an already-open file (e.g. a stream into the job
+    store from writeGlobalFileStream) that the output goes to directly."""
+    if hasattr(outfile, 'fileno'):
+        outfile.flush()
+        return outfile
+    return open(outfile, 'w')
+
+def cactus_call_to_global_file(fileStore, cleanup=False, **kwargs):
+    """Run cactus_call with its output streamed straight into a new
+    global file rather than staged on local disk first. Returns the file
+    ID."""
+    with fileStore.writeGlobalFileStream(cleanup=cleanup) as (outFile, fileID):
+        cactus_call(outfile=outFile, **kwargs)
+    return fileID
+
+def cactusCommand(tool=None,
+                  work_dir=None,
+                  parameters=None,
+                  rm=True,
+                  port=None,
+                  dockstore=None):
+    """Get the command line that runs parameters under the current
+    binaries mode, along with the container info (None unless running
+    under docker)."""
     mode = os.environ.get("CACTUS_BINARIES_MODE", "docker")
 
     if dockstore is None:
         dockstore = getDockerOrg()
-    if parameters is None:
-        parameters = []
     if tool is None:
         tool = "cactus"
 
     if mode in ("docker", "singularity"):
         work_dir, parameters = prepareWorkDir(work_dir, parameters)
 
+    containerInfo = None
     if mode == "docker":
         call, containerInfo = dockerCommand(tool=tool,
                                             work_dir=work_dir,
@@ -969,6 +1053,32 @@ def cactus_call(tool=None,
     else:
         assert mode == "local"
         call = parameters
+    return call, containerInfo
+
+def cactus_call(tool=None,
+                work_dir=None,
+                parameters=None,
+                rm=True,
+                check_output=False,
+                infile=None,
+                outfile=None,
+                stdin_string=None,
+                server=False,
+                shell=False,
+                port=None,
+                check_result=False,
+                dockstore=None,
+                soft_timeout=None,
+                job_name=None,
+                features=None,
+                fileStore=None):
+    mode = os.environ.get("CACTUS_BINARIES_MODE", "docker")
+
+    if parameters is None:
+        parameters = []
+    call, containerInfo = cactusCommand(tool=tool, work_dir=work_dir,
+                                        parameters=parameters, rm=rm,
+                                        port=port, dockstore=dockstore)
 
     stdinFileHandle = None
     stdoutFileHandle = None
@@ -977,7 +1087,7 @@ def cactus_call(tool=None,
     elif infile:
         stdinFileHandle = open(infile, 'r')
     if outfile:
-        stdoutFileHandle = open(outfile, 'w')
+        stdoutFileHandle = openOutfile(outfile)
     if check_output:
         stdoutFileHandle = subprocess32.PIPE
 
@@ -1024,6 +1134,58 @@ def cactus_call(tool=None,
     if check_output:
         return output
 
+def cactus_call_pipeline(commands, outfile, work_dir=None, infile=None,
+                         soft_timeout=None, tool=None, dockstore=None):
+    """Run a list of commands (each a parameter list, as given to
+    cactus_call) connected by OS pipes, with the output of the last
+    command written to outfile (a path or an open file).
+
+    If the first command runs for longer than soft_timeout, it is
+    interrupted and the rest of the pipeline finishes on the output it
+    produced, as cactus_call does with soft_timeout.
+    """
+    assert len(commands) > 0
+    processes = []
+    stdinFileHandle = open(infile, 'r') if infile else None
+    stdoutFileHandle = openOutfile(outfile)
+    try:
+        for i, parameters in enumerate(commands):
+            call, _ = cactusCommand(tool=tool, work_dir=work_dir,
+                                    parameters=parameters, dockstore=dockstore)
+            _log.info("Running the command %s" % call)
+            last = i == len(commands) - 1
+            process = subprocess32.Popen(call, stdin=stdinFileHandle,
+                                         stdout=stdoutFileHandle if last else subprocess32.PIPE,
+                                         stderr=sys.stderr, bufsize=-1)
+            if stdinFileHandle is not None:
+                # Only the consumer should hold the read end, so that
+                # the producer gets SIGPIPE if the consumer dies.
+                stdinFileHandle.close()
+            stdinFileHandle = process.stdout
+            processes.append((call, process))
+    finally:
+        if stdoutFileHandle is not outfile:
+            stdoutFileHandle.close()
+
+    interrupted = False
+    start_time = time.time()
+    while True:
+        try:
+            processes[0][1].wait(timeout=10)
+        except subprocess32.TimeoutExpired:
+            if soft_timeout is not None and time.time() - start_time > soft_timeout:
+                processes[0][1].send_signal(signal.SIGINT)
+                interrupted = True
+        else:
+            break
+    failed = []
+    for i, (call, process) in enumerate(processes):
+        process.wait()
+        if process.returncode != 0 and not (i == 0 and interrupted):
+            failed.append("%s (exit code %d)" % (call, process.returncode))
+    if len(failed) > 0:
+        raise RuntimeError("Pipeline commands failed: %s" % ", ".join(failed))
+
 class RunAsFollowOn(Job):
     def __init__(self, job, *args, **kwargs):
         Job.__init__(self, memory=100000000, preemptable=True)
@@ -1071,16 +1233,6 @@ class RoundedJob(Job):
             return bytesRequirement
         return (bytesRequirement // self.roundingAmount + 1) * self.roundingAmount
 
-def readGlobalFileWithoutCache(fileStore, jobStoreID):
-    """Reads a jobStoreID into a file and returns it, without touching
-    the cache.
-
-    Works around toil issue #1532.
-    """
-    f = fileStore.getLocalTempFile()
-    fileStore.jobStore.readFile(jobStoreID, f)
-    return f
-
 class ChildTreeJob(RoundedJob):
     """Spreads the child-job initialization work among multiple jobs.
 
@@ -1089,21 +1241,36 @@ class ChildTreeJob(RoundedJob):
     fashion). Subclasses of this job will automatically spread out
     that work amongst a tree of jobs, increasing the total work done
     slightly, but reducing the wall-clock time taken dramatically.
+
+    Children can be given an estimated cost, in which case the most
+    expensive ones are spawned first (longest-processing-time-first), so
+    that long jobs don't start at the end of the phase and leave a tail.
     """
     def __init__(self, memory=None, cores=None, disk=None, preemptable=None,
                  unitName=None, checkpoint=False, maxChildrenPerJob=20):
         self.queuedChildJobs = []
+        self.queuedChildCosts = []
         self.maxChildrenPerJob = maxChildrenPerJob
         super(ChildTreeJob, self).__init__(memory=memory, cores=cores, disk=disk,
                                            preemptable=preemptable, unitName=unitName,
                                            checkpoint=checkpoint)
 
-    def addChild(self, job):
+    def addChild(self, job, cost=None):
         self.queuedChildJobs.append(job)
+        self.queuedChildCosts.append(cost)
         return job
 
+    def orderChildJobs(self):
+        """Sort the queued children by decreasing cost. Children without
+        a cost go last, and ties keep the order they were added in."""
+        order = sorted(xrange(len(self.queuedChildJobs)),
+                       key=lambda i: (self.queuedChildCosts[i] is None, -(self.queuedChildCosts[i] or 0)))
+        self.queuedChildJobs = [self.queuedChildJobs[i] for i in order]
+        self.queuedChildCosts = [self.queuedChildCosts[i] for i in order]
+
     def _run(self, jobGraph, fileStore):
         ret = super(ChildTreeJob, self)._run(jobGraph, fileStore)
+        self.orderChildJobs()
         if len(self.queuedChildJobs) <= self.maxChildrenPerJob:
             # The number of children is small enough that we can just
             # add them directly.
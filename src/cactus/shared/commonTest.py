@@ -11,7 +11,7 @@ from toil.common import Toil
 from cactus.shared.test import silentOnSuccess
 from cactus.shared.common import encodeFlowerNames, decodeFirstFlowerName, \
                                  runCactusSplitFlowersBySecondaryGrouping, \
-                                 cactus_call, ChildTreeJob
+                                 cactus_call, ChildTreeJob, splitCigarFile
 
 class TestCase(unittest.TestCase):
     def setUp(self):
@@ -50,6 +50,19 @@ class TestCase(unittest.TestCase):
         self.assertEquals([(True, "1 13") ], runCactusSplitFlowersBySecondaryGrouping("1 b 13"))
         self.assertEquals([(False, "3 9 1 1"), (False, "2 8 4"), (True, "3 13 7 8")], runCactusSplitFlowersBySecondaryGrouping("8 9 1 1 a -3 4 b 1 7 8"))
 
+    def testSplitCigarFile(self):
+        cigarFile = getTempFile(rootDir=self.tempDir)
+        lines = ["cigar: seq%d 0 %d + seq 0 %d + 1 M %d\n" % (i, i, i, i) for i in xrange(100)]
+        with open(cigarFile, 'w') as f:
+            f.write("".join(lines))
+        for numBatches in [1, 3, 7, 100, 1000]:
+            batchDir = getTempDirectory(self.tempDir)
+            batchFiles = splitCigarFile(cigarFile, numBatches, batchDir)
+            self.assertTrue(0 < len(batchFiles) <= numBatches)
+            self.assertEquals(lines, [line for batchFile in batchFiles for line in open(batchFile)])
+        emptyFile = getTempFile(rootDir=self.tempDir)
+        self.assertEquals([], splitCigarFile(emptyFile, 4, self.tempDir))
+
     def testCactusCall(self):
         inputFile = getTempFile(rootDir=self.tempDir)
 
@@ -71,6 +84,14 @@ class TestCase(unittest.TestCase):
 
         self.assertEquals(input, output)
 
+        #Send output straight to an already-open file, as when
+        #streaming into the job store
+        outputFile = getTempFile(rootDir=self.tempDir)
+        with open(outputFile, 'w') as fh:
+            cactus_call(infile=inputFile, outfile=fh,
+                        parameters=["docker_test_script"])
+        self.assertEquals(input, "".join(open(outputFile).read().split("\n")))
+
     @silentOnSuccess
     def testChildTreeJob(self):
         """Check that the ChildTreeJob class runs all children."""
@@ -88,6 +109,14 @@ class TestCase(unittest.TestCase):
             self.assertTrue(os.path.exists(os.path.join(flagDir, str(i))))
         shutil.rmtree(flagDir)
 
+    def testChildTreeJobOrder(self):
+        """Check that ChildTreeJob starts the most expensive children first."""
+        parent = ChildTreeJob()
+        for i, cost in enumerate([1, None, 5, 0, 3, 5]):
+            parent.addChild(CTTestChild(None, i), cost=cost)
+        parent.orderChildJobs()
+        self.assertEqual([child.index for child in parent.queuedChildJobs], [2, 5, 4, 0, 3, 1])
+
 class CTTestParent(ChildTreeJob):
     def __init__(self, flagDir, numChildren):
         self.flagDir = flagDir
@@ -27,6 +27,7 @@ class ConfigWrapper:
     defaultOutgroupAncestorQualityFraction = 0.75
     defaultMaxParallelSubtrees = 3
     defaultMaxNumOutgroups = 1
+    defaultKtserverLocalDBMaxSequenceSize = 300000000
     
     def __init__(self, xmlRoot):
         self.xmlRoot = xmlRoot
@@ -185,6 +186,37 @@ class ConfigWrapper:
             return int(ktServerElem.attrib["cpu"])
         return default           
 
+    def getKtserverHandOver(self):
+        """Should the primary DB be kept up from one checkpoint phase to
+        the next, instead of being saved and reloaded between them?"""
+        ktServerElem = self.xmlRoot.find("ktserver")
+        if ktServerElem is not None and "handOverPrimaryDB" in ktServerElem.attrib:
+            return bool(int(ktServerElem.attrib["handOverPrimaryDB"]))
+        return False
+
+    def getKtserverPoolSecondaryDB(self):
+        """Should the reference and HAL phases share one secondary DB,
+        instead of each starting its own?"""
+        ktServerElem = self.xmlRoot.find("ktserver")
+        if ktServerElem is not None and "poolSecondaryDB" in ktServerElem.attrib:
+            return bool(int(ktServerElem.attrib["poolSecondaryDB"]))
+        return True
+
+    def getKtserverLocalDBMaxSequenceSize(self):
+        """Alignments with at most this much sequence (in bytes) use a
+        local tokyo cabinet DB rather than ktservers, when running on a
+        single machine. 0 to always use ktservers."""
+        ktServerElem = self.xmlRoot.find("ktserver")
+        if ktServerElem is not None and "localDBMaxSequenceSize" in ktServerElem.attrib:
+            return int(ktServerElem.attrib["localDBMaxSequenceSize"])
+        return self.defaultKtserverLocalDBMaxSequenceSize
+
+    def setKtserverLocalDBMaxSequenceSize(self, maxSequenceSize):
+        ktServerElem = self.xmlRoot.find("ktserver")
+        if ktServerElem is None:
+            ktServerElem = ET.SubElement(self.xmlRoot, "ktserver")
+        ktServerElem.attrib["localDBMaxSequenceSize"] = str(maxSequenceSize)
+
     def getDefaultMemory(self):
         constantsElem = self.xmlRoot.find("constants")
         return int(constantsElem.attrib["defaultMemory"])
@@ -244,3 +276,56 @@ class ConfigWrapper:
         for node in self.xmlRoot.findall("preprocessor"):
             if 'checkAssemblyHub' in node.attrib:
                 node.attrib['checkAssemblyHub'] = '0'
+
+class ResolvedConfig(object):
+    """A frozen copy of a config, with the predefined constants already
+    substituted, built once per workflow and carried by the jobs that
+    need it instead of each of them reading, parsing and substituting
+    the config file again. Pickles as the serialized XML plus the
+    attributes of the top-level elements, which answer lookups without
+    walking the tree.
+    """
+    __slots__ = ("_xml", "_attribs")
+
+    def __init__(self, xmlRoot):
+        xmlRoot = ET.fromstring(ET.tostring(xmlRoot))
+        ConfigWrapper(xmlRoot).substituteAllPredefinedConstantsWithLiterals()
+        attribs = {}
+        for child in xmlRoot:
+            # Like find(), the first element with a tag wins.
+            if child.tag not in attribs:
+                attribs[child.tag] = dict(child.attrib)
+        object.__setattr__(self, "_xml", ET.tostring(xmlRoot))
+        object.__setattr__(self, "_attribs", attribs)
+
+    def __setattr__(self, name, value):
+        raise RuntimeError("ResolvedConfig is read-only")
+
+    def __getstate__(self):
+        return (self._xml, self._attribs)
+
+    def __setstate__(self, state):
+        object.__setattr__(self, "_xml", state[0])
+        object.__setattr__(self, "_attribs", state[1])
+
+    def getAttrib(self, tag, attribName, typeFn=None, default=None):
+        """Get an attribute of the top-level element tag, like
+        getOptionalAttrib does for a node."""
+        attribs = self._attribs.get(tag)
+        if attribs is None or attribName not in attribs:
+            return default
+        if typeFn == bool:
+            return bool(int(attribs[attribName]))
+        if typeFn != None:
+            return typeFn(attribs[attribName])
+        return attribs[attribName]
+
+    def getNode(self):
+        """Get a new (and so modifiable) XML tree of the config."""
+        return ET.fromstring(self._xml)
+
+    def getDefaultMemory(self):
+        return int(self._attribs["constants"]["defaultMemory"])
+
+    def getExportHalDisk(self):
+        return int(self._attribs["exportHal"]["disk"])
@@ -0,0 +1,47 @@
+import unittest
+import pickle
+import xml.etree.ElementTree as ET
+from cactus.shared.configWrapper import ConfigWrapper
+from cactus.shared.configWrapper import ResolvedConfig
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.configNode = ET.fromstring('<cactus_workflow_config>'
+                                        '<constants defaultMemory="mediumMemory">'
+                                        '<defines mediumMemory="3500000000"/>'
+                                        '</constants>'
+                                        '<caf realign="1" minimumTreeCoverage="0.3" memory="mediumMemory"/>'
+                                        '<exportHal disk="2000000000"/>'
+                                        '</cactus_workflow_config>')
+
+    def testResolvedConfig(self):
+        config = ResolvedConfig(self.configNode)
+        # The original isn't touched by the substitution.
+        self.assertEqual(self.configNode.find("constants").attrib["defaultMemory"], "mediumMemory")
+        self.assertEqual(config.getDefaultMemory(), 3500000000)
+        self.assertEqual(config.getExportHalDisk(), 2000000000)
+        self.assertEqual(config.getAttrib("caf", "memory", int), 3500000000)
+        self.assertEqual(config.getAttrib("caf", "realign", bool), True)
+        self.assertEqual(config.getAttrib("caf", "minimumTreeCoverage", float), 0.3)
+        self.assertEqual(config.getAttrib("caf", "missing", default=5), 5)
+        self.assertEqual(config.getAttrib("bar", "missing"), None)
+        self.assertRaises(RuntimeError, setattr, config, "_attribs", {})
+
+    def testPickleAndNode(self):
+        config = pickle.loads(pickle.dumps(ResolvedConfig(self.configNode), pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(config.getAttrib("caf", "memory"), "3500000000")
+        node = config.getNode()
+        self.assertEqual(node.find("constants").find("defines"), None)
+        node.find("caf").attrib["memory"] = "1"
+        self.assertEqual(config.getNode().find("caf").attrib["memory"], "3500000000")
+
+    def testLocalDBMaxSequenceSize(self):
+        configWrapper = ConfigWrapper(self.configNode)
+        self.assertEqual(configWrapper.getKtserverLocalDBMaxSequenceSize(),
+                         ConfigWrapper.defaultKtserverLocalDBMaxSequenceSize)
+        configWrapper.setKtserverLocalDBMaxSequenceSize(0)
+        self.assertEqual(configWrapper.getKtserverLocalDBMaxSequenceSize(), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,6 +7,7 @@
 """Interface to the cactus experiment xml file used
 to read and modify an existing experiment"""
 import os
+import copy
 import xml.etree.ElementTree as ET
 from xml.dom import minidom
 
@@ -20,7 +21,8 @@ class DbElemWrapper(object):
         dbElem = confElem.find(typeString)
         self.dbElem = dbElem
         self.confElem = confElem
-        self.dbElem.attrib["database_dir"] = "fakepath"
+        if "database_dir" not in self.dbElem.attrib:
+            self.dbElem.attrib["database_dir"] = "fakepath"
 
     def check(self):
         """Function checks the database conf is as expected and creates useful exceptions
@@ -137,6 +139,106 @@ class DbElemWrapper(object):
         assert self.getDbType() == "kyoto_tycoon"
         self.dbElem.attrib["snapshot"] = str(int(snapshot))
 
+    def getDbSnapshotDeltas(self):
+        """Should snapshots be exported as deltas against the snapshot the
+        server was started from?"""
+        assert self.getDbType() == "kyoto_tycoon"
+        if "snapshot_deltas" in self.dbElem.attrib:
+            val = self.dbElem.attrib["snapshot_deltas"]
+            return val.lower() == "true" or val == "1"
+        return True
+
+    def setDbSnapshotDeltas(self, snapshotDeltas):
+        assert self.getDbType() == "kyoto_tycoon"
+        self.dbElem.attrib["snapshot_deltas"] = str(int(snapshotDeltas))
+
+    def getDbShards(self):
+        """Number of ktservers the DB is spread over."""
+        assert self.getDbType() == "kyoto_tycoon"
+        if "shards" in self.dbElem.attrib:
+            return int(self.dbElem.attrib["shards"])
+        return 1
+
+    def setDbShards(self, shards):
+        assert self.getDbType() == "kyoto_tycoon"
+        assert shards >= 1
+        self.dbElem.attrib["shards"] = str(shards)
+
+    def getDbShardAddresses(self):
+        """(host, port) of each running shard of the DB. The first shard
+        is the server given in the kyoto_tycoon tag, the rest are given
+        by the kyoto_tycoon_shard tags following it."""
+        assert self.getDbType() == "kyoto_tycoon"
+        addresses = [(self.getDbHost(), self.getDbPort())]
+        for shardElem in self.confElem.findall("kyoto_tycoon_shard"):
+            addresses.append((shardElem.attrib["host"], int(shardElem.attrib["port"])))
+        return addresses
+
+    def addDbShard(self, host, port):
+        assert self.getDbType() == "kyoto_tycoon"
+        shardElem = ET.SubElement(self.confElem, "kyoto_tycoon_shard")
+        shardElem.attrib["host"] = host
+        shardElem.attrib["port"] = str(port)
+
+    def getDbShardElems(self):
+        """A conf for each shard of the DB on its own."""
+        shardElems = []
+        for host, port in self.getDbShardAddresses():
+            confElem = copy.deepcopy(self.confElem)
+            for shardElem in confElem.findall("kyoto_tycoon_shard"):
+                confElem.remove(shardElem)
+            shard = DbElemWrapper(confElem)
+            shard.setDbHost(host)
+            shard.setDbPort(port)
+            shardElems.append(shard)
+        return shardElems
+
+    def getDbDir(self):
+        return self.dbElem.attrib["database_dir"]
+
+    def setDbTokyoCabinet(self, databaseDir):
+        """Switch to a tokyo cabinet DB, stored in databaseDir and opened
+        directly by the binaries, with no server. The attributes of the
+        st_kv_database_conf tag are kept."""
+        for elem in list(self.confElem):
+            self.confElem.remove(elem)
+        self.confElem.attrib["type"] = "tokyo_cabinet"
+        self.dbElem = ET.SubElement(self.confElem, "tokyo_cabinet")
+        self.dbElem.attrib["database_dir"] = databaseDir
+
+    def getDbCompressionLevel(self):
+        """zlib level (-1 for the default, or 0-9) the binaries compress
+        records with, or None if not set."""
+        if "compression_level" in self.confElem.attrib:
+            return int(self.confElem.attrib["compression_level"])
+        return None
+
+    def setDbCompressionLevel(self, level):
+        assert -1 <= level <= 9
+        self.confElem.attrib["compression_level"] = str(level)
+
+    def getDbWriteBatchSize(self):
+        """Bytes of updates the binaries buffer before writing them to the
+        DB, or None (or 0) to write them all at the end."""
+        if "write_batch_size" in self.confElem.attrib:
+            return int(self.confElem.attrib["write_batch_size"])
+        return None
+
+    def setDbWriteBatchSize(self, size):
+        assert size >= 0
+        self.confElem.attrib["write_batch_size"] = str(int(size))
+
+    def getDbWriteBatchTime(self):
+        """Seconds the binaries buffer an update before writing it to the
+        DB, or None (or 0) for no bound."""
+        if "write_batch_time" in self.confElem.attrib:
+            return int(self.confElem.attrib["write_batch_time"])
+        return None
+
+    def setDbWriteBatchTime(self, seconds):
+        assert seconds >= 0
+        self.confElem.attrib["write_batch_time"] = str(int(seconds))
+
 class ExperimentWrapper(DbElemWrapper):
     def __init__(self, xmlRoot):
         self.diskElem = xmlRoot.find("cactus_disk")
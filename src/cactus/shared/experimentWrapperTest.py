@@ -28,7 +28,63 @@ class TestCase(unittest.TestCase):
         seqList = self.sequences.split()
         for i in seqList:
             assert seqMap[os.path.splitext(i)[0].upper()] == i
-    
+
+    def testDbShards(self):
+        xmlRoot = self.__makeXmlDummy(self.tree, self.sequences)
+        exp = ExperimentWrapper(xmlRoot)
+        assert exp.getDbShards() == 1
+        exp.setDbShards(3)
+        exp.setDbHost("host0")
+        exp.setDbPort(1000)
+        exp.addDbShard("host1", 1001)
+        exp.addDbShard("host0", 1002)
+        assert exp.getDbShardAddresses() == [("host0", 1000), ("host1", 1001), ("host0", 1002)]
+        shards = exp.getDbShardElems()
+        assert [(shard.getDbHost(), shard.getDbPort()) for shard in shards] == exp.getDbShardAddresses()
+        for shard in shards:
+            assert shard.getDbShardAddresses() == [(shard.getDbHost(), shard.getDbPort())]
+        # The shards are listed in the conf string the binaries get.
+        assert ET.fromstring(exp.getConfString()).findall("kyoto_tycoon_shard")[1].attrib["port"] == "1002"
+
+    def testDbWriteParameters(self):
+        xmlRoot = self.__makeXmlDummy(self.tree, self.sequences)
+        exp = ExperimentWrapper(xmlRoot)
+        assert exp.getDbCompressionLevel() is None
+        assert exp.getDbWriteBatchSize() is None
+        assert exp.getDbWriteBatchTime() is None
+        exp.setDbCompressionLevel(1)
+        exp.setDbWriteBatchSize(50000000)
+        exp.setDbWriteBatchTime(30)
+        assert exp.getDbCompressionLevel() == 1
+        assert exp.getDbWriteBatchSize() == 50000000
+        assert exp.getDbWriteBatchTime() == 30
+        # The binaries read them from the st_kv_database_conf tag.
+        confElem = ET.fromstring(exp.getConfString())
+        assert confElem.tag == "st_kv_database_conf"
+        assert confElem.attrib["write_batch_size"] == "50000000"
+        # Each shard's conf keeps them.
+        exp.setDbShards(2)
+        exp.setDbHost("host0")
+        exp.setDbPort(1000)
+        exp.addDbShard("host1", 1001)
+        assert [shard.getDbWriteBatchTime() for shard in exp.getDbShardElems()] == [30, 30]
+
+    def testDbTokyoCabinet(self):
+        xmlRoot = self.__makeXmlDummy(self.tree, self.sequences)
+        exp = ExperimentWrapper(xmlRoot)
+        exp.setDbShards(2)
+        exp.addDbShard("host1", 1001)
+        exp.setDbWriteBatchSize(1000)
+        exp.setDbTokyoCabinet("/tmp/db")
+        exp.check()
+        assert exp.getDbType() == "tokyo_cabinet"
+        assert exp.getDbDir() == "/tmp/db"
+        assert exp.getDbWriteBatchSize() == 1000
+        confElem = ET.fromstring(exp.getConfString())
+        assert [elem.tag for elem in confElem] == ["tokyo_cabinet"]
+        # Wrapping the conf again doesn't lose the DB's location.
+        assert ExperimentWrapper(xmlRoot).getDbDir() == "/tmp/db"
+
     def __makeXmlDummy(self, treeString, sequenceString):
         rootElem =  ET.Element("dummy")
         rootElem.attrib['species_tree'] = self.tree
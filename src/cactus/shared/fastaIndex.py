@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+
+#Released under the MIT license, see LICENSE.txt
+
+"""One-pass index of a FASTA file.
+
+The index is a superset of samtools' .fai: for every sequence it holds
+the length, the byte offset of the first base, the line layout, and the
+number of N and soft-masked (lowercase) bases, where a lowercase n counts
+as an N but not as masked.  It is used wherever we
+need lengths or base composition so that we don't rescan whole genomes
+at every step, and to read subsequences by seeking rather than
+streaming the whole file.
+
+Indexes for job-store files can be persisted as global files passed on
+between jobs, so they are only computed once, and are memoized
+in-process on top of that.
+"""
+
+import os
+import mmap
+import string
+from collections import namedtuple, defaultdict
+
+# lineBases and lineWidth are 0 if the record's lines aren't all the
+# same width, in which case random access falls back to a scan.
+FastaIndexRecord = namedtuple("FastaIndexRecord", ["name", "length", "offset",
+                                                   "lineBases", "lineWidth",
+                                                   "nCount", "maskedCount"])
+
+class FastaIndex(object):
+    """Per-sequence lengths, offsets and base composition of a FASTA file."""
+    def __init__(self, records):
+        self.records = list(records)
+        self.recordMap = dict((record.name, record) for record in self.records)
+
+    @staticmethod
+    def build(fastaPath):
+        """Index a FASTA file in a single pass."""
+        records = []
+        name = None
+        length = offset = lineBases = lineWidth = nCount = maskedCount = 0
+        # Set once a line shorter than lineBases has been seen. Only the
+        # last line of a record may be short.
+        sawShortLine = False
+        irregular = False
+        position = 0
+        with open(fastaPath, 'rb') as fastaFile:
+            for line in fastaFile:
+                lineLength = len(line)
+                if line[:1] == '>':
+                    if name is not None:
+                        records.append(FastaIndexRecord(name, length, offset,
+                                                        0 if irregular else lineBases,
+                                                        0 if irregular else lineWidth,
+                                                        nCount, maskedCount))
+                    tokens = line[1:].split()
+                    name = tokens[0] if len(tokens) > 0 else ""
+                    length = lineBases = lineWidth = nCount = maskedCount = 0
+                    offset = position + lineLength
+                    sawShortLine = irregular = False
+                    position += lineLength
+                    continue
+                position += lineLength
+                bases = line.rstrip('\r\n')
+                if name is None:
+                    if bases.strip() == '':
+                        continue
+                    # Sequence before any header.
+                    name = ""
+                    offset = position - lineLength
+                numBases = len(bases)
+                if numBases == 0:
+                    sawShortLine = True
+                    continue
+                if lineBases == 0:
+                    lineBases = numBases
+                    lineWidth = lineLength
+                elif sawShortLine or numBases > lineBases:
+                    irregular = True
+                if numBases < lineBases or lineLength != lineWidth:
+                    sawShortLine = True
+                length += numBases
+                # Soft-masked Ns are counted as Ns only, so the two
+                # counts can be subtracted from the length together.
+                maskedNs = bases.count('n')
+                nCount += bases.count('N') + maskedNs
+                maskedCount += numBases - len(bases.translate(None, string.ascii_lowercase)) - maskedNs
+        if name is not None:
+            records.append(FastaIndexRecord(name, length, offset,
+                                            0 if irregular else lineBases,
+                                            0 if irregular else lineWidth,
+                                            nCount, maskedCount))
+        return FastaIndex(records)
+
+    @staticmethod
+    def merge(indexes):
+        """Combine the indexes of several files (e.g. a directory of
+        FASTAs). Offsets are meaningless in the result."""
+        return FastaIndex([record for index in indexes for record in index.records])
+
+    def writeFile(self, outFile):
+        for record in self.records:
+            outFile.write("\t".join(map(str, record)) + "\n")
+
+    def write(self, path):
+        with open(path, 'w') as outFile:
+            self.writeFile(outFile)
+
+    @staticmethod
+    def readFile(inFile):
+        records = []
+        for line in inFile:
+            tokens = line.rstrip("\n").split("\t")
+            records.append(FastaIndexRecord(tokens[0], *map(int, tokens[1:])))
+        return FastaIndex(records)
+
+    @staticmethod
+    def read(path):
+        with open(path) as inFile:
+            return FastaIndex.readFile(inFile)
+
+    def names(self):
+        return [record.name for record in self.records]
+
+    def getLength(self, name):
+        return self.recordMap[name].length
+
+    def getLengths(self):
+        """Get a dict which maps header -> sequence size."""
+        ret = defaultdict(int)
+        for record in self.records:
+            ret[record.name] += record.length
+        return ret
+
+    def totalLength(self):
+        return sum(record.length for record in self.records)
+
+    def totalNs(self):
+        return sum(record.nCount for record in self.records)
+
+    def totalMasked(self):
+        return sum(record.maskedCount for record in self.records)
+
+    def n50(self):
+        lengths = sorted((record.length for record in self.records), reverse=True)
+        total = sum(lengths)
+        cumulative = 0
+        for length in lengths:
+            cumulative += length
+            if 2 * cumulative >= total:
+                return length
+        return 0
+
+    def getSubsequence(self, fastaPath, name, start, end):
+        """Read the bases [start, end) of sequence name from the indexed
+        file."""
+        with MappedFasta(fastaPath, self) as fasta:
+            return fasta.getSubsequence(name, start, end)
+
+class MappedFasta(object):
+    """Memory-mapped random access to the sequences of an indexed FASTA
+    file, so that extracting a block costs time proportional to the
+    size of the block rather than to the size of the file."""
+    def __init__(self, fastaPath, index=None):
+        self.index = index if index is not None else indexFasta(fastaPath)
+        self.fastaFile = open(fastaPath, 'rb')
+        if os.fstat(self.fastaFile.fileno()).st_size > 0:
+            self.map = mmap.mmap(self.fastaFile.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            # Empty files can't be mapped, but have nothing to read anyway.
+            self.map = None
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+        self.fastaFile.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def getSubsequence(self, name, start, end):
+        """Get the bases [start, end) of sequence name."""
+        record = self.index.recordMap[name]
+        start = max(0, start)
+        end = min(end, record.length)
+        if start >= end:
+            return ""
+        if record.lineBases > 0:
+            def filePosition(i):
+                return record.offset + (i // record.lineBases) * record.lineWidth + i % record.lineBases
+            return self.map[filePosition(start):filePosition(end - 1) + 1].translate(None, '\r\n')
+        # Irregular line layout: walk the record's lines up to end.
+        bases = []
+        numBases = 0
+        position = record.offset
+        while numBases < end and position < len(self.map) and self.map[position] != '>':
+            lineEnd = self.map.find('\n', position)
+            if lineEnd == -1:
+                lineEnd = len(self.map)
+            line = self.map[position:lineEnd].rstrip('\r')
+            bases.append(line)
+            numBases += len(line)
+            position = lineEnd + 1
+        return "".join(bases)[start:end]
+
+# In-process memo of indexes, keyed on local path (plus size and mtime
+# so that a rewritten file isn't served a stale index) and on job-store
+# file ID.
+_pathIndexCache = {}
+_fileIDIndexCache = {}
+
+def _pathKey(fastaPath):
+    stat = os.stat(fastaPath)
+    return (os.path.abspath(fastaPath), stat.st_size, stat.st_mtime)
+
+def indexFasta(fastaPath):
+    """Get the (memoized) index of a local FASTA file."""
+    key = _pathKey(fastaPath)
+    if key not in _pathIndexCache:
+        _pathIndexCache[key] = FastaIndex.build(fastaPath)
+    return _pathIndexCache[key]
+
+def indexFastaPaths(fastaPaths):
+    """Get a combined index over several FASTA files, or over the files
+    in a directory."""
+    paths = []
+    for fastaPath in fastaPaths:
+        if os.path.isdir(fastaPath):
+            paths += [os.path.join(fastaPath, f) for f in sorted(os.listdir(fastaPath))]
+        else:
+            paths.append(fastaPath)
+    return FastaIndex.merge([indexFasta(path) for path in paths])
+
+def getFastaIndex(fileStore, fastaID, fastaPath=None, indexIDs=None):
+    """Get the index of a FASTA file in the job store.
+
+    indexIDs, if given, maps FASTA file IDs to the IDs of their persisted
+    indexes, and is passed on from job to job so that each index is only
+    computed once. Indexes missing from it are written as global files
+    that are deleted along with this job and its successors, and added
+    to it.
+
+    If fastaPath is given it should be a local copy of fastaID; the
+    index is then also memoized against that path so that indexFasta
+    calls on it are free."""
+    key = str(fastaID)
+    index = _fileIDIndexCache.get(key)
+    if index is None:
+        if indexIDs is not None and key in indexIDs:
+            with fileStore.readGlobalFileStream(indexIDs[key]) as inFile:
+                index = FastaIndex.readFile(inFile)
+        else:
+            if fastaPath is None:
+                fastaPath = fileStore.readGlobalFile(fastaID)
+            index = indexFasta(fastaPath)
+        _fileIDIndexCache[key] = index
+    if indexIDs is not None and key not in indexIDs:
+        with fileStore.writeGlobalFileStream(cleanup=True) as (outFile, indexID):
+            index.writeFile(outFile)
+        indexIDs[key] = indexID
+    if fastaPath is not None:
+        _pathIndexCache[_pathKey(fastaPath)] = index
+    return index
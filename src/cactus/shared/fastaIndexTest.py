@@ -0,0 +1,93 @@
+import os
+import random
+import unittest
+
+from sonLib.bioio import TestStatus
+from sonLib.bioio import getTempDirectory
+from sonLib.bioio import system
+from cactus.shared.fastaIndex import FastaIndex, MappedFasta
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        self.testNo = TestStatus.getTestSetup(1, 5, 10, 100)
+        self.tempDir = getTempDirectory(os.getcwd())
+        unittest.TestCase.setUp(self)
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        system("rm -rf %s" % self.tempDir)
+
+    def writeFasta(self, records, lineWidth):
+        path = os.path.join(self.tempDir, "seq.fa")
+        with open(path, 'w') as f:
+            for name, seq in records:
+                f.write(">%s extra header text\n" % name)
+                for i in xrange(0, len(seq), lineWidth):
+                    f.write(seq[i:i + lineWidth] + "\n")
+        return path
+
+    def testStats(self):
+        path = self.writeFasta([("a", "ACGTNNacgt"), ("b", "nnAA"), ("c", "")], 3)
+        index = FastaIndex.build(path)
+        self.assertEqual(index.names(), ["a", "b", "c"])
+        self.assertEqual(index.getLengths(), {"a": 10, "b": 4, "c": 0})
+        self.assertEqual(index.totalLength(), 14)
+        self.assertEqual(index.totalNs(), 4)
+        self.assertEqual(index.totalMasked(), 4)
+        self.assertEqual(index.n50(), 10)
+
+    def testMaskedNs(self):
+        # Lowercase ns are Ns, not masked bases, so that subtracting both
+        # from the length doesn't count them twice.
+        path = self.writeFasta([("a", "nnnnacNNTT")], 4)
+        index = FastaIndex.build(path)
+        self.assertEqual(index.totalNs(), 6)
+        self.assertEqual(index.totalMasked(), 2)
+        self.assertEqual(index.totalLength() - index.totalNs() - index.totalMasked(), 2)
+
+    def testIrregularLines(self):
+        path = os.path.join(self.tempDir, "seq.fa")
+        with open(path, 'w') as f:
+            f.write(">a\nACG\n\nTT\nGGGG\n>b\r\nAC\r\nGT\r\n\n")
+        index = FastaIndex.build(path)
+        self.assertEqual(index.recordMap["a"].lineBases, 0)
+        self.assertEqual(index.recordMap["b"].lineBases, 2)
+        self.assertEqual(index.getLengths(), {"a": 9, "b": 4})
+        self.assertEqual(index.getSubsequence(path, "a", 2, 7), "GTTGG")
+        self.assertEqual(index.getSubsequence(path, "b", 1, 4), "CGT")
+
+    def testRoundTripAndSubsequence(self):
+        for test in xrange(self.testNo):
+            records = []
+            for i in xrange(random.randint(1, 5)):
+                seq = "".join(random.choice("ACGTNacgtn") for _ in xrange(random.randint(0, 200)))
+                records.append(("seq%d" % i, seq))
+            path = self.writeFasta(records, random.randint(1, 80))
+            index = FastaIndex.build(path)
+            indexPath = os.path.join(self.tempDir, "seq.fa.fai")
+            index.write(indexPath)
+            self.assertEqual(FastaIndex.read(indexPath).records, index.records)
+            for name, seq in records:
+                self.assertEqual(index.getLength(name), len(seq))
+                start = random.randint(0, len(seq))
+                end = random.randint(start, len(seq))
+                self.assertEqual(index.getSubsequence(path, name, start, end), seq[start:end])
+
+    def testMappedFasta(self):
+        records = [("a", "ACGTACGTAC"), ("b", ""), ("c", "ggggcccc")]
+        path = self.writeFasta(records, 4)
+        with MappedFasta(path) as fasta:
+            self.assertEqual(fasta.getSubsequence("a", 3, 9), "TACGTA")
+            self.assertEqual(fasta.getSubsequence("a", 8, 20), "AC")
+            self.assertEqual(fasta.getSubsequence("b", 0, 5), "")
+            self.assertEqual(fasta.getSubsequence("c", 0, 8), "ggggcccc")
+        emptyPath = os.path.join(self.tempDir, "empty.fa")
+        open(emptyPath, 'w').close()
+        with MappedFasta(emptyPath) as fasta:
+            self.assertEqual(fasta.index.records, [])
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+
+#Released under the MIT license, see LICENSE.txt
+
+"""Node-local, read-only cache of job-store files.
+
+We run with Toil's caching disabled, so every job that reads a file
+downloads its own copy of it, even when other jobs on the same node
+have just downloaded the same file (the input genomes, chunks, the
+alignments that every CAF job needs...). Files read through here are
+downloaded once per node into a directory shared by all the workflow's
+workers on that node.
+
+Job-store files are immutable, so a file ID names its contents and
+entries never need invalidating. Each job gets a hard link to the
+entry in its own temp directory, so the entry can be evicted at any
+time without pulling the file out from under a job that is using it,
+and the job's copy goes away with the rest of its temp files. The
+files are shared, and must not be modified.
+
+The cache lives in the workflow's directory on the node, since Toil
+removes each worker's directory when the worker exits. No job's disk
+requirement accounts for the cache, so by default it holds at most
+defaultReadCacheFraction of the space that is free for it on that disk.
+CACTUS_READ_CACHE_SIZE in the environment overrides this with a number
+of bytes (0 disables the cache). The least recently read entries are
+evicted first. Downloads and evictions take a lock file per entry, so
+concurrent jobs wait for the first download of a file instead of
+starting their own. Evicting an entry removes its lock file too.
+"""
+
+import os
+import errno
+import fcntl
+import shutil
+import hashlib
+from contextlib import contextmanager
+
+from toil.common import Toil
+
+defaultReadCacheFraction = 0.1
+
+def cacheContentsSize(cacheDir):
+    size = 0
+    for name in os.listdir(cacheDir):
+        if not name.endswith(".lock"):
+            try:
+                size += os.stat(os.path.join(cacheDir, name)).st_size
+            except OSError:
+                # Evicted by someone else as we were looking.
+                pass
+    return size
+
+def readCacheDisabled():
+    return int(os.environ.get("CACTUS_READ_CACHE_SIZE", 1)) <= 0
+
+def readCacheSize(cacheDir):
+    """Get the maximum size of the cache in bytes. Unless it is set by
+    CACTUS_READ_CACHE_SIZE, this is a fraction of the free space on the
+    cache's disk, counting the space the cache already uses as free."""
+    if "CACTUS_READ_CACHE_SIZE" in os.environ:
+        return int(os.environ["CACTUS_READ_CACHE_SIZE"])
+    stat = os.statvfs(cacheDir)
+    return int(defaultReadCacheFraction * (stat.f_bavail * stat.f_frsize + cacheContentsSize(cacheDir)))
+
+def readCacheDir(fileStore):
+    """Get the cache directory, which lives in the workflow's directory
+    on this node, so it outlives the workers."""
+    config = fileStore.jobStore.config
+    cacheDir = os.path.join(Toil.getWorkflowDir(config.workflowID, config.workDir), "cactusReadCache")
+    if not os.path.isdir(cacheDir):
+        try:
+            os.makedirs(cacheDir)
+        except OSError:
+            # Another worker created it first.
+            if not os.path.isdir(cacheDir):
+                raise
+    return cacheDir
+
+def cacheEntryName(fileID):
+    return hashlib.md5(str(fileID)).hexdigest()
+
+def isLockedFile(f, path):
+    """Is f still the file at path? Evictions unlink lock files while
+    holding them, so a lock taken on a file that has since been
+    unlinked locks nothing."""
+    try:
+        return os.fstat(f.fileno()).st_ino == os.stat(path).st_ino
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return False
+
+@contextmanager
+def lockFile(path, blocking=True):
+    """Hold an exclusive lock on path (created if necessary). Yields
+    whether the lock was taken, which is always True if blocking."""
+    while True:
+        with open(path, 'a') as f:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except IOError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                yield False
+                return
+            try:
+                if isLockedFile(f, path):
+                    yield True
+                    return
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def linkOrCopy(src, dest):
+    if os.path.exists(dest):
+        os.remove(dest)
+    try:
+        os.link(src, dest)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.copyfile(src, dest)
+
+def evict(cacheDir, maxSize, keep):
+    """Remove the least recently read entries (other than keep) until
+    the cache holds at most maxSize bytes. Entries that are being
+    downloaded or read are skipped."""
+    entries = []
+    for name in os.listdir(cacheDir):
+        if name.endswith(".lock") or name.endswith(".tmp"):
+            continue
+        try:
+            stat = os.stat(os.path.join(cacheDir, name))
+        except OSError:
+            # Evicted by someone else as we were looking.
+            continue
+        entries.append((stat.st_mtime, stat.st_size, name))
+    totalSize = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if totalSize <= maxSize:
+            break
+        if name == keep:
+            continue
+        path = os.path.join(cacheDir, name)
+        with lockFile(path + ".lock", blocking=False) as locked:
+            if locked and os.path.exists(path):
+                os.remove(path)
+                # Remove the lock file while we still hold it, so
+                # evicted entries don't leave their locks behind.
+                os.remove(path + ".lock")
+                totalSize -= size
+
+def readGlobalFileShared(fileStore, fileID, userPath=None):
+    """Get a local copy of fileID through the node's cache, downloading
+    it into the cache if it isn't already there. The copy is put at
+    userPath, or in the job's temp directory. It shares its contents
+    with other jobs, so must not be modified."""
+    if userPath is None:
+        userPath = fileStore.getLocalTempFile()
+    if readCacheDisabled():
+        if os.path.exists(userPath):
+            os.remove(userPath)
+        return fileStore.readGlobalFile(fileID, userPath=userPath)
+    cacheDir = readCacheDir(fileStore)
+    name = cacheEntryName(fileID)
+    path = os.path.join(cacheDir, name)
+    downloaded = False
+    with lockFile(path + ".lock"):
+        if not os.path.exists(path):
+            # Download under a temporary name so that a partial file is
+            # never visible under the real one.
+            tempPath = path + ".tmp"
+            if os.path.exists(tempPath):
+                # Left behind by a job that died mid-download.
+                os.remove(tempPath)
+            fileStore.jobStore.readFile(fileID, tempPath)
+            os.rename(tempPath, path)
+            downloaded = True
+        linkOrCopy(path, userPath)
+        # The modification time of an entry records when it was last
+        # read, for eviction.
+        os.utime(path, None)
+    if downloaded:
+        evict(cacheDir, readCacheSize(cacheDir), keep=name)
+    return userPath
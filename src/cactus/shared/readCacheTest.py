@@ -0,0 +1,144 @@
+import os
+import shutil
+import unittest
+import tempfile
+from uuid import uuid4
+from threading import Thread
+
+from toil.common import Toil
+from sonLib.bioio import getTempDirectory
+from cactus.shared.readCache import readGlobalFileShared, readCacheDir, readCacheSize, cacheEntryName, \
+    defaultReadCacheFraction
+
+class FakeConfig(object):
+    def __init__(self, workDir):
+        self.workflowID = "test"
+        self.workDir = workDir
+
+class FakeJobStore(object):
+    """Serves files from a dict, counting the downloads."""
+    def __init__(self, files, workDir):
+        self.files = files
+        self.reads = []
+        self.config = FakeConfig(workDir)
+
+    def readFile(self, fileID, localPath):
+        self.reads.append(fileID)
+        with open(localPath, 'w') as f:
+            f.write(self.files[fileID])
+
+class FakeFileStore(object):
+    """Has a temp dir laid out like Toil's, in a directory of its own
+    worker in the workflow's directory."""
+    def __init__(self, jobStore, workerName):
+        self.jobStore = jobStore
+        workflowDir = Toil.getWorkflowDir(jobStore.config.workflowID, jobStore.config.workDir)
+        self.workerDir = os.path.join(workflowDir, workerName)
+        self.localTempDir = os.path.join(self.workerDir, str(uuid4()))
+        os.makedirs(self.localTempDir)
+
+    def exitWorker(self):
+        shutil.rmtree(self.workerDir)
+
+    def getLocalTempFile(self):
+        handle, path = tempfile.mkstemp(dir=self.localTempDir)
+        os.close(handle)
+        return path
+
+    def readGlobalFile(self, fileID, userPath):
+        self.jobStore.readFile(fileID, userPath)
+        return userPath
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.tempDir = getTempDirectory()
+        self.previousCacheSize = os.environ.get("CACTUS_READ_CACHE_SIZE")
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        shutil.rmtree(self.tempDir)
+        if self.previousCacheSize is None:
+            os.environ.pop("CACTUS_READ_CACHE_SIZE", None)
+        else:
+            os.environ["CACTUS_READ_CACHE_SIZE"] = self.previousCacheSize
+
+    def testSharedBetweenWorkers(self):
+        jobStore = FakeJobStore({"a": "alignments", "b": "constraints"}, self.tempDir)
+        fileStores = [FakeFileStore(jobStore, "worker%d" % i) for i in xrange(8)]
+        paths = {}
+        def read(i):
+            paths[i] = readGlobalFileShared(fileStores[i], "a")
+        threads = [Thread(target=read, args=(i,)) for i in xrange(len(fileStores))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(jobStore.reads, ["a"])
+        for i, fileStore in enumerate(fileStores):
+            self.assertEqual(os.path.dirname(paths[i]), fileStore.localTempDir)
+            self.assertEqual(open(paths[i]).read(), "alignments")
+
+        userPath = os.path.join(fileStores[0].localTempDir, "constraints")
+        self.assertEqual(readGlobalFileShared(fileStores[0], "b", userPath=userPath), userPath)
+        self.assertEqual(open(userPath).read(), "constraints")
+        self.assertEqual(jobStore.reads, ["a", "b"])
+
+        # Workers that start after the others have exited still get hits.
+        for fileStore in fileStores:
+            fileStore.exitWorker()
+        for i in xrange(2):
+            fileStore = FakeFileStore(jobStore, "laterWorker%d" % i)
+            self.assertEqual(open(readGlobalFileShared(fileStore, "a")).read(), "alignments")
+        self.assertEqual(jobStore.reads, ["a", "b"])
+
+    def testEviction(self):
+        os.environ["CACTUS_READ_CACHE_SIZE"] = "25"
+        jobStore = FakeJobStore({"a": "a" * 10, "b": "b" * 10, "c": "c" * 10}, self.tempDir)
+        fileStore = FakeFileStore(jobStore, "worker")
+        cacheDir = readCacheDir(fileStore)
+        def cached(fileID):
+            return os.path.exists(os.path.join(cacheDir, cacheEntryName(fileID)))
+        pathA = readGlobalFileShared(fileStore, "a")
+        readGlobalFileShared(fileStore, "b")
+        # Make "b" the least recently read.
+        os.utime(os.path.join(cacheDir, cacheEntryName("b")), (0, 0))
+        readGlobalFileShared(fileStore, "a")
+        readGlobalFileShared(fileStore, "c")
+        self.assertTrue(cached("a"))
+        self.assertFalse(cached("b"))
+        self.assertTrue(cached("c"))
+        # Evicted entries don't leave their lock files behind.
+        self.assertFalse(os.path.exists(os.path.join(cacheDir, cacheEntryName("b") + ".lock")))
+        self.assertTrue(os.path.exists(os.path.join(cacheDir, cacheEntryName("c") + ".lock")))
+        self.assertEqual(jobStore.reads, ["a", "b", "c"])
+        # Jobs keep their copies of evicted files.
+        os.utime(os.path.join(cacheDir, cacheEntryName("a")), (0, 0))
+        readGlobalFileShared(fileStore, "b")
+        self.assertFalse(cached("a"))
+        self.assertEqual(open(pathA).read(), "a" * 10)
+
+    def testDefaultSize(self):
+        os.environ.pop("CACTUS_READ_CACHE_SIZE", None)
+        jobStore = FakeJobStore({"a": "a" * 1000}, self.tempDir)
+        fileStore = FakeFileStore(jobStore, "worker")
+        cacheDir = readCacheDir(fileStore)
+        stat = os.statvfs(cacheDir)
+        freeSpace = stat.f_bavail * stat.f_frsize
+        self.assertTrue(abs(readCacheSize(cacheDir) - defaultReadCacheFraction * freeSpace) < 0.01 * freeSpace + 1000)
+        readGlobalFileShared(fileStore, "a")
+        self.assertTrue(os.path.exists(os.path.join(cacheDir, cacheEntryName("a"))))
+
+    def testDisabled(self):
+        os.environ["CACTUS_READ_CACHE_SIZE"] = "0"
+        jobStore = FakeJobStore({"a": "alignments"}, self.tempDir)
+        fileStore = FakeFileStore(jobStore, "worker")
+        readGlobalFileShared(fileStore, "a")
+        path = readGlobalFileShared(fileStore, "a")
+        self.assertEqual(open(path).read(), "alignments")
+        self.assertEqual(jobStore.reads, ["a", "a"])
+        workflowDir = Toil.getWorkflowDir(jobStore.config.workflowID, jobStore.config.workDir)
+        self.assertFalse(os.path.exists(os.path.join(workflowDir, "cactusReadCache")))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -25,6 +25,7 @@ from sonLib.bioio import cigarWrite, PairwiseAlignment, AlignmentOperation
 
 from cactus.shared.common import runCactusWorkflow
 from cactus.shared.common import runCactusCheck
+from cactus.shared.common import cactusRootPath
 
 from sonLib.bioio import TestStatus
 
@@ -34,6 +35,7 @@ from cactus.shared.common import runToilStats, runToilStatusAndFailIfNotComplete
 
 from cactus.shared.experimentWrapper import DbElemWrapper
 from cactus.shared.experimentWrapper import ExperimentWrapper
+from cactus.shared.configWrapper import ConfigWrapper
 
 def silentOnSuccess(fn):
     """
@@ -300,6 +302,18 @@ def getCactusInputs_chromosomeX(regionNumber=0, tempDir=None):
     newickTreeString = parseNewickTreeFile(os.path.join(chrXPath, "newickTree.txt"))
     return sequences, newickTreeString
 
+def getKtserverConfigForTest(configFile, outputDir, progressive=False):
+    """Write a copy of the config (or the default one) to outputDir that
+    never swaps the ktservers for a local DB, returning its path.
+    """
+    if configFile is None:
+        configFile = os.path.join(cactusRootPath(), "cactus_progressive_config.xml" if progressive else "cactus_config.xml")
+    configWrapper = ConfigWrapper(ET.parse(configFile).getroot())
+    configWrapper.setKtserverLocalDBMaxSequenceSize(0)
+    ktserverConfigFile = os.path.join(outputDir, "ktserverConfig.xml")
+    configWrapper.writeXML(ktserverConfigFile)
+    return ktserverConfigFile
+
 def runWorkflow_TestScript(sequences, newickTreeString, 
                            outputDir=None,
                            batchSystem="single_machine",
@@ -311,8 +325,11 @@ def runWorkflow_TestScript(sequences, newickTreeString,
                            buildToilStats=False,
                            constraints=None,
                            progressive=False,
-                           cactusWorkflowFunction=runCactusWorkflow):
-    """Runs the workflow and various downstream utilities.
+                           cactusWorkflowFunction=runCactusWorkflow,
+                           localDB=False):
+    """Runs the workflow and various downstream utilities. Unless localDB
+    is set, the workflow uses ktservers even for inputs small enough for
+    a local DB.
     """
     logger.info("Running cactus workflow test script")
     logger.info("Got the following sequence dirs/files: %s" % " ".join(sequences))
@@ -321,6 +338,9 @@ def runWorkflow_TestScript(sequences, newickTreeString,
     #Setup the output dir
     assert outputDir != None
     logger.info("Using the output dir: %s" % outputDir)
+
+    if not localDB:
+        configFile = getKtserverConfigForTest(configFile, outputDir, progressive)
     
     #Setup the flower disk.
     experiment = getCactusWorkflowExperimentForTest(sequences, newickTreeString, 
@@ -370,7 +390,8 @@ def runWorkflow_multipleExamples(inputGenFunction,
                                  cactusWorkflowFunction=runCactusWorkflow,
                                  buildHal=False,
                                  buildFasta=False,
-                                 progressive=False):
+                                 progressive=False,
+                                 localDB=False):
     """A wrapper to run a number of examples.
     """
     if (inverseTestRestrictions and TestStatus.getTestStatus() not in testRestrictions) or \
@@ -392,7 +413,8 @@ def runWorkflow_multipleExamples(inputGenFunction,
                                    buildToilStats=buildToilStats,
                                    constraints=constraints,
                                    progressive=progressive,
-                                   cactusWorkflowFunction=cactusWorkflowFunction)
+                                   cactusWorkflowFunction=cactusWorkflowFunction,
+                                   localDB=localDB)
             system("rm -rf %s" % tempDir)
             logger.info("Finished random test %i" % test)
 